@@ -5,11 +5,19 @@ import sys
 import os
 import string
 import random
+import asyncio
+import requests
 from dotenv import load_dotenv
 from duniterpy.key import SigningKey
 from pathlib import Path
 from lib.gva import GvaApi
 from lib.cesium import CesiumPlus
+from lib.nodeRanking import NodeRanking
+from lib.loadGen import LoadGenerator, DEFAULT_MIX
+from lib import hedge, resilience, traffic, jsonCodec, outbox, localCache
+from lib.profileCache import profileCache
+from lib.gvaIdentities import directory
+from lib.multiAccounts import MultiAccounts, MULTI_COMMANDS, expandKeyfiles
 
 __version__ = "0.1.1"
 
@@ -44,10 +52,41 @@ parser.add_argument(
     action="store_true",
     help="Display the current program version",
 )
-parser.add_argument("-k", "--key", help="Path to the keyfile (PubSec)")
+parser.add_argument(
+    "-k",
+    "--key",
+    action="append",
+    help="Path to the keyfile (PubSec), or a directory of keyfiles. Repeat it to run read, balance, history or stars for several accounts",
+)
 parser.add_argument(
     "-n", "--node", help="Address of the Cesium+, Gchange, or Duniter node to use"
 )
+parser.add_argument(
+    "--record", metavar="DIR", help="Record the Cesium+ and GVA exchanges into DIR"
+)
+parser.add_argument(
+    "--replay", metavar="DIR", help="Answer the requests with the exchanges recorded in DIR"
+)
+parser.add_argument(
+    "--replay-latencies",
+    action="store_true",
+    help="Replay the exchanges with their recorded latencies",
+)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Fetch the profiles and identities again instead of reading them from the local cache",
+)
+parser.add_argument(
+    "--queue",
+    action="store_true",
+    help="Store the signed documents of send, set, stars and setoffer in the outbox, for the flush command",
+)
+parser.add_argument(
+    "--hedge",
+    choices=["delay", "race"],
+    help="Hedge reads on a second node: after an adaptive delay, or racing both nodes",
+)
 
 # Define commands with arguments
 commands = {
@@ -61,6 +100,10 @@ commands = {
             },
             ("j", "json"): {"action": "store_true", "help": "Output in JSON format"},
             ("o", "outbox"): {"action": "store_true", "help": "Read sent messages"},
+            ("b", "both"): {
+                "action": "store_true",
+                "help": "Read received and sent messages in one request",
+            },
         },
         "type": "cesium",
     },
@@ -105,6 +148,10 @@ commands = {
                 "action": "store_true",
                 "help": "Also retrieve the avatar in raw base64 format",
             },
+            ("s", "stars"): {
+                "action": "store_true",
+                "help": "Also show the number of stars and the score of the profile",
+            },
         },
         "type": "cesium",
     },
@@ -145,6 +192,10 @@ commands = {
         "arguments": {
             ("p", "profile"): {"help": "Target profile"},
             ("n", "number"): {"type": int, "help": "Number of stars"},
+            ("s", "summary"): {
+                "action": "store_true",
+                "help": "Only show the number of stars and the score",
+            },
         },
         "type": "cesium",
     },
@@ -228,6 +279,92 @@ commands = {
                 "action": "store_true",
                 "help": "Display the result in black and white",
             },
+            ("f", "format"): {
+                "choices": ["csv", "ndjson", "columnar"],
+                "help": "Stream the history as CSV, NDJSON or JSON column batches (-n 0 for all)",
+            },
+        },
+        "type": "gva",
+    },
+    "historyStats": {
+        "help": "Totals in/out of a Ḡ1 account by day, month and counterparty",
+        "arguments": {
+            ("p", "pubkey"): {"help": "Public key of the target account"},
+            ("t", "top"): {
+                "type": int,
+                "default": 10,
+                "help": "Number of top counterparties to display",
+            },
+        },
+        "type": "gva",
+    },
+    "balanceSeries": {
+        "help": "Rebuild the balance of a Ḡ1 account over time from its full history",
+        "arguments": {
+            ("p", "pubkey"): {"help": "Public key of the target account"},
+            ("r", "resolution"): {
+                "choices": ["day", "hour"],
+                "default": "day",
+                "help": "Time step of the series",
+            },
+            ("a", "anchor"): {
+                "action": "store_true",
+                "help": "Shift the series so that it ends on the current balance (initial sources)",
+            },
+        },
+        "type": "gva",
+    },
+    "flows": {
+        "help": "Weighted graph of the flows between a set of Ḡ1 accounts",
+        "arguments": {
+            ("a", "accounts"): {
+                "nargs": "+",
+                "default": [],
+                "help": "Public keys of the accounts",
+            },
+            ("f", "file"): {"help": "File of public keys, one per line, '-' for stdin"},
+            ("i", "internal"): {
+                "action": "store_true",
+                "help": "Keep only the flows between the given accounts",
+            },
+            ("j", "jobs"): {
+                "type": int,
+                "default": 8,
+                "help": "Number of histories fetched concurrently",
+            },
+            ("d", "db"): {"help": "Read histories from this chain store (see syncBlocks)"},
+        },
+        "type": "gva",
+    },
+    "watch": {
+        "help": "Watch incoming payments and match them against open invoices (NDJSON events)",
+        "arguments": {
+            ("p", "pubkey"): {
+                "help": "Default receiving public key for invoices without one"
+            },
+            ("i", "invoices"): {
+                "required": True,
+                "help": "JSON/NDJSON file of invoices {id, pubkey, comment, amount, time}, '-' for stdin",
+            },
+            ("t", "interval"): {
+                "type": float,
+                "default": 5,
+                "help": "Seconds between two polls",
+            },
+            ("o", "once"): {
+                "action": "store_true",
+                "help": "Poll only once and exit",
+            },
+        },
+        "type": "gva",
+    },
+    "subscribe": {
+        "help": "Follow new blocks over WebSocket and refresh watched accounts (NDJSON events)",
+        "arguments": {
+            ("w", "watched"): {
+                "action": "append",
+                "help": "Public key of an account to watch (repeatable), default is yours",
+            },
         },
         "type": "gva",
     },
@@ -286,6 +423,118 @@ commands = {
         },
         "type": "gva",
     },
+    "crawl": {
+        "help": "Crawl the full histories of many accounts into partitioned gzip files (resumable)",
+        "arguments": {
+            ("i", "input"): {
+                "default": "-",
+                "help": "File of pubkeys, one per line ('-' for stdin)",
+            },
+            ("o", "output"): {"required": True, "help": "Output directory"},
+            ("f", "format"): {
+                "choices": ["csv", "ndjson"],
+                "default": "ndjson",
+                "help": "Format of the partition files",
+            },
+            ("j", "jobs"): {
+                "type": int,
+                "default": 8,
+                "help": "Number of concurrent requests",
+            },
+            ("s", "size"): {
+                "type": int,
+                "default": 1000,
+                "help": "Number of accounts per partition file",
+            },
+        },
+        "type": "gva",
+    },
+    "syncBlocks": {
+        "help": "Sync a range of blocks into the local chain store (resumable)",
+        "arguments": {
+            ("s", "start"): {
+                "type": int,
+                "default": 0,
+                "help": "First block number",
+            },
+            ("e", "end"): {
+                "type": int,
+                "help": "Last block number, current block by default",
+            },
+            ("j", "jobs"): {
+                "type": int,
+                "default": 4,
+                "help": "Number of concurrent requests",
+            },
+            ("b", "batch"): {
+                "type": int,
+                "default": 50,
+                "help": "Number of blocks per request",
+            },
+            ("d", "db"): {"help": "Path of the chain store (SQLite), chain-CURRENCY.sqlite in the cache by default"},
+        },
+        "type": "gva",
+    },
+    "load": {
+        "help": "Generate a load of jaklis requests on a pod and a GVA node, and report latencies",
+        "arguments": {
+            ("r", "rate"): {
+                "type": float,
+                "default": 50,
+                "help": "Target requests per second",
+            },
+            ("d", "duration"): {
+                "type": float,
+                "default": 10,
+                "help": "Seconds of load",
+            },
+            ("w", "workers"): {
+                "type": int,
+                "default": 32,
+                "help": "Number of concurrent requests",
+            },
+            ("m", "mix"): {
+                "default": DEFAULT_MIX,
+                "help": "Weights of the workloads: messages, profiles, stars, history, wallets, genTx",
+            },
+            ("a", "accounts"): {
+                "help": "File of pubkeys to query, the first wallets of the node by default",
+            },
+            ("g", "gva"): {"help": "GVA node to load"},
+            ("p", "pod"): {"help": "Cesium+ pod to load"},
+        },
+        "type": "network",
+    },
+    "flush": {
+        "help": "Send the signed Cesium+ documents waiting in the outbox (--queue)",
+        "arguments": {
+            ("j", "jobs"): {
+                "type": int,
+                "default": outbox.JOBS,
+                "help": "Number of documents sent at once",
+            },
+            ("b", "batch"): {
+                "type": int,
+                "default": outbox.BATCH,
+                "help": "Number of documents submitted by round",
+            },
+            ("w", "wait"): {
+                "action": "store_true",
+                "help": "Retry the failed documents until the outbox is empty",
+            },
+        },
+        "type": "outbox",
+    },
+    "nodes": {
+        "help": "Rank the known GVA nodes and Cesium+/Ḡchange pods by latency",
+        "arguments": {
+            ("r", "refresh"): {
+                "action": "store_true",
+                "help": "Discover and probe the nodes again, even if the ranking is recent",
+            },
+        },
+        "type": "network",
+    },
 }
 
 # Process commands and arguments
@@ -310,6 +559,64 @@ if not cmd:
     parser.print_help()
     sys.exit(0)
 
+# Caches keyed by node (metadata, UD timeline, breakers, identities) stay in
+# memory while recording or replaying: every exchange is recorded, and found
+# again by the replay on its new port
+if args.record or args.replay:
+    localCache.bypass()
+
+# Replayed exchanges are served by a local stand-in
+if args.replay:
+    replayUrl = traffic.startReplay(args.replay, args.replay_latencies)
+    node = replayUrl + "/gva"
+    pod = replayUrl
+    args.node = None
+
+# With NODE_SELECTION=auto and without -n, the fastest healthy up to date
+# node or pod of the ranking is used instead of the configured one
+if not args.node and not args.replay and (os.getenv("NODE_SELECTION") or "fixed") == "auto":
+    if commands[cmd]["type"] == "gva":
+        node = NodeRanking().bestNode(node)
+    elif commands[cmd]["type"] == "cesium":
+        pod = NodeRanking().bestPod(pod)
+
+# Signed writes wait in the outbox
+if args.queue:
+    outbox.enable()
+
+# Recorded and replayed traffic stays deterministic without hedging
+if args.record:
+    traffic.startRecording(args.record)
+hedge.configure(None if args.record or args.replay else args.hedge)
+# Recorded exchanges hold every profile lookup, none served by the cache
+if args.no_cache or args.record or args.replay:
+    profileCache.disable()
+    directory.disable()
+
+# Connections to the pod are opened while the keys load
+if commands[cmd]["type"] == "cesium" and not args.replay:
+    resilience.warmUp(pod)
+
+# Deadline of the whole command. Long running ones and the multi-page reads
+# (full history exports, stats, balance series, all the wallets or
+# geolocated profiles) have none, each of their requests keeps its timeout.
+LONG_COMMANDS = (
+    "watch",
+    "subscribe",
+    "crawl",
+    "syncBlocks",
+    "flows",
+    "nodes",
+    "load",
+    "flush",
+    "historyStats",
+    "balanceSeries",
+    "geolocProfiles",
+    "listWallets",
+)
+if cmd not in LONG_COMMANDS and not (cmd == "history" and (args.format or not args.number)):
+    resilience.startDeadline()
+
 
 def createTmpDunikey():
     # Generate a pseudo-random nonce
@@ -336,7 +643,7 @@ def get_arg_value(args, arg):
 
 def get_dunikey(args):
     if args.key:
-        return args.key
+        return args.key[0]
     dunikey = os.getenv("DUNIKEY")
     if not dunikey:
         keyPath = createTmpDunikey()
@@ -350,11 +657,49 @@ def get_dunikey(args):
     return dunikey
 
 
+def run_multi_accounts(args, cmd, keyfiles):
+    # Several accounts: one merged JSON report, tagged by keyfile and pubkey
+    if cmd not in MULTI_COMMANDS or (cmd == "stars" and args.number is not None):
+        sys.stderr.write(
+            "Several keyfiles are only supported by {0}.\n".format(
+                ", ".join(MULTI_COMMANDS)
+            )
+        )
+        sys.exit(1)
+
+    options = {
+        "read": lambda: {"number": args.number, "outbox": args.outbox},
+        "balance": lambda: {"useMempool": args.mempool},
+        "history": lambda: {"number": args.number},
+        "stars": lambda: {"profile": args.profile, "summary": args.summary},
+    }[cmd]()
+    # -n is the GVA node of balance and history, the pod of read and stars
+    isCesium = commands[cmd]["type"] == "cesium"
+    multi = MultiAccounts(
+        keyfiles,
+        node if isCesium else args.node or node,
+        args.node or pod if isCesium else pod,
+    )
+    print(jsonCodec.dumps(multi.run(cmd, **options), indent=2, ensure_ascii=False))
+
+
+if args.key and (len(args.key) > 1 or os.path.isdir(args.key[0])):
+    run_multi_accounts(args, cmd, expandKeyfiles(args.key))
+    sys.exit(0)
+
 pubkey = get_arg_value(args, "pubkey")
 profile = get_arg_value(args, "profile")
+# subscribe watches the accounts of -w, the first one stands for the key
+watched = get_arg_value(args, "watched")
+if watched and not pubkey:
+    pubkey = watched[0]
 
 noNeedDunikey = cmd in (
     "history",
+    "historyStats",
+    "balanceSeries",
+    "watch",
+    "subscribe",
     "balance",
     "page",
     "id",
@@ -422,7 +767,7 @@ def handle_cesium_commands(args, cmd, cesium):
         if args.number or args.number == 0:
             cesium.like(args.number, args.profile)
         else:
-            cesium.readLikes(args.profile)
+            cesium.readLikes(args.profile, args.summary)
     elif cmd == "unstars":
         cesium.unLike(args.profile)
 
@@ -450,7 +795,25 @@ def handle_gva_commands(args, cmd, gva):
     if cmd == "pay":
         gva.pay(args.amount, args.comment, args.mempool, args.verbose)
     elif cmd == "history":
-        gva.history(args.json, args.nocolors, args.number)
+        gva.history(args.json, args.nocolors, args.number, args.format)
+    elif cmd == "historyStats":
+        gva.historyStats(args.top)
+    elif cmd == "balanceSeries":
+        gva.balanceSeries(args.resolution, args.anchor)
+    elif cmd == "flows":
+        pubkeys = list(args.accounts)
+        if args.file:
+            f = sys.stdin if args.file == "-" else open(args.file, "r")
+            pubkeys += [line.split()[0] for line in f if line.strip()]
+        gva.flows(list(dict.fromkeys(pubkeys)), args.internal, args.jobs, args.db)
+    elif cmd == "crawl":
+        f = sys.stdin if args.input == "-" else open(args.input, "r")
+        pubkeys = (line.split()[0] for line in f if line.strip())
+        gva.crawl(pubkeys, args.output, args.format, args.jobs, args.size)
+    elif cmd == "watch":
+        gva.watch(args.invoices, args.interval, args.once)
+    elif cmd == "subscribe":
+        gva.subscribe(args.watched)
     elif cmd == "balance":
         gva.balance(args.mempool)
     elif cmd == "id":
@@ -461,17 +824,31 @@ def handle_gva_commands(args, cmd, gva):
         gva.currentUd()
     elif cmd == "listWallets":
         gva.listWallets(args.brut, args.mbr, args.non_mbr, args.larf)
+    elif cmd == "syncBlocks":
+        gva.syncBlocks(args.start, args.end, args.jobs, args.batch, args.db)
     else:
         raise ValueError(f"Unknown command: {cmd}")
 
 
+def run_command(handler, *handler_args):
+    # Unreachable nodes and exceeded deadlines end the command with a message
+    try:
+        handler(*handler_args)
+    except (resilience.DeadlineExceeded, requests.RequestException) as e:
+        sys.stderr.write("Echec de la commande:\n" + str(e) + "\n")
+        if keyPath:
+            os.remove(keyPath)
+        sys.exit(1)
+
+
 # Construct the CesiumPlus object
 if commands[cmd]["type"] == "cesium":
     if args.node:
         pod = args.node
 
-    cesium = CesiumPlus(dunikey, pod, noNeedDunikey)
-    handle_cesium_commands(args, cmd, cesium)
+    # The GVA node resolves the usernames shown by read and stars
+    cesium = CesiumPlus(dunikey, pod, noNeedDunikey, node)
+    run_command(handle_cesium_commands, args, cmd, cesium)
 
 # Construct the GvaApi object
 elif commands[cmd]["type"] == "gva":
@@ -482,7 +859,32 @@ elif commands[cmd]["type"] == "gva":
         destPubkey = args.pubkey
 
     gva = GvaApi(dunikey, node, destPubkey, noNeedDunikey)
-    handle_gva_commands(args, cmd, gva)
+    run_command(handle_gva_commands, args, cmd, gva)
+
+# Load a pod and a node
+elif cmd == "load":
+    accounts = None
+    if args.accounts:
+        with open(args.accounts, "r") as f:
+            accounts = [line.split()[0] for line in f if line.strip()]
+    load = LoadGenerator(
+        args.gva or node, args.pod or pod, args.rate, args.duration, args.workers, args.mix, accounts
+    )
+    print(jsonCodec.dumps(asyncio.run(load.run()), indent=2))
+
+# Send the documents of the outbox
+elif cmd == "flush":
+    report = outbox.Outbox().flush(args.jobs, args.batch, args.wait)
+    print(jsonCodec.dumps(report, indent=2))
+
+# Rank the nodes
+elif commands[cmd]["type"] == "network":
+    if args.node and args.node.endswith("/gva"):
+        node = args.node
+    elif args.node:
+        pod = args.node
+    ranking = NodeRanking().get([node], [pod], args.refresh)
+    print(jsonCodec.dumps(ranking, indent=2))
 else:
     raise ValueError(f"Unknown command: {cmd}")
 
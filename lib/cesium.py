@@ -1,4 +1,4 @@
-import json
+import asyncio
 import re, string, random, base64
 from lib.cesiumCommon import CesiumCommon, PUBKEY_REGEX
 from lib.geolocProfiles import GeolocProfiles
@@ -7,19 +7,40 @@ from lib.messaging import ReadFromCesium, SendToCesium, DeleteFromCesium
 from lib.profiles import Profiles
 from lib.stars import ReadLikes, SendLikes, UnLikes
 from lib.offers import Offers
+from lib.cesiumAsync import AsyncCesium
+from lib import jsonCodec, esQuery
 
 
 class CesiumPlus(CesiumCommon):
     #################### Messaging ####################
 
-    def read(self, nbrMsg, isJSON, outbox):
-        readCesium = ReadFromCesium(self.dunikey, self.pod)
+    def read(self, nbrMsg, isJSON, outbox, both=False):
+        readCesium = ReadFromCesium(self.dunikey, self.pod, node=self.node)
+        if both:
+            return self.readBoxes(readCesium, nbrMsg, isJSON)
         jsonMsg = readCesium.sendDocument(nbrMsg, outbox)
+        usernames = readCesium.usernames((jsonMsg, outbox))
         if isJSON:
-            jsonFormat = readCesium.jsonMessages(jsonMsg, nbrMsg, outbox)
+            jsonFormat = readCesium.jsonMessages(jsonMsg, nbrMsg, outbox, usernames)
             print(jsonFormat)
         else:
-            readCesium.readMessages(jsonMsg, nbrMsg, outbox)
+            readCesium.readMessages(jsonMsg, nbrMsg, outbox, usernames)
+
+    def readBoxes(self, readCesium, nbrMsg, isJSON):
+        inbox, outbox = readCesium.sendBoxes(nbrMsg)
+        usernames = readCesium.usernames((inbox, False), (outbox, True))
+        if isJSON:
+            boxes = {}
+            for boxType, hits in (("inbox", inbox), ("outbox", outbox)):
+                if hits and hits["total"]:
+                    boxes[boxType] = jsonCodec.loads(readCesium.jsonMessages(hits, nbrMsg, boxType == "outbox", usernames))
+                else:
+                    boxes[boxType] = []
+            print(jsonCodec.dumps(boxes, indent=2))
+        else:
+            for hits, isOutbox in ((inbox, False), (outbox, True)):
+                if hits:
+                    readCesium.readMessages(hits, nbrMsg, isOutbox, usernames)
 
     def send(self, title, msg, recipient, outbox):
         sendCesium = SendToCesium(self.dunikey, self.pod)
@@ -37,12 +58,19 @@ class CesiumPlus(CesiumCommon):
         sendCesium.sendDocument(finalDoc, outbox)  # Send final signed document
 
     def delete(self, idsMsgList, outbox):
+        if len(idsMsgList) > 1:
+            # Several messages are deleted at once
+            return asyncio.run(self.deleteMany(idsMsgList, outbox))
         deleteCesium = DeleteFromCesium(self.dunikey, self.pod)
         # deleteCesium.issuer = recipient
         for idMsg in idsMsgList:
             finalDoc = deleteCesium.configDoc(idMsg, outbox)
             deleteCesium.sendDocument(finalDoc, idMsg)
 
+    async def deleteMany(self, idsMsgList, outbox):
+        async with AsyncCesium(self.dunikey, self.pod) as cesium:
+            return await cesium.deleteMany(idsMsgList, outbox)
+
     #################### Profiles ####################
 
     def set(
@@ -64,7 +92,7 @@ class CesiumPlus(CesiumCommon):
         print(result)
         return result
 
-    def get(self, profile=None, avatar=None):
+    def get(self, profile=None, avatar=None, stars=False):
         getProfile = Profiles(self.dunikey, self.pod, self.noNeedDunikey)
         if not profile:
             profile = self.pubkey
@@ -73,11 +101,35 @@ class CesiumPlus(CesiumCommon):
         else:
             scope = "_id"
 
-        document = getProfile.configDocGet(profile, scope, avatar)
-        resultJSON = getProfile.sendDocument(document, "get")
-        result = getProfile.parseJSON(resultJSON)
+        if stars:
+            document = getProfile.configDocGet(profile, scope, avatar)
+            return self.getWithStars(getProfile, profile, scope, document)
+        result = getProfile.readProfile(profile, scope, avatar)
+        if result:
+            print(getProfile.parseJSON(result))
 
-        print(result)
+    def getWithStars(self, getProfile, profile, scope, document):
+        likes = ReadLikes(self.dunikey, self.pod, self.noNeedDunikey)
+        if scope == "_id":
+            # Profile and stars in one round trip
+            profileResult, score = getProfile.multiSearch(
+                [(esQuery.PROFILES, document), (esQuery.LIKES, likes.configDocScore(profile))],
+                esQuery.FIRST_HITS,
+                esQuery.SCORE,
+            )
+            result = profileResult and getProfile.parseProfile(profileResult)
+        else:
+            # The stars need the pubkey of the profile found by its title
+            resultJSON = getProfile.sendDocument(document, "get")
+            result = resultJSON and getProfile.parseProfile(jsonCodec.loads(resultJSON))
+            score = result and likes.sendDocument(likes.configDocScore(result["pubkey"]))
+            score = score and jsonCodec.loads(score)
+        if not result:
+            print("Profile vide")
+            return
+        if score:
+            result["stars"] = likes.parseScore(score)
+        print(jsonCodec.dumps(result, indent=2))
 
     def getPage(self, page=None, avatar=None):
         getPage = Pages(self.dunikey, self.pod, self.noNeedDunikey)
@@ -105,14 +157,20 @@ class CesiumPlus(CesiumCommon):
         geolocProfiles = GeolocProfiles(self.dunikey, self.pod)
         cesiumProfiles = geolocProfiles.getCesiumProfiles()
         gvaProfiles = geolocProfiles.getGVAProfiles(node)
-        result = geolocProfiles.formatProfiles(cesiumProfiles, json.loads(gvaProfiles))
+        result = geolocProfiles.formatProfiles(cesiumProfiles, jsonCodec.loads(gvaProfiles))
 
-        print(json.dumps(result))
+        print(jsonCodec.dumps(result))
 
     #################### Likes ####################
 
-    def readLikes(self, profile=False):
-        likes = ReadLikes(self.dunikey, self.pod, self.noNeedDunikey)
+    def readLikes(self, profile=False, summary=False):
+        likes = ReadLikes(self.dunikey, self.pod, self.noNeedDunikey, self.node)
+        if summary:
+            # Number of stars and score only, computed by the pod
+            result = likes.sendDocument(likes.configDocScore(profile))
+            if result:
+                print(jsonCodec.dumps(likes.parseScore(jsonCodec.loads(result))))
+            return
         document = likes.configDoc(profile)
         result = likes.sendDocument(document)
         result = likes.parseResult(result)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+
+# Async Cesium+ client: the operations of CesiumPlus on one aiohttp session,
+# so that many of them run overlapped in one process.
+#   async with AsyncCesium(dunikey, pod) as cesium:
+#       await cesium.deleteMany(ids, outbox)
+#       profiles = await cesium.getProfiles(pubkeys)
+
+import sys, re, json, time, random, string, base64, asyncio
+import aiohttp, requests
+from lib.cesiumCommon import PUBKEY_REGEX
+from lib.messaging import ReadFromCesium, SendToCesium, DeleteFromCesium
+from lib.profiles import Profiles
+from lib.getPages import Pages
+from lib.stars import ReadLikes, SendLikes, UnLikes, PROFILES_CHUNK
+from lib.offers import Offers
+from lib.geolocProfiles import GeolocProfiles, GEOLOC_POD
+from lib.hedge import HttpResponse
+from lib.profileCache import profileCache, FIELDS as PROFILE_FIELDS
+from lib import resilience, esQuery, jsonCodec
+
+# Requests running at once on the pod
+CONCURRENCY = resilience.POOL_SIZE
+HEADERS = {"Content-type": "application/json"}
+
+
+async def gatherBounded(coroutines, limit=CONCURRENCY):
+    # Results in the order of the coroutines, at most limit of them running
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+
+def scope(profile):
+    return "_id" if re.match(PUBKEY_REGEX, profile) and len(profile) <= 45 else "title"
+
+
+class AsyncCesium:
+    def __init__(self, dunikey, pod, noNeedDunikey=False, concurrency=CONCURRENCY):
+        self.dunikey = dunikey
+        self.pod = pod
+        self.noNeedDunikey = noNeedDunikey
+        self.concurrency = concurrency
+        self.session = None
+        # Documents are built and signed by the blocking classes
+        self.reader = ReadFromCesium(dunikey, pod, noNeedDunikey)
+        self.pubkey = self.reader.pubkey
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, headers={**HEADERS, **resilience.COMPRESSION})
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def documents(self, cls):
+        return cls(self.dunikey, self.pod, self.noNeedDunikey)
+
+    async def request(self, method, path, idempotent=False, base=None, **kwargs):
+        # Same timeouts, retries and circuit breakers as resilience.request,
+        # without rerouting: the ranking of the pods is blocking
+        base = base or self.pod
+        if resilience.breakers.isOpen(base):
+            raise resilience.unreachable(base, None)
+        lastError = None
+        for attempt in range(resilience.RETRIES if idempotent else 1):
+            start = time.monotonic()
+            timeout = aiohttp.ClientTimeout(total=resilience.timeout())
+            try:
+                async with self.session.request(method, base + path, timeout=timeout, **kwargs) as response:
+                    result = HttpResponse(response.status, await response.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                resilience.recordHttp(method, base + path, kwargs, start, error=e)
+                resilience.breakers.failure(base)
+                lastError = requests.ConnectionError(str(e) or type(e).__name__)
+            else:
+                resilience.recordHttp(method, base + path, kwargs, start, result)
+                if result.status_code not in resilience.RETRY_STATUS:
+                    resilience.breakers.success(base)
+                    return result
+                resilience.breakers.failure(base)
+                lastError = requests.HTTPError(str(result.status_code))
+            if resilience.breakers.isOpen(base):
+                break
+            if attempt < resilience.RETRIES - 1:
+                await asyncio.sleep(random.uniform(0, resilience.RETRY_BACKOFF * 2**attempt))
+        raise lastError
+
+    async def search(self, path, document):
+        result = await self.request("POST", path, idempotent=True, data=document)
+        if result.status_code == 200:
+            return result.json()
+        sys.stderr.write("Echec de l'envoi du document...\n" + result.text + "\n")
+
+    async def multiSearch(self, searches, *filterPaths):
+        # Searches in one round trip (_msearch), None for the failed ones
+        result = await self.request(
+            "POST",
+            esQuery.msearchPath(*filterPaths),
+            idempotent=True,
+            data=esQuery.msearchBody(searches),
+            headers={"Content-type": "application/x-ndjson"},
+        )
+        if result.status_code != 200:
+            sys.stderr.write("Echec de la recherche multiple...\n" + result.text + "\n")
+            return [None] * len(searches)
+        return [None if "error" in answer else answer for answer in result.json().get("responses", [])]
+
+    async def write(self, path, document):
+        result = await self.request("POST", path, data=document)
+        if result.status_code == 200:
+            return result.text
+        sys.stderr.write("Echec de l'envoi du document...\n" + result.text + "\n")
+
+    #################### Messaging ####################
+
+    async def read(self, nbrMsg=10, outbox=False):
+        result = await self.search(self.reader.searchPath(outbox), self.reader.configDoc(nbrMsg, outbox))
+        return result and self.reader.boxHits(result)
+
+    async def readBoxes(self, nbrMsg=10):
+        # Inbox and outbox in one round trip
+        answers = await self.multiSearch(
+            [
+                (esQuery.MESSAGES.format("inbox"), self.reader.configDoc(nbrMsg, False)),
+                (esQuery.MESSAGES.format("outbox"), self.reader.configDoc(nbrMsg, True)),
+            ],
+            esQuery.HITS,
+        )
+        return [self.reader.boxHits(answer) if answer else None for answer in answers]
+
+    async def send(self, title, msg, recipient, outbox=False):
+        sendCesium = self.documents(SendToCesium)
+        sendCesium.recipient = recipient
+        nonce = [random.choice(string.ascii_letters + string.digits) for _ in range(32)]
+        sendCesium.nonce = base64.b64decode("".join(nonce))
+        document = sendCesium.configDoc(sendCesium.encryptMsg(title), sendCesium.encryptMsg(msg))
+        boxType = "outbox" if outbox else "inbox"
+        return await self.write("/message/{0}?pubkey={1}".format(boxType, recipient), document)
+
+    async def delete(self, idMsg, outbox=False, deleteCesium=None):
+        deleteCesium = deleteCesium or self.documents(DeleteFromCesium)
+        document = deleteCesium.configDoc(idMsg, outbox)
+        try:
+            result = await self.request("POST", "/history/delete", data=document)
+        except Exception as e:
+            return deleteCesium.failed(idMsg, e)
+        return deleteCesium.checkResult(result, idMsg)
+
+    async def deleteMany(self, idsMsgList, outbox=False):
+        deleteCesium = self.documents(DeleteFromCesium)
+        return await gatherBounded(
+            (self.delete(idMsg, outbox, deleteCesium) for idMsg in idsMsgList), self.concurrency
+        )
+
+    #################### Profiles and pages ####################
+
+    async def getProfile(self, profile=None, avatar=None, cls=Profiles):
+        # Profiles share the cache of Profiles.readProfile, pages and avatars
+        # are always fetched
+        profile = profile or self.pubkey
+        documents = self.documents(cls)
+        cached = cls is Profiles and not avatar
+        if cached:
+            fields = documents.getFields(avatar)
+            if scope(profile) == "_id":
+                source, found = profileCache.get(self.pod, profile, fields)
+                if found:
+                    return source and {"pubkey": profile, **source}
+        document = documents.configDocGet(profile, scope(profile), avatar)
+        result = await self.search(esQuery.searchPath(esQuery.PROFILES, esQuery.FIRST_HITS), document)
+        if result is None:
+            return
+        hits = esQuery.hits(result)
+        if cached and hits:
+            profileCache.put(self.pod, hits[0]["_id"], hits[0]["_source"], fields)
+        elif cached and scope(profile) == "_id":
+            profileCache.put(self.pod, profile, None, fields)
+        if hits:
+            return {"pubkey": hits[0]["_id"], **hits[0]["_source"]}
+
+    async def getProfiles(self, profiles, avatar=None):
+        return await gatherBounded(
+            (self.getProfile(profile, avatar) for profile in profiles), self.concurrency
+        )
+
+    async def getPage(self, page=None, avatar=None):
+        return await self.getProfile(page, avatar, Pages)
+
+    async def setProfile(self, name=None, description=None, ville=None, adresse=None, position=None, site=None, avatar=None):
+        document = self.documents(Profiles).configDocSet(name, description, ville, adresse, position, site, avatar)
+        profileCache.forget(self.pod, self.pubkey)
+        return await self.write("/user/profile?pubkey={0}/_update?pubkey={0}".format(self.pubkey), document)
+
+    async def erase(self):
+        profileCache.forget(self.pod, self.pubkey)
+        return await self.write("/history/delete", self.documents(Profiles).configDocErase())
+
+    async def geolocProfiles(self, node, slices=4):
+        # The GVA wallets are listed in a thread while the profiles scroll
+        geoloc = self.documents(GeolocProfiles)
+        gvaProfiles, cesiumProfiles = await asyncio.gather(
+            asyncio.to_thread(geoloc.getGVAProfiles, node),
+            self.scrollProfiles(slices),
+        )
+        return geoloc.formatProfiles(cesiumProfiles, jsonCodec.loads(gvaProfiles))
+
+    async def scrollProfiles(self, slices=4):
+        # Sliced scroll: each slice of the index scrolls on its own, all at once
+        geoloc = self.documents(GeolocProfiles)
+        cached = geoloc.cachedProfiles()
+        if cached is not None:
+            return cached
+        pages = await asyncio.gather(
+            *(self.scrollSlice(geoloc.configDoc(), i, slices) for i in range(slices))
+        )
+        hits = [hit for page in pages for hit in page]
+        geoloc.cacheProfiles(hits)
+        return hits
+
+    async def scrollSlice(self, document, sliceId, slices):
+        if slices > 1:
+            document = {**document, "slice": {"id": sliceId, "max": slices}}
+        path = esQuery.searchPath(esQuery.USER_PROFILES, esQuery.SCROLL, scroll="2m")
+        result = await self.request("POST", path, True, GEOLOC_POD, json=document)
+        result = result.json()
+        scrollId = result["_scroll_id"]
+        hits = esQuery.hits(result)
+        try:
+            while True:
+                page = await self.request(
+                    "POST",
+                    esQuery.searchPath("/_search/scroll", esQuery.SCROLL),
+                    True,
+                    GEOLOC_POD,
+                    json={"scroll_id": scrollId, "scroll": "2m"},
+                )
+                page = page.json()
+                if "error" in page or not esQuery.hits(page):
+                    return hits
+                hits.extend(esQuery.hits(page))
+        finally:
+            await self.request("DELETE", "/_search/scroll", False, GEOLOC_POD, json={"scroll_id": [scrollId]})
+
+    #################### Likes ####################
+
+    async def readLikes(self, profile=None, summary=False):
+        # Likes of a profile, or only their number and score
+        readLikes = self.documents(ReadLikes)
+        if summary:
+            result = await self.search(
+                esQuery.searchPath(esQuery.LIKES, esQuery.SCORE), readLikes.configDocScore(profile)
+            )
+            return result and readLikes.parseScore(result)
+        result = await self.search(
+            esQuery.searchPath(esQuery.LIKES, esQuery.SCORED_HITS), readLikes.configDoc(profile)
+        )
+        if not result:
+            return
+        profiles = await self.getLikers([hit["_source"]["issuer"] for hit in esQuery.hits(result)])
+        return readLikes.parseLikes(result, profiles)
+
+    async def getLikers(self, issuers):
+        # Profiles of the likers, the cached ones first, chunks of _mget
+        # requests at once for the others
+        cached, issuers = profileCache.getMany(self.pod, issuers)
+        path = esQuery.searchPath(esQuery.PROFILES_MGET, esQuery.DOCS, _source=",".join(PROFILE_FIELDS))
+        chunks = [issuers[i : i + PROFILES_CHUNK] for i in range(0, len(issuers), PROFILES_CHUNK)]
+        results = await gatherBounded(
+            (self.search(path, json.dumps({"ids": chunk})) for chunk in chunks), self.concurrency
+        )
+        readLikes = self.documents(ReadLikes)
+        fetched = {}
+        for chunk, result in zip(chunks, results):
+            if result:
+                fetched.update(dict.fromkeys(chunk))
+                fetched.update(readLikes.parseProfiles(result))
+        if fetched:
+            profileCache.putMany(self.pod, fetched)
+        return {issuer: profile for issuer, profile in {**cached, **fetched}.items() if profile}
+
+    async def like(self, stars, profile=None):
+        document = self.documents(SendLikes).configDoc(profile, stars)
+        if document:
+            return await self.write("/user/profile/:id/_like", document)
+
+    async def unLike(self, pubkey):
+        readLikes = self.documents(ReadLikes)
+        result = await self.search(
+            esQuery.searchPath(esQuery.LIKES, esQuery.FIRST_HITS), readLikes.configDoc(pubkey, self.pubkey)
+        )
+        hits = result and esQuery.hits(result)
+        if not hits:
+            sys.stderr.write("Vous n'avez pas liké ce profile\n")
+            return False
+        document = self.documents(UnLikes).configDoc(hits[0]["_id"])
+        return await self.write("/history/delete", document)
+
+    #################### Offers ####################
+
+    async def getOfferText(self, id):
+        result = await self.request("GET", self.documents(Offers).getPath(id), idempotent=True)
+        if result.status_code == 200:
+            return result.text
+        sys.stderr.write("Echec de l'envoi du document...\n" + result.text + "\n")
+
+    async def getOffer(self, id):
+        result = await self.getOfferText(id)
+        return result and jsonCodec.loads(result)["_source"]
+
+    async def getOffers(self, ids):
+        return await gatherBounded((self.getOffer(id) for id in ids), self.concurrency)
+
+    async def setOffer(self, title=None, description=None, city=None, location=None, category=None, price=None, picture=None):
+        document = self.documents(Offers).configDocSet(title, description, city, location, category, price, picture)
+        return await self.write("/market/record", document)
+
+    async def deleteOffer(self, id):
+        offer = await self.getOfferText(id)
+        if offer:
+            document = self.documents(Offers).configDocErase(id, offer)
+            return await self.write("/market/record/{0}/_update".format(id), document)
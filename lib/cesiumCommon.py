@@ -1,6 +1,8 @@
 import sys, re, json
 from hashlib import sha256
 from lib.natools import fmt, sign, get_privkey
+from lib.hedge import readPost
+from lib import esQuery, outbox
 
 PUBKEY_REGEX = "(?![OIl])[1-9A-Za-z]{42,45}"
 
@@ -13,8 +15,10 @@ def pp_json(json_thing, sort=True, indents=4):
     return None
 
 class CesiumCommon:
-    def __init__(self, dunikey, pod, noNeedDunikey=False):
+    def __init__(self, dunikey, pod, noNeedDunikey=False, node=None):
         self.pod = pod
+        # GVA node resolving the usernames, if any
+        self.node = node
         self.noNeedDunikey = noNeedDunikey
         # Get my pubkey from my private key
         try:
@@ -34,6 +38,30 @@ class CesiumCommon:
             sys.stderr.write("La clé publique n'est pas au bon format.\n")
             sys.exit(1)
 
+    def multiSearch(self, searches, *filterPaths):
+        # Independent searches in one round trip (_msearch), answers in the
+        # order of the searches, None for the failed ones
+        headers = {
+            'Content-type': 'application/x-ndjson',
+        }
+        result = readPost(self.pod, esQuery.msearchPath(*filterPaths), headers=headers, data=esQuery.msearchBody(searches))
+        if result.status_code != 200:
+            sys.stderr.write("Echec de la recherche multiple...\n" + result.text + '\n')
+            return [None] * len(searches)
+        answers = result.json().get('responses', [])
+        for answer in answers:
+            if 'error' in answer:
+                sys.stderr.write("Echec d'une recherche:\n" + json.dumps(answer['error']) + '\n')
+        return [None if 'error' in answer else answer for answer in answers]
+
+    def queue(self, path, document):
+        # With --queue, the signed document waits in the outbox for
+        # "jaklis flush": the message to display, None when sent right away
+        if not outbox.queueing():
+            return None
+        name = outbox.Outbox().put(self.pod, path, document)
+        return "Document mis en file d'attente: " + name
+
     def signDoc(self, document):
         # Generate hash of document
         hashDoc = sha256(document.encode()).hexdigest().upper()
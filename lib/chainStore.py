@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import sys, sqlite3
+from lib.localCache import cachePath
+from lib.gvaBlocks import outputPubkey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    number INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    issuer TEXT NOT NULL,
+    medianTime INTEGER NOT NULL,
+    dividend INTEGER,
+    unitBase INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS txs (
+    hash TEXT PRIMARY KEY,
+    number INTEGER NOT NULL,
+    issuer TEXT NOT NULL,
+    comment TEXT
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    txHash TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    base INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocksDividend ON blocks (dividend) WHERE dividend IS NOT NULL;
+CREATE INDEX IF NOT EXISTS txsNumber ON txs (number);
+CREATE INDEX IF NOT EXISTS txsIssuer ON txs (issuer);
+CREATE INDEX IF NOT EXISTS outputsTx ON outputs (txHash);
+CREATE INDEX IF NOT EXISTS outputsRecipient ON outputs (recipient);
+"""
+
+
+class ChainStore:
+    def __init__(self, path=None, currency=None):
+        # One store by currency, the blocks of g1 and g1-test never mix
+        self.path = path or cachePath("chain-{0}.sqlite".format(currency))
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+        if currency:
+            self.checkCurrency(currency)
+
+    def checkCurrency(self, currency):
+        # The first sync sets the currency of the store
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO meta VALUES ('currency', ?)", (currency,))
+        stored = self.db.execute("SELECT value FROM meta WHERE key = 'currency'").fetchone()[0]
+        if stored != currency:
+            sys.stderr.write(
+                "{0} contient les blocs de la monnaie {1}, pas {2}.\n".format(self.path, stored, currency)
+            )
+            sys.exit(1)
+
+    def missingNumbers(self, start, end):
+        # Block numbers of [start, end] not stored yet, used to resume a sync
+        known = {
+            row[0]
+            for row in self.db.execute(
+                "SELECT number FROM blocks WHERE number BETWEEN ? AND ?", (start, end)
+            )
+        }
+        return [number for number in range(start, end + 1) if number not in known]
+
+    def addBlocks(self, blocks):
+        # One transaction per batch, so an interrupted sync keeps whole blocks only
+        with self.db:
+            for block in blocks:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        block["number"],
+                        block["hash"],
+                        block["issuer"],
+                        block["medianTime"],
+                        block["dividend"],
+                        block["unitBase"],
+                    ),
+                )
+                for transaction in block.get("transactions") or []:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO txs VALUES (?, ?, ?, ?)",
+                        (
+                            transaction["hash"],
+                            block["number"],
+                            transaction["issuers"][0],
+                            transaction["comment"],
+                        ),
+                    )
+                    self.db.execute(
+                        "DELETE FROM outputs WHERE txHash = ?", (transaction["hash"],)
+                    )
+                    self.db.executemany(
+                        "INSERT INTO outputs VALUES (?, ?, ?, ?)",
+                        [
+                            (
+                                transaction["hash"],
+                                outputPubkey(output) or output.split(":", 2)[2],
+                                int(output.split(":")[0]),
+                                int(output.split(":")[1]),
+                            )
+                            for output in transaction["outputs"]
+                        ],
+                    )
+
+    def head(self):
+        return self.db.execute("SELECT MAX(number) FROM blocks").fetchone()[0]
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def udEvents(self, start=0, end=None):
+        # (number, medianTime, dividend, unitBase) of every UD block of the range
+        return self.db.execute(
+            """SELECT number, medianTime, dividend, unitBase FROM blocks
+               WHERE dividend IS NOT NULL AND number >= ? AND number <= ?
+               ORDER BY number""",
+            (start, end if end is not None else self.head() or 0),
+        ).fetchall()
+
+    def transactionsOf(self, pubkey):
+        # Every stored transaction issued or received by pubkey, oldest first
+        return self.db.execute(
+            """SELECT txs.number, blocks.medianTime, txs.hash, txs.issuer, txs.comment,
+                      outputs.recipient, outputs.amount, outputs.base
+               FROM txs
+               JOIN blocks ON blocks.number = txs.number
+               JOIN outputs ON outputs.txHash = txs.hash
+               WHERE txs.hash IN (
+                   SELECT hash FROM txs WHERE issuer = ?
+                   UNION SELECT txHash FROM outputs WHERE recipient = ?
+               )
+               ORDER BY txs.number""",
+            (pubkey, pubkey),
+        ).fetchall()
+
+    def close(self):
+        self.db.close()
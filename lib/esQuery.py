@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Elasticsearch searches of the Cesium+ pods, asking only for what the
+# parsers read: the fewest hits, the fields they use (_source) and the parts
+# of the answer the pod sends back (filter_path).
+# With filter_path, the pod leaves out "hits" when nothing matched.
+
+import json
+
+# Paths of the searches
+MESSAGES = "/message/{0}/_search"
+PROFILES = "/user,page,group/profile,record/_search"
+USER_PROFILES = "/user/profile/_search"
+LIKES = "/like/record/_search"
+PROFILES_MGET = "/user/profile/_mget"
+
+# Parts of the answers kept by the pod
+HITS = "hits.total,hits.hits._id,hits.hits._source"
+SCORED_HITS = HITS + ",aggregations"
+SCORE = "hits.total,aggregations"
+FIRST_HITS = "hits.hits._id,hits.hits._source"
+SCROLL = "_scroll_id,hits.hits._id,hits.hits._source"
+DOCS = "docs._id,docs._source"
+
+
+def searchPath(path, filterPath, **params):
+    params["filter_path"] = filterPath
+    query = "&".join("{0}={1}".format(key, value) for key, value in params.items())
+    return path + ("&" if "?" in path else "?") + query
+
+
+def msearchPath(*filterPaths):
+    # Parts kept in each answer of a multi-search, and its errors
+    paths = dict.fromkeys(
+        "responses." + path for filterPath in filterPaths for path in filterPath.split(",")
+    )
+    return searchPath("/_msearch", ",".join(list(paths) + ["responses.error"]))
+
+
+def msearchBody(searches):
+    # Newline delimited header and body of each (path, document) search
+    lines = []
+    for path, document in searches:
+        index, type = path.strip("/").split("/")[:2]
+        if not isinstance(document, str):
+            document = json.dumps(document)
+        lines += [json.dumps({"index": index, "type": type}), document]
+    return "\n".join(lines) + "\n"
+
+
+def hits(result):
+    return result.get("hits", {}).get("hits", [])
+
+
+def terms(*pairs):
+    return [{"term": {field: value}} for field, value in pairs]
+
+
+def filtered(*pairs):
+    # Exact matches only, without scoring
+    return {"bool": {"filter": terms(*pairs)}}
+
+
+def search(query, size, source=None, sort=None, aggs=None, **extra):
+    data = {"query": query, "size": size}
+    if source is not None:
+        data["_source"] = source
+    if sort:
+        data["sort"] = sort
+    if aggs:
+        data["aggs"] = aggs
+    data.update(extra)
+    return data
+
+
+def profileSearch(profile, scope, source):
+    # First hit only: a pubkey is an exact _id, a title is searched by
+    # relevance, users before pages and groups
+    if scope == "_id":
+        return search(filtered(("_id", profile)), 1, source)
+    query = {
+        "bool": {
+            "should": [
+                {"match": {scope: {"query": profile, "boost": 2}}},
+                {"prefix": {scope: profile}},
+            ]
+        }
+    }
+    return search(query, 1, source, indices_boost={"user": 100, "page": 1, "group": 0.01})
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ThreadPoolExecutor
+from lib.gvaHistory import History
+from lib.gvaBlocks import outputPubkey
+
+
+class FlowGraph:
+    def __init__(self):
+        self.seen = set()
+        # (issuer, recipient) -> [amount in cents, number of transactions]
+        self.edges = {}
+        self.successors = {}
+
+    def addOutput(self, issuer, recipient, amount):
+        if recipient == issuer:
+            return
+        edge = self.edges.get((issuer, recipient))
+        if edge is None:
+            edge = self.edges[(issuer, recipient)] = [0, 0]
+            self.successors.setdefault(issuer, []).append(recipient)
+            self.successors.setdefault(recipient, [])
+        edge[0] += amount
+        edge[1] += 1
+
+    def addTransaction(self, txHash, issuer, outputs):
+        # Transactions are shared by both accounts, they are counted once
+        if txHash in self.seen:
+            return
+        self.seen.add(txHash)
+        for output in outputs:
+            amount, base, condition = output.split(":", 2)
+            recipient = outputPubkey(output)
+            if recipient:
+                self.addOutput(issuer, recipient, int(amount) * pow(10, int(base)))
+
+    def restrict(self, pubkeys):
+        # Keep only the flows between the given accounts
+        pubkeys = set(pubkeys)
+        graph = FlowGraph()
+        graph.seen = self.seen
+        for (issuer, recipient), (amount, count) in self.edges.items():
+            if issuer in pubkeys and recipient in pubkeys:
+                graph.addOutput(issuer, recipient, amount)
+                graph.edges[(issuer, recipient)][1] = count
+        return graph
+
+    def totals(self):
+        totals = {}
+        for (issuer, recipient), (amount, count) in self.edges.items():
+            totals.setdefault(issuer, [0, 0])[1] += amount
+            totals.setdefault(recipient, [0, 0])[0] += amount
+        return {
+            pubkey: {"in": values[0] / 100, "out": values[1] / 100}
+            for pubkey, values in totals.items()
+        }
+
+    def stronglyConnected(self):
+        # Iterative Tarjan, linear in nodes + edges, groups of 2 accounts or more
+        index = {}
+        lowlink = {}
+        onStack = set()
+        stack = []
+        groups = []
+        counter = 0
+
+        for root in self.successors:
+            if root in index:
+                continue
+            work = [(root, iter(self.successors[root]))]
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            onStack.add(root)
+            while work:
+                node, children = work[-1]
+                child = next(children, None)
+                if child is not None:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        onStack.add(child)
+                        work.append((child, iter(self.successors[child])))
+                    elif child in onStack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        onStack.discard(member)
+                        group.append(member)
+                        if member == node:
+                            break
+                    if len(group) > 1:
+                        groups.append(sorted(group))
+        return sorted(groups, key=len, reverse=True)
+
+    def export(self):
+        return {
+            "transactions": len(self.seen),
+            "edges": [
+                {"from": issuer, "to": recipient, "amount": amount / 100, "count": count}
+                for (issuer, recipient), (amount, count) in sorted(
+                    self.edges.items(), key=lambda item: item[1][0], reverse=True
+                )
+            ],
+            "nodes": self.totals(),
+            "groups": self.stronglyConnected(),
+        }
+
+
+def fetchTransactions(node, pubkey):
+    # Full blockchain history of one account as (hash, issuer, outputs)
+    history = History(None, node, pubkey)
+    return [
+        (edge["node"]["hash"], edge["node"]["issuers"][0], edge["node"]["outputs"])
+        for edges in history.iterPages()
+        for edge in edges
+    ]
+
+
+def buildFromNode(node, pubkeys, jobs=8):
+    graph = FlowGraph()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for transactions in executor.map(lambda pubkey: fetchTransactions(node, pubkey), pubkeys):
+            for txHash, issuer, outputs in transactions:
+                graph.addTransaction(txHash, issuer, outputs)
+    return graph
+
+
+def buildFromStore(store, pubkeys):
+    # Histories already synced with syncBlocks, one row per output. The
+    # recipient of the other conditions (XHX, multisig, CLTV) is the raw
+    # condition, skipped by addTransaction as from the node.
+    graph = FlowGraph()
+    for pubkey in pubkeys:
+        outputs = {}
+        for number, txTime, txHash, issuer, comment, recipient, amount, base in store.transactionsOf(pubkey):
+            condition = recipient if "(" in recipient else "SIG({0})".format(recipient)
+            outputs.setdefault((txHash, issuer), []).append(
+                "{0}:{1}:{2}".format(amount, base, condition)
+            )
+        for (txHash, issuer), txOutputs in outputs.items():
+            graph.addTransaction(txHash, issuer, txOutputs)
+    return graph
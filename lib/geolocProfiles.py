@@ -1,72 +1,109 @@
-import requests
 from time import time
 from lib.cesiumCommon import CesiumCommon
+from lib import resilience, esQuery, jsonCodec
 from lib.gvaWallets import ListWallets
+from lib.profileCache import profileCache
+
+
+GEOLOC_POD = "https://g1.data.e-is.pro"
 
 
 class GeolocProfiles(CesiumCommon):
-    def getCesiumProfiles(self):
-        # Send a POST request to the Cesium profiles API
-        response = requests.post(
-            "https://g1.data.e-is.pro/user/profile/_search?scroll=2m",
-            json={
-                "query": {
-                    "constant_score": {
-                        "filter": [
-                            {"exists": {"field": "geoPoint"}},
-                            {
-                                "geo_bounding_box": {
-                                    "geoPoint": {
-                                        "top_left": {"lat": 90, "lon": -180},
-                                        "bottom_right": {"lat": -90, "lon": 180},
-                                    }
+    # Geolocated profiles, the whole index in a few scroll pages
+    def configDoc(self):
+        return {
+            "query": {
+                "constant_score": {
+                    "filter": [
+                        {"exists": {"field": "geoPoint"}},
+                        {
+                            "geo_bounding_box": {
+                                "geoPoint": {
+                                    "top_left": {"lat": 90, "lon": -180},
+                                    "bottom_right": {"lat": -90, "lon": 180},
                                 }
-                            },
-                        ]
-                    }
-                },
-                "_source": [
-                    "title",
-                    "avatar._content_type",
-                    "description",
-                    "city",
-                    "address",
-                    "socials.url",
-                    "creationTime",
-                    "membersCount",
-                    "type",
-                    "geoPoint",
-                ],
-                "size": 20000,
+                            }
+                        },
+                    ]
+                }
             },
+            "_source": [
+                "title",
+                "avatar._content_type",
+                "description",
+                "city",
+                "address",
+                "socials.url",
+                "creationTime",
+                "membersCount",
+                "type",
+                "geoPoint",
+            ],
+            "size": 20000,
+        }
+
+    def cachedProfiles(self):
+        # Hits of the last scroll, while all its profiles are in the cache
+        pubkeys = profileCache.scanned(GEOLOC_POD + " geoloc")
+        if pubkeys is None:
+            return
+        cached, missing = profileCache.getMany(GEOLOC_POD, pubkeys, self.configDoc()["_source"])
+        if not missing:
+            return [{"_id": pubkey, "_source": cached[pubkey]} for pubkey in pubkeys if cached[pubkey]]
+
+    def cacheProfiles(self, hits):
+        profileCache.putMany(
+            GEOLOC_POD, {hit["_id"]: hit["_source"] for hit in hits}, self.configDoc()["_source"]
+        )
+        profileCache.scanned(GEOLOC_POD + " geoloc", [hit["_id"] for hit in hits])
+
+    def getCesiumProfiles(self):
+        cached = self.cachedProfiles()
+        if cached is not None:
+            return cached
+
+        # Send a POST request to the Cesium profiles API
+        response = resilience.post(
+            GEOLOC_POD,
+            esQuery.searchPath(esQuery.USER_PROFILES, esQuery.SCROLL, scroll="2m"),
+            idempotent=True,
+            json=self.configDoc(),
         )
 
-        scroll_id = response.json()["_scroll_id"]
-        finalResult: dict | None = response.json()["hits"]["hits"]
+        result = jsonCodec.loads(response.content)
+        scroll_id = result["_scroll_id"]
+        finalResult: dict | None = esQuery.hits(result)
 
         while True:
             # Send a scroll request to get the next page
-            response_scroll = requests.post(
-                "https://g1.data.e-is.pro/_search/scroll",
+            # The scroll context only lives on the pod of the first request
+            response_scroll = resilience.post(
+                response.url.split("/user/")[0],
+                esQuery.searchPath("/_search/scroll", esQuery.SCROLL),
+                idempotent=True,
+                reroute=False,
                 json={"scroll_id": scroll_id, "scroll": "2m"},
             )
 
             # Check if the response is empty (no results) or if there's an error
-            if (
-                not response_scroll.json()["hits"]["hits"]
-                or "error" in response_scroll.json()
-            ):
+            page = jsonCodec.loads(response_scroll.content)
+            if not esQuery.hits(page) or "error" in page:
                 break
             else:
-                finalResult.extend(response_scroll.json()["hits"]["hits"])
+                finalResult.extend(esQuery.hits(page))
 
             # Process the results here
 
         # Delete the scroll context when done
-        requests.delete(
-            "https://g1.data.e-is.pro/_search/scroll", json={"scroll_id": [scroll_id]}
+        resilience.request(
+            "DELETE",
+            response.url.split("/user/")[0],
+            "/_search/scroll",
+            reroute=False,
+            json={"scroll_id": [scroll_id]},
         )
 
+        self.cacheProfiles(finalResult)
         return finalResult
 
     def getGVAProfiles(self, node):
@@ -1,6 +1,7 @@
-import sys, re, json, requests, base64
+import sys, re, json, base64
 from time import time
 from lib.cesiumCommon import CesiumCommon, PUBKEY_REGEX
+from lib import resilience, esQuery, jsonCodec
 
 
 class Pages(CesiumCommon):
@@ -46,32 +47,7 @@ class Pages(CesiumCommon):
         else:
             avatar = "avatar._content_type"
 
-        data = {
-                "query": {
-                "bool": {
-                    "should":[
-                        {
-                            "match":{
-                                scope:{
-                                    "query": profile,"boost":2
-                                }
-                            }
-                        },{
-                            "prefix": {scope: profile}
-                        }
-                    ]
-                }
-            },"highlight": {
-                    "fields": {
-                        "title":{},
-                        "tags":{}
-                    }
-                },"from":0,
-                "size":100,
-                "_source":["title", avatar,"description","city","address","socials.url","creationTime","membersCount","type","geoPoint"],
-                "indices_boost":{"user":100,"page":1,"group":0.01
-                }
-        }
+        data = esQuery.profileSearch(profile, scope, ["title", avatar,"description","city","address","socials.url","creationTime","membersCount","type","geoPoint"])
 
         document =  json.dumps(data)
 
@@ -101,13 +77,13 @@ class Pages(CesiumCommon):
 
         # Send JSON document and get JSON result
         if type == 'set':
-            reqQuery = '{0}/user/profile?pubkey={1}/_update?pubkey={1}'.format(self.pod, self.pubkey)
+            reqPath = '/user/profile?pubkey={0}/_update?pubkey={0}'.format(self.pubkey)
         elif type == 'get':
-            reqQuery = '{0}/user,page,group/profile,record/_search'.format(self.pod)
+            reqPath = esQuery.searchPath(esQuery.PROFILES, esQuery.FIRST_HITS)
         elif type == 'erase':
-            reqQuery = '{0}/history/delete'.format(self.pod)
+            reqPath = '/history/delete'
 
-        result = requests.post(reqQuery, headers=headers, data=document)
+        result = resilience.post(self.pod, reqPath, idempotent=type == 'get', headers=headers, data=document)
         if result.status_code == 200:
             # print(result.text)
             return result.text
@@ -115,11 +91,11 @@ class Pages(CesiumCommon):
             sys.stderr.write("Echec de l'envoi du document...\n" + result.text + '\n')
 
     def parseJSON(self, doc):
-        doc = json.loads(doc)['hits']['hits']
+        doc = esQuery.hits(jsonCodec.loads(doc))
         if doc:
             pubkey = { "pubkey": doc[0]['_id'] }
             rest = doc[0]['_source']
             final = {**pubkey, **rest}
-            return json.dumps(final, indent=2)
+            return jsonCodec.dumps(final, indent=2)
         else:
             return 'Profile vide'
@@ -1,11 +1,22 @@
 from lib.currentUd import currentUd
 from lib.gvaWallets import ListWallets
-import sys, re
+import sys, re, time, asyncio
 from lib.natools import get_privkey
 from lib.gvaPay import Transaction, PUBKEY_REGEX
 from lib.gvaHistory import History
+from lib.historyRecords import historyStats, balanceSeries
 from lib.gvaBalance import Balance
 from lib.gvaID import Id
+from lib.gvaIdentities import Identities
+from lib.gvaWatch import Watch
+from lib.gvaSubscribe import Subscribe
+from lib.gvaSync import SyncBlocks
+from lib.gvaCrawl import HistoryCrawl
+from lib.chainStore import ChainStore
+from lib.udTimeline import UdTimeline
+from lib.nodeMeta import NodeMeta
+from lib.flowGraph import buildFromNode, buildFromStore
+from lib import jsonCodec
 
 class GvaApi():
     def __init__(self, dunikey, node, pubkey, noNeedDunikey=False):
@@ -46,16 +57,96 @@ class GvaApi():
         gva.signDoc()
         return gva.sendTXDoc()
 
-    def history(self, isJSON=False, noColors=False, number=10):
-        gva = History(self.dunikey, self.node, self.destPubkey)
+    def history(self, isJSON=False, noColors=False, number=10, format=None):
+        udTimeline = UdTimeline(self.node)
+        udTimeline.update()
+        gva = History(self.dunikey, self.node, self.destPubkey, udTimeline)
+        if format:
+            gva.exportHistory(sys.stdout, format, number)
+            return
         gva.sendDoc(number)
         transList = gva.parseHistory()
+        # Usernames of the counterparties, in one request
+        usernames = Identities(self.node).usernames([t.pubkey for t in transList])
 
         if isJSON:
-            transJson = gva.jsonHistory(transList)
+            transJson = gva.jsonHistory(transList, usernames)
             print(transJson)
         else:
-            gva.printHistory(transList, noColors)
+            gva.printHistory(transList, noColors, usernames)
+
+    def historyStats(self, top=10):
+        gva = History(self.dunikey, self.node, self.destPubkey)
+        columns = gva.columns()
+        print(jsonCodec.dumps(historyStats(columns, top), indent=2))
+
+    def balanceSeries(self, resolution="day", anchor=False):
+        udTimeline = UdTimeline(self.node)
+        udTimeline.update()
+        gva = History(self.dunikey, self.node, self.destPubkey, udTimeline)
+        columns = gva.columns()
+        columns.addDividends(gva.dividends(), gva.pubkey)
+        currentBase, amountUD = gva.amountUD()
+
+        def toUD(balance, time):
+            if udTimeline.entries:
+                return udTimeline.toUD(balance, time, currentBase)
+            return balance / 100 / gva.UD
+
+        # Transactions and UDs do not carry the account initial sources (genesis
+        # or migrated ones), anchoring shifts the series so that it ends on the
+        # actual balance
+        computed = sum(columns.amounts) / 100
+        balance = gva.historyDoc['balance']
+        actual = balance['amount'] / 100 if balance else 0
+        start = int(round((actual - computed) * 100)) if anchor else 0
+
+        step = 3600 if resolution == "hour" else 86400
+        series = balanceSeries(columns, step, toUD, int(time.time()), start)
+        print(
+            jsonCodec.dumps(
+                {
+                    "pubkey": self.destPubkey,
+                    "resolution": resolution,
+                    "check": {
+                        "computed": computed,
+                        "balance": actual,
+                        "difference": round(actual - computed, 2),
+                    },
+                    "series": series,
+                },
+                indent=2,
+            )
+        )
+
+    def flows(self, pubkeys, internal=False, jobs=8, db=None):
+        if db:
+            store = ChainStore(db)
+            graph = buildFromStore(store, pubkeys)
+            store.close()
+        else:
+            # Warm the metadata cache once before the concurrent fetches
+            NodeMeta(self.node).get()
+            graph = buildFromNode(self.node, pubkeys, jobs)
+        if internal:
+            graph = graph.restrict(pubkeys)
+        print(jsonCodec.dumps(graph.export(), indent=2))
+
+    def crawl(self, pubkeys, outDir, format="ndjson", jobs=8, partitionSize=1000):
+        gva = HistoryCrawl(self.node, outDir, format, jobs, partitionSize)
+        progress = gva.run(pubkeys)
+        print(jsonCodec.dumps(progress))
+
+    def watch(self, invoices, interval=5, once=False):
+        gva = Watch(self.node, self.destPubkey, invoices)
+        gva.run(interval, once)
+
+    def subscribe(self, pubkeys):
+        gva = Subscribe(self.node, pubkeys or [self.destPubkey])
+        try:
+            asyncio.run(gva.run())
+        except KeyboardInterrupt:
+            pass
     
     def balance(self, useMempool):
         gva = Balance(self.dunikey, self.node, self.destPubkey, useMempool)
@@ -77,6 +168,23 @@ class GvaApi():
         result = gva.sendDoc()
         print(result)
         
+    def syncBlocks(self, start=0, end=None, jobs=4, batch=50, db=None):
+        store = ChainStore(db, NodeMeta(self.node).get()["currency"])
+        gva = SyncBlocks(self.node, store, jobs, batch)
+        progress = gva.run(start, end)
+        print(
+            jsonCodec.dumps(
+                {
+                    "fetched": progress["done"],
+                    "missing": progress["total"] - progress["done"],
+                    "failed": progress["failed"],
+                    "stored": store.count(),
+                    "head": store.head(),
+                }
+            )
+        )
+        store.close()
+
     def listWallets(self, brut, brutMbr, brutNonMbr, brutLarf):
         gva = ListWallets(self.node, brut, brutMbr, brutNonMbr, brutLarf)
         result = gva.sendDoc()
@@ -3,8 +3,9 @@
 import sys, re, os.path, json, ast
 from termcolor import colored
 from lib.natools import fmt, sign, get_privkey
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import gql
+from lib.hedge import gvaReadClient
+from lib.resilience import errorMessage
 
 PUBKEY_REGEX = "(?![OIl])[1-9A-Za-z]{42,45}"
 
@@ -19,8 +20,7 @@ class Balance:
             sys.exit(1)
 
         # Define Duniter GVA node
-        transport = AIOHTTPTransport(url=node)
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
+        self.client = gvaReadClient(node)
 
     def sendDoc(self):
         # Build balance generation document
@@ -41,7 +41,7 @@ class Balance:
         try:
             balanceResult = self.client.execute(queryBuild, variable_values=paramsBuild)
         except Exception as e:
-            message = ast.literal_eval(str(e))["message"]
+            message = errorMessage(e)
             sys.stderr.write("Echec de récupération du solde:\n" + message + "\n")
             sys.exit(1)
             
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+# Block fields requested from GVA, shared by subscriptions and block sync
+BLOCK_FIELDS = """
+    number
+    hash
+    issuer
+    medianTime
+    dividend
+    unitBase
+    transactions {
+        issuers
+        outputs
+        comment
+        blockstamp
+        hash
+    }
+"""
+
+
+def outputPubkey(output):
+    # "amount:base:SIG(pubkey)" -> pubkey, None for other conditions
+    condition = output.split(":", 2)[2]
+    if condition.startswith("SIG(") and condition.endswith(")"):
+        return condition[4:-1]
+    return None
+
+
+def blockPubkeys(block):
+    # Every pubkey issuing or receiving a transaction in this block
+    pubkeys = set()
+    for transaction in block.get("transactions") or []:
+        pubkeys.update(transaction["issuers"])
+        for output in transaction["outputs"]:
+            pubkey = outputPubkey(output)
+            if pubkey:
+                pubkeys.add(pubkey)
+    return pubkeys
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+import threading
+from lib.resilience import ResilientClient
+
+_local = threading.local()
+
+
+def gvaClient(node, reroute=True, bounded=True):
+    # One GVA client per node and thread, shared by every query of the process.
+    # The schema is not fetched: the node validates queries itself, and the
+    # introspection round trip used to double the cost of each command.
+    # Queries get timeouts, retries and rerouting from ResilientClient (the
+    # hedged reads reroute to their own alternate).
+    clients = getattr(_local, "clients", None)
+    if clients is None:
+        clients = _local.clients = {}
+    key = (node, reroute, bounded)
+    if key not in clients:
+        clients[key] = ResilientClient(node, reroute, bounded)
+    return clients[key]
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import os, sys, csv, gzip, time, asyncio
+from gql import Client
+from lib.resilience import gvaTransport
+from lib.gvaHistory import History
+from lib.historyRecords import EXPORT_COLUMNS, exportRow
+from lib.nodeMeta import NodeMeta
+from lib.udTimeline import UdTimeline
+from lib import jsonCodec
+
+# Same columns as history exports, prefixed by the crawled account
+CRAWL_COLUMNS = ("account",) + EXPORT_COLUMNS
+
+
+class Partition:
+    # One gzip file of rows, written under a temporary name until it is complete
+    def __init__(self, path, format):
+        self.path = path
+        self.tmpPath = path + ".tmp"
+        self.file = gzip.open(self.tmpPath, "wt", newline="")
+        self.format = format
+        self.accounts = []
+        if format == "csv":
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(CRAWL_COLUMNS)
+
+    def write(self, account, records):
+        rows = ((account,) + exportRow(record) for record in records)
+        if self.format == "csv":
+            self.writer.writerows(rows)
+        else:
+            self.file.writelines(jsonCodec.dumps(dict(zip(CRAWL_COLUMNS, row))) + "\n" for row in rows)
+        self.accounts.append(account)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmpPath, self.path)
+
+
+class HistoryCrawl:
+    def __init__(self, node, outDir, format="ndjson", jobs=8, partitionSize=1000, pageSize=1000):
+        self.node = node
+        self.outDir = outDir
+        self.format = format
+        self.jobs = jobs
+        self.partitionSize = partitionSize
+        self.pageSize = pageSize
+        self.donePath = os.path.join(outDir, "done.txt")
+        self.failedPath = os.path.join(outDir, "failed.txt")
+        self.partition = None
+        self.progress = {"accounts": 0, "transactions": 0, "failed": 0, "skipped": 0}
+
+    def loadCheckpoint(self):
+        # Accounts of complete partitions are done, unfinished partitions are
+        # dropped and their accounts crawled again
+        os.makedirs(self.outDir, exist_ok=True)
+        self.nextPart = 0
+        for name in os.listdir(self.outDir):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.outDir, name))
+            elif name.startswith("part-"):
+                self.nextPart = max(self.nextPart, int(name[5:10]) + 1)
+        try:
+            with open(self.donePath, "r") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        except OSError:
+            self.done = set()
+        # Failures of a previous run are retried
+        if os.path.exists(self.failedPath):
+            os.remove(self.failedPath)
+
+    def partitionPath(self, number):
+        return os.path.join(
+            self.outDir, "part-{0:05d}.{1}.gz".format(number, self.format)
+        )
+
+    def closePartition(self):
+        if not self.partition:
+            return
+        self.partition.close()
+        # The checkpoint only moves once the partition file is complete
+        with open(self.donePath, "a") as f:
+            f.writelines(account + "\n" for account in self.partition.accounts)
+        self.partition = None
+
+    def write(self, account, records):
+        if not self.partition:
+            self.partition = Partition(self.partitionPath(self.nextPart), self.format)
+            self.nextPart += 1
+        self.partition.write(account, records)
+        if len(self.partition.accounts) >= self.partitionSize:
+            self.closePartition()
+
+    async def fetchAccount(self, session, pubkey):
+        # Every page of the blockchain history of one account, newest first
+        history = History(None, self.node, pubkey, self.udTimeline)
+        history.meta = self.meta
+        query = history.pageQuery()
+        records = []
+        cursor = None
+        while True:
+            for attempt in range(3):
+                try:
+                    result = await session.execute(
+                        query,
+                        variable_values={
+                            "script": "SIG({0})".format(pubkey),
+                            "number": self.pageSize,
+                            "cursor": cursor,
+                        },
+                    )
+                    break
+                except Exception:
+                    if attempt == 2:
+                        raise
+                    await asyncio.sleep(2**attempt)
+            page = result["txsHistoryBc"]["both"]
+            records += history.parseEdges(page["edges"])
+            if not page["pageInfo"]["hasNextPage"]:
+                return records
+            cursor = page["pageInfo"]["endCursor"]
+
+    async def worker(self, session, queue):
+        while True:
+            pubkey = await queue.get()
+            try:
+                records = await self.fetchAccount(session, pubkey)
+            except (Exception, SystemExit) as e:
+                sys.stderr.write("Failed to crawl {0}:\n{1}\n".format(pubkey, str(e)))
+                with open(self.failedPath, "a") as f:
+                    f.write(pubkey + "\n")
+                self.progress["failed"] += 1
+            else:
+                self.write(pubkey, records)
+                self.progress["accounts"] += 1
+                self.progress["transactions"] += len(records)
+            finally:
+                queue.task_done()
+
+    async def crawl(self, pubkeys):
+        self.loadCheckpoint()
+        client = Client(
+            transport=gvaTransport(self.node), fetch_schema_from_transport=False
+        )
+        async with client as session:
+            # Bounded queue: pubkeys are read only as fast as workers take them
+            queue = asyncio.Queue(maxsize=self.jobs * 2)
+            workers = [
+                asyncio.ensure_future(self.worker(session, queue))
+                for _ in range(self.jobs)
+            ]
+            startTime = time.time()
+            reported = 0
+            for pubkey in pubkeys:
+                if pubkey in self.done:
+                    self.progress["skipped"] += 1
+                    continue
+                self.done.add(pubkey)
+                await queue.put(pubkey)
+                if self.progress["accounts"] - reported >= 1000:
+                    reported = self.progress["accounts"]
+                    sys.stderr.write(
+                        "{0} accounts, {1} transactions ({2:.1f} accounts/s)\n".format(
+                            self.progress["accounts"],
+                            self.progress["transactions"],
+                            self.progress["accounts"] / (time.time() - startTime),
+                        )
+                    )
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+        self.closePartition()
+        return self.progress
+
+    def run(self, pubkeys):
+        # Currency base and UD history are shared by every account
+        self.meta = NodeMeta(self.node).get()
+        self.udTimeline = UdTimeline(self.node)
+        self.udTimeline.update()
+        try:
+            return asyncio.run(self.crawl(pubkeys))
+        except KeyboardInterrupt:
+            # Only complete partitions are kept, the next run resumes from them
+            return self.progress
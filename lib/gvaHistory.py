@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
 
-import sys, re, os.path, json, ast, time, hashlib
+import sys, re, os.path, json, ast, time, hashlib, shutil
 from datetime import datetime
 from duniterpy.key import base58
 from termcolor import colored
 from lib.natools import fmt, sign, get_privkey
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import gql
+from lib.hedge import gvaReadClient
+from lib.nodeMeta import NodeMeta
+from lib.historyRecords import parseTransaction, HistoryColumns, EXPORTS
+from lib.resilience import errorMessage
+from lib import jsonCodec
+from operator import attrgetter
 
 PUBKEY_REGEX = "(?![OIl])[1-9A-Za-z]{42,45}"
 
 class History:
 
-    def __init__(self, dunikey, node, pubkey):
+    def __init__(self, dunikey, node, pubkey, udTimeline=None):
         self.dunikey = dunikey
+        self.udTimeline = udTimeline
         self.pubkey = pubkey if pubkey else get_privkey(dunikey, "pubsec").pubkey
         self.node = node
         if not re.match(PUBKEY_REGEX, self.pubkey) or len(self.pubkey) > 45:
@@ -21,10 +27,12 @@ class History:
             sys.exit(1)
 
         # Define Duniter GVA node
-        transport = AIOHTTPTransport(url=node)
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
+        self.client = gvaReadClient(node)
 
     def sendDoc(self, number):
+        # Currency and current UD come from the node metadata cache
+        self.meta = NodeMeta(self.node).get()
+
         # Build history generation document
         queryBuild = gql(
             """
@@ -37,6 +45,7 @@ class History:
                         pageInfo {
                             hasPreviousPage
                             hasNextPage
+                            endCursor
                         }
                         edges {
                             direction
@@ -76,15 +85,6 @@ class History:
                     amount
                     base
                 }
-                node {
-                    peer {
-                        currency
-                    }
-                }
-                currentUd {
-                    amount
-                    base
-                }
             }
         """
         )
@@ -98,96 +98,182 @@ class History:
         try:
             self.historyDoc = self.client.execute(queryBuild, variable_values=paramsBuild)
         except Exception as e:
-            message = ast.literal_eval(str(e))["message"]
+            message = errorMessage(e)
             sys.stderr.write("Echec de récupération de l'historique:\n" + message + "\n")
             sys.exit(1)
 
 
-    def parseHistory(self):
-        trans = []
-        i = 0
-
-        currentBase = int(self.historyDoc['currentUd']['base'])
-        self.UD = self.historyDoc['currentUd']['amount']/100
-
-
-        # Parse transactions in blockchain
-        resBc = []
-        resBc = self.historyDoc['txsHistoryBc']['both']['edges']
-        for j, transaction in enumerate(resBc):
-            # print(transaction)
-            direction = resBc[j]['direction']
-            transaction = resBc[j]['node']
-            output = transaction['outputs'][0]
-            outPubkey = output.split("SIG(")[1].replace(')','')
-            # if direction == 'RECEIVED' or self.pubkey != outPubkey:
-            trans.append(i)
-            trans[i] = []
-            trans[i].append(direction)
-            trans[i].append(transaction['writtenTime'])
-            
-            if direction == 'SENT':
-                trans[i].append(outPubkey)
-                amount = int('-' + output.split(':')[0])
-            else:
-                trans[i].append(transaction['issuers'][0])
-                amount = int(output.split(':')[0])
-            base = int(output.split(':')[1])
-            applyBase = base-currentBase
-            amount = round(amount*pow(10,applyBase)/100, 2)
-            # if referential == 'DU': amount = round(amount/UD, 2)
-            trans[i].append(amount)
-            trans[i].append(round(amount/self.UD, 2))
-            trans[i].append(transaction['comment'])
-            trans[i].append(base)
-            trans[i].append(transaction['blockstamp'])
-            trans[i].append(transaction['hash'])
-            i += 1
-
-        # Parse transactions in mempool
-        for direction, resBc in self.historyDoc['txsHistoryMp'].items():
-            for j, transaction in enumerate(resBc):
-                # print(transaction)
-                transaction = resBc[j]
-                output = transaction['outputs'][0]
-                outPubkey = output.split("SIG(")[1].replace(')','')
-                # if direction == 'RECEIVING' or self.pubkey != outPubkey:
-                trans.append(i)
-                trans[i] = []
-                trans[i].append(direction.upper())
-                trans[i].append(transaction['receivedTime'])
-                
-                # trans[i].append(int(time.time()))
-                if direction.upper() == 'SENDING':
-                    trans[i].append(outPubkey)
-                    amount = int('-' + output.split(':')[0])
-                else:
-                    trans[i].append(transaction['issuers'][0])
-                    amount = int(output.split(':')[0])
-                base = int(output.split(':')[1])
-                applyBase = base-currentBase
-                amount = round(amount*pow(10,applyBase)/100, 2)
-                # if referential == 'DU': amount = round(amount/UD, 2)
-                trans[i].append(amount)
-                trans[i].append(round(amount/self.UD, 2))
-                trans[i].append(transaction['comment'])
-                trans[i].append(base)
-                trans[i].append(transaction['blockstamp'])
-                trans[i].append(transaction['hash'])
-                i += 1
+    def pageQuery(self):
+        # Next pages of the blockchain history only, mempool and balance come with sendDoc
+        return gql(
+            """
+            query ($script: PkOrScriptGva!, $number: Int!, $cursor: String){
+                txsHistoryBc(
+                    script: $script
+                    pagination: { pageSize: $number, ord: DESC, cursor: $cursor }
+                ) {
+                    both {
+                        pageInfo {
+                            hasNextPage
+                            endCursor
+                        }
+                        edges {
+                            direction
+                            node {
+                                issuers
+                                blockstamp
+                                outputs
+                                comment
+                                writtenTime
+                                hash
+                            }
+                        }
+                    }
+                }
+            }
+        """
+        )
+
+    def iterPages(self, pageSize=1000):
+        # Blockchain history page after page (newest first), the first page being
+        # the one of sendDoc, so that mempool and balance are still available
+        self.sendDoc(pageSize)
+        page = self.historyDoc['txsHistoryBc']['both']
+        yield page['edges']
+        queryBuild = self.pageQuery()
+        while page['pageInfo']['hasNextPage']:
+            paramsBuild = {
+                "script": f"SIG({self.pubkey})",
+                "number": pageSize,
+                "cursor": page['pageInfo']['endCursor'],
+            }
+            try:
+                page = self.client.execute(queryBuild, variable_values=paramsBuild)['txsHistoryBc']['both']
+            except Exception as e:
+                sys.stderr.write("Echec de récupération de l'historique:\n" + str(e) + "\n")
+                sys.exit(1)
+            yield page['edges']
+
+    def udsQuery(self):
+        return gql(
+            """
+            query ($pubkey: PubKeyGva!, $number: Int!, $cursor: String){
+                udsOfPubkey(
+                    pubkey: $pubkey
+                    pagination: { pageSize: $number, ord: DESC, cursor: $cursor }
+                ) {
+                    pageInfo {
+                        hasNextPage
+                        endCursor
+                    }
+                    edges {
+                        node {
+                            amount
+                            base
+                            blockchainTime
+                        }
+                    }
+                }
+            }
+        """
+        )
+
+    def iterUds(self, pageSize=1000):
+        # Universal dividends of the account page after page, newest first
+        queryBuild = self.udsQuery()
+        cursor = None
+        while True:
+            paramsBuild = {"pubkey": self.pubkey, "number": pageSize, "cursor": cursor}
+            try:
+                page = self.client.execute(queryBuild, variable_values=paramsBuild)['udsOfPubkey']
+            except Exception as e:
+                sys.stderr.write("Echec de récupération des DU:\n" + errorMessage(e) + "\n")
+                sys.exit(1)
+            yield page['edges']
+            if not page['pageInfo']['hasNextPage']:
+                break
+            cursor = page['pageInfo']['endCursor']
+
+    def dividends(self, pageSize=1000):
+        # (time, amount in cents of the current base) of every UD of the account
+        currentBase = int(self.meta['currentUd']['base'])
+        return [
+            (edge['node']['blockchainTime'], int(round(edge['node']['amount'] * pow(10, edge['node']['base'] - currentBase))))
+            for edges in self.iterUds(pageSize)
+            for edge in edges
+        ]
+
+    def amountUD(self):
+        currentBase = int(self.meta['currentUd']['base'])
+        self.UD = self.meta['currentUd']['amount']/100
+
+        # Amounts in DU are converted with the UD in force at their own date
+        def amountUD(amount, txTime):
+            if self.udTimeline and self.udTimeline.entries:
+                return round(self.udTimeline.toUD(amount*100, txTime, currentBase), 2)
+            return round(amount/self.UD, 2)
+
+        return currentBase, amountUD
+
+    def parseEdges(self, edges):
+        currentBase, amountUD = self.amountUD()
+        return [
+            parseTransaction(edge['direction'], edge['node'], edge['node']['writtenTime'], currentBase, amountUD, self.pubkey)
+            for edge in edges
+        ]
+
+    def parseMempool(self):
+        currentBase, amountUD = self.amountUD()
+        return [
+            parseTransaction(direction.upper(), transaction, transaction['receivedTime'], currentBase, amountUD, self.pubkey)
+            for direction, transactions in self.historyDoc['txsHistoryMp'].items()
+            for transaction in transactions
+        ]
+
+    def parseHistory(self, edges=None):
+        # Parse transactions in blockchain and in mempool
+        if edges is None:
+            edges = self.historyDoc['txsHistoryBc']['both']['edges']
+        trans = self.parseEdges(edges) + self.parseMempool()
 
         # Order transactions by date
-        trans.sort(key=lambda x: x[1])
+        trans.sort(key=attrgetter('time'))
 
         # Keep only base if there is base change
         lastBase = 0
-        for i in trans:
-            if i[6] == lastBase: i[6] = None
-            else: lastBase = i[6]
-        
+        for t in trans:
+            if t.base == lastBase: t.base = None
+            else: lastBase = t.base
+
         return trans
 
-    def printHistory(self, trans, noColors):
+    def exportHistory(self, out, format, number=0, pageSize=1000):
+        # Stream rows while pages arrive (newest first), pending ones first.
+        # number=0 exports the whole history.
+        export = EXPORTS[format](out)
+        pageSize = min(number, pageSize) if number else pageSize
+        count = 0
+        for i, edges in enumerate(self.iterPages(pageSize)):
+            records = self.parseEdges(edges)
+            if i == 0:
+                records = self.parseMempool() + records
+            if number:
+                records = records[: number - count]
+            export.write(records)
+            out.flush()
+            count += len(records)
+            if number and count >= number:
+                break
+
+    def columns(self, pageSize=1000):
+        # Full blockchain history as columns, records are dropped page by page
+        columns = HistoryColumns()
+        for edges in self.iterPages(pageSize):
+            columns.extend(self.parseEdges(edges))
+        return columns
+
+    def printHistory(self, trans, noColors, usernames=None):
+        usernames = usernames or {}
         # Get balance
         if (self.historyDoc['balance'] == None): 
             balance = balanceUD = 'null'
@@ -197,13 +283,13 @@ class History:
             balanceUD = round(balance/self.UD, 2)
 
         # Get currency
-        currency = self.historyDoc['node']['peer']['currency']
+        currency = self.meta['currency']
         if currency == 'g1': currency = 'Ḡ1'
         elif currency == 'g1-test': currency = 'GT'
         # if referential == 'DU': currency = 'DU/' + currency.lower()
 
         # Get terminal size
-        rows = int(os.popen('stty size', 'r').read().split()[1])
+        rows = shutil.get_terminal_size().columns
 
         # Display history
         print('+', end='')
@@ -215,34 +301,37 @@ class History:
         print(isBold + "|{: <19} | {: <12} | {: <7} | {: <7} | {: <30}".format("        Date","   De / À","  {0}".format(currency)," DU/{0}".format(currency.lower()),"Commentaire") + isBoldEnd)
         print('|', end='')
         for t in trans:
-            if t[0] == "RECEIVED": color = "green"
-            elif t[0] == "SENT": color = "blue"
-            elif t[0] == "receiving": color = "yellow"
-            elif t[0] == "sending": color = "red"
+            if t.status == "RECEIVED": color = "green"
+            elif t.status == "SENT": color = "blue"
+            elif t.status == "RECEIVING": color = "yellow"
+            elif t.status == "SENDING": color = "red"
             else: color = None
             if noColors:
                 color = None
-                if t[0] in ('RECEIVING','SENDING'):
-                    comment = '(EN ATTENTE) ' + t[5]
+                if t.status in ('RECEIVING','SENDING'):
+                    comment = '(EN ATTENTE) ' + t.comment
                 else:
-                    comment = t[5]
+                    comment = t.comment
             else:
-                comment = t[5]
+                comment = t.comment
 
-            date = datetime.fromtimestamp(t[1]).strftime("%d/%m/%Y à %H:%M")
+            date = datetime.fromtimestamp(t.time).strftime("%d/%m/%Y à %H:%M")
             print('-'.center(rows-1, '-'))
-            if t[6]:
+            if t.base:
                 print('|', end='')
-                print('  Changement de base : {0}  '.format(t[6]).center(rows-1, '#'))
+                print('  Changement de base : {0}  '.format(t.base).center(rows-1, '#'))
                 print('|', end='')
                 print('-'.center(rows-1, '-'))
             print('|', end='')
-            checksum = self.gen_checksum(t[2])
-            shortPubkey = t[2][0:4] + '\u2026' + t[2][-4:] + ':' + checksum
+            if t.pubkey in usernames:
+                shortPubkey = usernames[t.pubkey][:12]
+            else:
+                checksum = self.gen_checksum(t.pubkey)
+                shortPubkey = t.pubkey[0:4] + '\u2026' + t.pubkey[-4:] + ':' + checksum
             if noColors:
-                print(" {: <18} | {: <12} | {: <7} | {: <7} | {: <30}".format(date, shortPubkey, t[3], t[4], comment))
+                print(" {: <18} | {: <12} | {: <7} | {: <7} | {: <30}".format(date, shortPubkey, t.amount, t.amountUD, comment))
             else:
-                print(colored(" {: <18} | {: <12} | {: <7} | {: <7} | {: <30}".format(date, shortPubkey, t[3], t[4], comment), color))
+                print(colored(" {: <18} | {: <12} | {: <7} | {: <7} | {: <30}".format(date, shortPubkey, t.amount, t.amountUD, comment), color))
             print('|', end='')
         print('-'.center(rows-1, '-'))
         print('|', end='')
@@ -263,21 +352,24 @@ class History:
         hash = hashlib.sha256(hashlib.sha256(pubkey_byte).digest()).digest()
         return base58.Base58Encoder.encode(hash)[:3]
 
-    def jsonHistory(self, transList):
+    def jsonHistory(self, transList, usernames=None):
+        usernames = usernames or {}
         dailyJSON = []
         for i, trans in enumerate(transList):
             dailyJSON.append(i)
             dailyJSON[i] = {}
-            dailyJSON[i]['status'] = trans[0].upper()
-            dailyJSON[i]['date'] = trans[1]
-            dailyJSON[i]['pubkey'] = trans[2]
-            dailyJSON[i]['amount'] = trans[3]
-            dailyJSON[i]['amountUD'] = trans[4]
-            dailyJSON[i]['comment'] = trans[5]
-            dailyJSON[i]['blockstamp'] = trans[7]
-            dailyJSON[i]['hash'] = trans[8]
-
-        dailyJSON = json.dumps(dailyJSON, indent=2)
+            dailyJSON[i]['status'] = trans.status.upper()
+            dailyJSON[i]['date'] = trans.time
+            dailyJSON[i]['pubkey'] = trans.pubkey
+            if trans.pubkey in usernames:
+                dailyJSON[i]['username'] = usernames[trans.pubkey]
+            dailyJSON[i]['amount'] = trans.amount
+            dailyJSON[i]['amountUD'] = trans.amountUD
+            dailyJSON[i]['comment'] = trans.comment
+            dailyJSON[i]['blockstamp'] = trans.blockstamp
+            dailyJSON[i]['hash'] = trans.hash
+
+        dailyJSON = jsonCodec.dumps(dailyJSON, indent=2)
         # If we want to write JSON to a file
         #jsonFile = open("history-{0}.json".format(self.pubkey[0:8]), "w")
         #jsonFile.writelines(dailyJSON + '\n')
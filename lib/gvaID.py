@@ -3,8 +3,10 @@
 import sys, re, os.path, json, ast
 from termcolor import colored
 from lib.natools import fmt, sign, get_privkey
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import gql
+from lib.hedge import gvaReadClient
+from lib.gvaIdentities import Identities, directory
+from lib import jsonCodec
 
 PUBKEY_REGEX = "(?![OIl])[1-9A-Za-z]{42,45}"
 
@@ -13,15 +15,20 @@ class Id:
     def __init__(self, dunikey, node, pubkey='', username=''):
        
         self.dunikey = dunikey
-        self.pubkey = pubkey if pubkey else get_privkey(dunikey, "pubsec").pubkey
         self.username = username
+        if username and not pubkey:
+            # The pubkey of the username, from the identities directory
+            pubkey = Identities(node).pubkey(username)
+            if not pubkey:
+                sys.stderr.write("Identité introuvable: " + username + "\n")
+                sys.exit(1)
+        self.pubkey = pubkey if pubkey else get_privkey(dunikey, "pubsec").pubkey
         # if not re.match(PUBKEY_REGEX, self.pubkey) or len(self.pubkey) > 45:
         #     sys.stderr.write("La clé publique n'est pas au bon format.\n")
         #     sys.exit(1)
 
         # Define Duniter GVA node
-        transport = AIOHTTPTransport(url=node)
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
+        self.client = gvaReadClient(node)
 
     def sendDoc(self, getBalance=False):
         # Build balance generation document
@@ -64,6 +71,9 @@ class Id:
             sys.exit(1)
 
         jsonBrut = queryResult
+        directory.putMany({self.pubkey: queryResult['idty']})
+        if self.username:
+            jsonBrut['pubkey'] = self.pubkey
         
         if (getBalance):            
             if (queryResult['balance'] == None):
@@ -71,11 +81,4 @@ class Id:
             else:
                 jsonBrut['balance'] = queryResult['balance']['amount']/100
                 
-        if (queryResult['idty'] == None):
-            username = 'Matiou'
-            isMember = False
-        else:
-            username = queryResult['idty']['username']
-            isMember = queryResult['idty']['isMember']
-
-        return json.dumps(jsonBrut, indent=2)
+        return jsonCodec.dumps(jsonBrut, indent=2)
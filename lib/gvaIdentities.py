@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import os, sys, time, threading
+from gql import gql
+from lib.hedge import gvaReadClient
+from lib.localCache import cachePath, loadJson, saveJson
+
+# Seconds an identity stays valid in the directory
+TTL = int(os.getenv("IDENTITY_CACHE_TTL") or 86400)
+# Number of pubkeys merged in one aliased GVA request
+CHUNK_SIZE = 200
+# Wallets read by page while looking a username up
+SCAN_PAGE_SIZE = 1000
+
+WALLETS_QUERY = gql(
+    """
+    query ($cursor: String, $pageSize: Int!) {
+        wallets(pagination: { cursor: $cursor, ord: ASC, pageSize: $pageSize }) {
+            pageInfo { hasNextPage endCursor }
+            edges { node { script idty { isMember username } } }
+        }
+    }
+    """
+)
+
+
+class IdentityDirectory:
+    # Username and membership by pubkey (None without identity), kept in the
+    # local cache and shared by the threads of the process. The whole list of
+    # identities is only fetched to look a username up.
+    def __init__(self, path=None):
+        self.path = path or cachePath("identities.json")
+        self.lock = threading.Lock()
+        self.directory = None
+        self.enabled = True
+
+    def disable(self):
+        # --no-cache: identities are resolved again, and the directory refreshed
+        self.enabled = False
+
+    def load(self):
+        if self.directory is None:
+            self.directory = loadJson(self.path) or {}
+            self.directory.setdefault("pubkeys", {})
+            self.directory.setdefault("listed", 0)
+        return self.directory
+
+    def save(self):
+        saveJson(self.path, self.directory)
+
+    def getMany(self, pubkeys):
+        # Known identities by pubkey and the pubkeys to resolve
+        found, missing = {}, []
+        with self.lock:
+            entries = self.load()["pubkeys"]
+            for pubkey in dict.fromkeys(pubkeys):
+                entry = entries.get(pubkey)
+                if self.enabled and entry and time.time() - entry["time"] < TTL:
+                    found[pubkey] = entry["idty"]
+                else:
+                    missing.append(pubkey)
+        return found, missing
+
+    def putMany(self, identities, listed=False):
+        now = time.time()
+        with self.lock:
+            directory = self.load()
+            for pubkey, idty in identities.items():
+                directory["pubkeys"][pubkey] = {"idty": idty, "time": now}
+            if listed:
+                directory["listed"] = now
+            self.save()
+
+    def pubkey(self, username):
+        # Pubkey of a username known to the directory, and whether the
+        # directory is sure of it: a username missing from a recent list of
+        # all the identities is unknown
+        with self.lock:
+            directory = self.load()
+            if not self.enabled:
+                return None, False
+            now = time.time()
+            for pubkey, entry in directory["pubkeys"].items():
+                if entry["idty"] and entry["idty"]["username"] == username and now - entry["time"] < TTL:
+                    return pubkey, True
+            return None, now - directory["listed"] < TTL
+
+
+directory = IdentityDirectory()
+
+
+class Identities:
+    def __init__(self, node):
+        self.node = node
+        self.client = gvaReadClient(node)
+
+    def buildQuery(self, pubkeys):
+        # One aliased idty field by pubkey
+        variables = ", ".join("$pk{0}: PubKeyGva!".format(i) for i in range(len(pubkeys)))
+        fields = "\n".join(
+            "i{0}: idty(pubkey: $pk{0}) {{ isMember username }}".format(i) for i in range(len(pubkeys))
+        )
+        params = {"pk{0}".format(i): pubkey for i, pubkey in enumerate(pubkeys)}
+        return gql("query ({0}) {{ {1} }}".format(variables, fields)), params
+
+    def resolve(self, pubkeys):
+        # Identities of the pubkeys, the unknown ones in one request by chunk.
+        # Names are a convenience: a failed request leaves them unresolved.
+        identities, missing = directory.getMany(pubkeys)
+        resolved = {}
+        for start in range(0, len(missing), CHUNK_SIZE):
+            chunk = missing[start : start + CHUNK_SIZE]
+            query, params = self.buildQuery(chunk)
+            try:
+                result = self.client.execute(query, variable_values=params)
+            except Exception as e:
+                sys.stderr.write("Echec de la résolution des identités:\n" + str(e) + "\n")
+                break
+            for i, pubkey in enumerate(chunk):
+                resolved[pubkey] = result.get("i{0}".format(i))
+        if resolved:
+            directory.putMany(resolved)
+        identities.update(resolved)
+        return identities
+
+    def usernames(self, pubkeys):
+        # Username by pubkey, only for the pubkeys having an identity
+        return {
+            pubkey: idty["username"] for pubkey, idty in self.resolve(pubkeys).items() if idty
+        }
+
+    def pubkey(self, username):
+        # Pubkey of a username, from the directory first. Otherwise the
+        # wallets are read page by page until the username shows up, their
+        # identities going to the directory.
+        pubkey, known = directory.pubkey(username)
+        if known:
+            return pubkey
+        cursor = None
+        while True:
+            try:
+                result = self.client.execute(
+                    WALLETS_QUERY, variable_values={"cursor": cursor, "pageSize": SCAN_PAGE_SIZE}
+                )
+            except Exception as e:
+                sys.stderr.write("Echec de la recherche du pseudonyme:\n" + str(e) + "\n")
+                sys.exit(1)
+            wallets = result["wallets"]
+            identities = {edge["node"]["script"]: edge["node"]["idty"] for edge in wallets["edges"]}
+            listed = not wallets["pageInfo"]["hasNextPage"]
+            directory.putMany(identities, listed)
+            for pubkey, idty in identities.items():
+                if idty and idty["username"] == username:
+                    return pubkey
+            if listed:
+                return None
+            cursor = wallets["pageInfo"]["endCursor"]
@@ -3,8 +3,9 @@
 import sys, re, os.path, json, ast
 from termcolor import colored
 from lib.natools import fmt, sign, get_privkey
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import gql
+from lib.gvaClient import gvaClient
+from lib.resilience import errorMessage
 
 PUBKEY_REGEX = "(?![OIl])[0-9A-Za-z]{42,45}"
 
@@ -38,8 +39,7 @@ class Transaction:
 
 
         # Define Duniter GVA node
-        transport = AIOHTTPTransport(url=node)
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
+        self.client = gvaClient(node)
 
     def genDoc(self):
         # Build TX generation document
@@ -71,7 +71,7 @@ class Transaction:
             if self.verbose: print(self.txDoc[0])
             return self.txDoc
         except Exception as e:
-            message = ast.literal_eval(str(e))["message"]
+            message = errorMessage(e)
             sys.stderr.write("Echec de la génération du document:\n" + message + "\n")
             raise
 
@@ -139,7 +139,7 @@ class Transaction:
             try:
                 txResult.append(str(self.client.execute(querySign, variable_values=paramsSign)))
             except Exception as e:
-                message = ast.literal_eval(str(e))["message"]
+                message = errorMessage(e)
                 sys.stderr.write("Echec de la transaction:\n" + message + "\n")
                 if self.verbose:
                     sys.stderr.write("Document final:\n" + docs)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import sys, asyncio
+from gql import gql, Client
+from lib.resilience import gvaTransport
+from gql.transport.websockets import WebsocketsTransport
+from lib.gvaBlocks import BLOCK_FIELDS, blockPubkeys
+from lib.nodeMeta import NodeMeta
+from lib import jsonCodec
+
+NEW_BLOCKS = "subscription {{ newBlocks {{ {0} }} }}".format(BLOCK_FIELDS)
+
+
+def subscriptionUrl(node):
+    # GVA serves subscriptions on "<gva path>-sub" over WebSocket
+    if node.startswith("https://"):
+        return "wss://" + node[len("https://") :] + "-sub"
+    if node.startswith("http://"):
+        return "ws://" + node[len("http://") :] + "-sub"
+    return node + "-sub"
+
+
+class Subscribe:
+    def __init__(self, node, pubkeys, maxBackoff=60):
+        self.node = node
+        self.url = subscriptionUrl(node)
+        self.pubkeys = set(pubkeys)
+        self.maxBackoff = maxBackoff
+
+    def event(self, data):
+        print(jsonCodec.dumps(data), flush=True)
+
+    async def refreshBalances(self, session, pubkeys):
+        # One aliased request for all the accounts touched by a block
+        pubkeys = sorted(pubkeys)
+        variables = ", ".join("$s{0}: PkOrScriptGva!".format(i) for i in range(len(pubkeys)))
+        fields = "\n".join(
+            "b{0}: balance(script: $s{0}) {{ amount base }}".format(i)
+            for i in range(len(pubkeys))
+        )
+        params = {"s{0}".format(i): "SIG({0})".format(p) for i, p in enumerate(pubkeys)}
+        try:
+            result = await session.execute(
+                gql("query ({0}) {{ {1} }}".format(variables, fields)),
+                variable_values=params,
+            )
+        except Exception as e:
+            sys.stderr.write("Failed to refresh balances:\n" + str(e) + "\n")
+            return
+
+        for i, pubkey in enumerate(pubkeys):
+            balance = result["b{0}".format(i)]
+            self.event(
+                {
+                    "event": "balance",
+                    "pubkey": pubkey,
+                    "balance": balance["amount"] / 100 if balance else None,
+                }
+            )
+
+    async def onBlock(self, session, block):
+        touched = blockPubkeys(block) & self.pubkeys
+        if block.get("dividend"):
+            # Every member balance changes with a new UD, cached UD is outdated
+            NodeMeta(self.node).expire()
+            self.event(
+                {
+                    "event": "ud",
+                    "number": block["number"],
+                    "amount": block["dividend"],
+                    "base": block["unitBase"],
+                }
+            )
+        else:
+            # Metadata cached BLOCKS_TTL blocks before this one is outdated too
+            NodeMeta(self.node).seen(block["number"])
+        if not touched:
+            return
+
+        for transaction in block["transactions"]:
+            involved = blockPubkeys({"transactions": [transaction]})
+            for pubkey in sorted(involved & touched):
+                self.event(
+                    {
+                        "event": "transaction",
+                        "number": block["number"],
+                        "time": block["medianTime"],
+                        "pubkey": pubkey,
+                        "issuers": transaction["issuers"],
+                        "outputs": transaction["outputs"],
+                        "comment": transaction["comment"],
+                        "hash": transaction["hash"],
+                    }
+                )
+        await self.refreshBalances(session, touched)
+
+    async def listen(self):
+        subscription = Client(
+            transport=WebsocketsTransport(url=self.url),
+            fetch_schema_from_transport=False,
+        )
+        queries = Client(
+            transport=gvaTransport(self.node),
+            fetch_schema_from_transport=False,
+        )
+        async with subscription as wsSession, queries as httpSession:
+            async for result in wsSession.subscribe(gql(NEW_BLOCKS)):
+                blocks = result["newBlocks"]
+                if isinstance(blocks, dict):
+                    blocks = [blocks]
+                for block in blocks:
+                    self.event(
+                        {
+                            "event": "block",
+                            "number": block["number"],
+                            "hash": block["hash"],
+                            "time": block["medianTime"],
+                        }
+                    )
+                    await self.onBlock(httpSession, block)
+
+    async def run(self):
+        # Keep a single WebSocket open, reconnect with exponential backoff
+        backoff = 1
+        while True:
+            try:
+                await self.listen()
+                backoff = 1
+            except Exception as e:
+                sys.stderr.write(
+                    "Subscription to {0} lost:\n{1}\n".format(self.url, str(e))
+                )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.maxBackoff)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import sys, time, asyncio
+from gql import gql, Client
+from lib.resilience import gvaTransport
+from lib.gvaBlocks import BLOCK_FIELDS
+from lib.chainStore import ChainStore
+from lib.nodeMeta import NodeMeta
+
+
+class SyncBlocks:
+    def __init__(self, node, store=None, jobs=4, batch=50):
+        self.node = node
+        self.store = store or ChainStore(currency=NodeMeta(node).get()["currency"])
+        self.jobs = jobs
+        self.batch = batch
+
+    def blocksQuery(self, numbers):
+        # Aliased block() fields, one request for a whole batch of numbers
+        fields = "\n".join(
+            "b{0}: block(number: {0}) {{ {1} }}".format(number, BLOCK_FIELDS)
+            for number in numbers
+        )
+        return gql("query {{ {0} }}".format(fields))
+
+    async def currentNumber(self, session):
+        result = await session.execute(gql("query { currentBlock { number } }"))
+        return result["currentBlock"]["number"]
+
+    async def worker(self, session, queue, progress):
+        while True:
+            numbers = await queue.get()
+            try:
+                result = None
+                for attempt in range(3):
+                    try:
+                        result = await session.execute(self.blocksQuery(numbers))
+                        break
+                    except Exception as e:
+                        if attempt == 2:
+                            sys.stderr.write(
+                                "Failed to fetch blocks {0}-{1}:\n{2}\n".format(
+                                    numbers[0], numbers[-1], str(e)
+                                )
+                            )
+                        else:
+                            await asyncio.sleep(2**attempt)
+                if result is None:
+                    progress["failed"] += len(numbers)
+                else:
+                    blocks = [block for block in result.values() if block]
+                    self.store.addBlocks(blocks)
+                    progress["done"] += len(blocks)
+            except Exception as e:
+                # The worker keeps consuming, the blocks of a batch which
+                # cannot be stored are fetched again by the next sync
+                sys.stderr.write(
+                    "Failed to store blocks {0}-{1}:\n{2}\n".format(numbers[0], numbers[-1], str(e))
+                )
+                progress["failed"] += len(numbers)
+            finally:
+                queue.task_done()
+
+    async def sync(self, start=0, end=None):
+        client = Client(
+            transport=gvaTransport(self.node), fetch_schema_from_transport=False
+        )
+        async with client as session:
+            if end is None:
+                end = await self.currentNumber(session)
+                NodeMeta(self.node).seen(end)
+
+            # Resume: only the blocks of the range not already stored are fetched
+            missing = self.store.missingNumbers(start, end)
+            progress = {"done": 0, "failed": 0, "total": len(missing)}
+            if not missing:
+                return progress
+
+            # Bounded queue and a fixed pool of workers bound the parallelism
+            queue = asyncio.Queue(maxsize=self.jobs * 2)
+            workers = [
+                asyncio.ensure_future(self.worker(session, queue, progress))
+                for _ in range(self.jobs)
+            ]
+            startTime = time.time()
+            for i in range(0, len(missing), self.batch):
+                await queue.put(missing[i : i + self.batch])
+                if i and i % (self.batch * 100) == 0:
+                    sys.stderr.write(
+                        "{0}/{1} blocks ({2:.0f} blocks/s)\n".format(
+                            progress["done"],
+                            progress["total"],
+                            progress["done"] / (time.time() - startTime),
+                        )
+                    )
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+
+        return progress
+
+    def run(self, start=0, end=None):
+        return asyncio.run(self.sync(start, end))
@@ -2,9 +2,10 @@
 
 import sys
 import json
-from gql import gql, Client
-from gql.transport.aiohttp import AIOHTTPTransport
+from gql import gql
+from lib.gvaClient import gvaClient
 from lib.natools import fmt, sign, get_privkey
+from lib import jsonCodec
 
 
 class ListWallets:
@@ -18,9 +19,9 @@ class ListWallets:
         self.brut = brut  # Output format flag (brut or JSON)
         self.map = map  # Output format flag (map or list)
 
-        # Define Duniter GVA node
-        transport = AIOHTTPTransport(url=node)
-        self.client = Client(transport=transport, fetch_schema_from_transport=True)
+        # Define Duniter GVA node. All the wallets come in one answer, which
+        # takes longer than the request timeout on a real node.
+        self.client = gvaClient(node, bounded=False)
 
     def sendDoc(self):
         # Define the GraphQL query to retrieve wallet information
@@ -97,4 +98,4 @@ class ListWallets:
             return "\n".join(names)
         else:
             # Return JSON data in either map or list format
-            return json.dumps(walletMap if self.map else walletList, indent=2)
+            return jsonCodec.dumps(walletMap if self.map else walletList, indent=2)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import sys, os.path, json, time
+from gql import gql
+from lib.gvaClient import gvaClient
+from lib import jsonCodec
+
+# Number of watched pubkeys merged in one aliased GVA request
+CHUNK_SIZE = 50
+# Seconds a transaction hash stays remembered: written ones are behind
+# lastSeen by then, pending ones left the mempool
+RETENTION = int(os.getenv("WATCH_RETENTION") or 86400)
+# Seconds the time of a block (median time of the previous ones) lags
+# behind the clock, a payment written right after an invoice may be older
+MEDIAN_TIME_LAG = int(os.getenv("WATCH_TIME_LAG") or 3600)
+
+TX_FIELDS = """
+    issuers
+    outputs
+    comment
+    blockstamp
+    hash
+"""
+
+
+def outputsTo(outputs, pubkey):
+    # Sum of the outputs sent to pubkey, in cents of the current base
+    total = 0
+    for output in outputs:
+        amount, base, condition = output.split(":", 2)
+        if condition == "SIG({0})".format(pubkey):
+            total += int(amount) * pow(10, int(base))
+    return total
+
+
+class InvoiceIndex:
+    def __init__(self, defaultPubkey):
+        self.defaultPubkey = defaultPubkey
+        self.invoices = {}
+        self.byComment = {}
+        self.byAmount = {}
+        self.closed = set()
+
+    def add(self, invoice):
+        idInvoice = str(invoice["id"])
+        if idInvoice in self.invoices or idInvoice in self.closed:
+            return
+        pubkey = invoice.get("pubkey") or self.defaultPubkey
+        comment = invoice.get("comment")
+        amount = invoice.get("amount")
+        amount = int(round(float(amount) * 100)) if amount is not None else None
+        # Creation time of the invoice, when it is first read by default
+        created = invoice.get("time")
+        if created is None:
+            created = time.time()
+        self.invoices[idInvoice] = (pubkey, comment, amount, created)
+
+        # Invoices with a comment are matched on it, the others on their amount
+        if comment:
+            self.byComment.setdefault((pubkey, comment.strip()), []).append(idInvoice)
+        elif amount is not None:
+            self.byAmount.setdefault((pubkey, amount), []).append(idInvoice)
+
+    def close(self, idInvoice):
+        pubkey, comment, amount, _ = self.invoices.pop(idInvoice)
+        self.closed.add(idInvoice)
+        key, index = (
+            ((pubkey, comment.strip()), self.byComment)
+            if comment
+            else ((pubkey, amount), self.byAmount)
+        )
+        index[key].remove(idInvoice)
+        if not index[key]:
+            del index[key]
+
+    def match(self, pubkey, comment, amount, txTime):
+        # Only the invoices created before the transaction: an older payment
+        # never pays a new invoice
+        def created(key, index):
+            return [idInvoice for idInvoice in index.get(key, []) if self.invoices[idInvoice][3] < txTime]
+
+        candidates = created((pubkey, (comment or "").strip()), self.byComment)
+        if candidates:
+            idInvoice = candidates[0]
+            expected = self.invoices[idInvoice][2]
+            if expected is None or amount >= expected:
+                return idInvoice
+            return None
+        candidates = created((pubkey, amount), self.byAmount)
+        return candidates[0] if candidates else None
+
+    def pubkeys(self):
+        return sorted({invoice[0] for invoice in self.invoices.values()})
+
+
+class Watch:
+    def __init__(self, node, pubkey, invoicesFile, pageSize=20):
+        self.invoicesFile = invoicesFile
+        self.invoicesMtime = None
+        self.pageSize = pageSize
+        self.index = InvoiceIndex(pubkey)
+
+        # Transaction hashes already emitted with the time they were first
+        # seen, and newest written hash per pubkey
+        self.pending = {}
+        self.written = {}
+        self.lastSeen = {}
+
+        # Define Duniter GVA node
+        self.client = gvaClient(node)
+
+    def loadInvoices(self):
+        # (Re)load invoices file when it changed, closed invoices are kept closed
+        if self.invoicesFile == "-":
+            if self.invoicesMtime is None:
+                self.invoicesMtime = 0
+                self.parseInvoices(sys.stdin.read())
+            return
+        try:
+            mtime = os.path.getmtime(self.invoicesFile)
+        except OSError as e:
+            sys.stderr.write("Unable to read invoices file:\n" + str(e) + "\n")
+            sys.exit(1)
+        if mtime != self.invoicesMtime:
+            self.invoicesMtime = mtime
+            with open(self.invoicesFile, "r") as f:
+                self.parseInvoices(f.read())
+
+    def parseInvoices(self, content):
+        content = content.strip()
+        if content.startswith("["):
+            invoices = json.loads(content)
+        else:
+            invoices = [json.loads(line) for line in content.splitlines() if line.strip()]
+        for invoice in invoices:
+            self.index.add(invoice)
+
+    def buildQuery(self, pubkeys, cursors):
+        # One aliased request for a chunk of pubkeys, mempool and blockchain together
+        variables = []
+        fields = []
+        params = {}
+        for i, pubkey in enumerate(pubkeys):
+            variables.append("$s{0}: PkOrScriptGva!".format(i))
+            params["s{0}".format(i)] = "SIG({0})".format(pubkey)
+            cursor = cursors.get(pubkey)
+            pagination = "{{ pageSize: {0}, ord: DESC{1} }}".format(
+                self.pageSize, ', cursor: "{0}"'.format(cursor) if cursor else ""
+            )
+            # Mempool is only read with the first page of each pubkey
+            if not cursor:
+                variables.append("$pk{0}: PubKeyGva!".format(i))
+                params["pk{0}".format(i)] = pubkey
+                fields.append(
+                    "mp{0}: txsHistoryMp(pubkey: $pk{0}) {{ receiving {{ {1} receivedTime }} }}".format(
+                        i, TX_FIELDS
+                    )
+                )
+            fields.append(
+                """bc{0}: txsHistoryBc(script: $s{0}, pagination: {1}) {{
+                    received {{
+                        pageInfo {{ hasNextPage endCursor }}
+                        edges {{ node {{ {2} writtenTime }} }}
+                    }}
+                }}""".format(
+                    i, pagination, TX_FIELDS
+                )
+            )
+
+        query = "query ({0}) {{ {1} }}".format(", ".join(variables), "\n".join(fields))
+        return gql(query), params
+
+    def event(self, status, idInvoice, pubkey, transaction, amount, txTime):
+        print(
+            jsonCodec.dumps(
+                {
+                    "event": status,
+                    "invoice": idInvoice,
+                    "pubkey": pubkey,
+                    "issuer": transaction["issuers"][0],
+                    "amount": amount / 100,
+                    "comment": transaction["comment"],
+                    "time": txTime,
+                    "blockstamp": transaction["blockstamp"],
+                    "hash": transaction["hash"],
+                }
+            ),
+            flush=True,
+        )
+
+    def handlePending(self, pubkey, transaction):
+        txHash = transaction["hash"]
+        if txHash in self.pending or txHash in self.written:
+            return
+        amount = outputsTo(transaction["outputs"], pubkey)
+        idInvoice = self.index.match(pubkey, transaction["comment"], amount, transaction["receivedTime"])
+        self.pending[txHash] = (idInvoice, time.time())
+        if idInvoice:
+            self.event("pending", idInvoice, pubkey, transaction, amount, transaction["receivedTime"])
+
+    def handleWritten(self, pubkey, transaction):
+        txHash = transaction["hash"]
+        self.written[txHash] = time.time()
+        idInvoice, _ = self.pending.pop(txHash, (None, None))
+        amount = outputsTo(transaction["outputs"], pubkey)
+        if not idInvoice or idInvoice not in self.index.invoices:
+            idInvoice = self.index.match(
+                pubkey, transaction["comment"], amount, transaction["writtenTime"] + MEDIAN_TIME_LAG
+            )
+        if idInvoice:
+            self.index.close(idInvoice)
+            self.event("written", idInvoice, pubkey, transaction, amount, transaction["writtenTime"])
+
+    def pollChunk(self, pubkeys):
+        # Newest written hash of the pubkeys read up to the last transaction
+        # seen (None without any). A pubkey whose catch-up failed keeps its
+        # lastSeen, the next poll reads its history again from the top.
+        cursors = {}
+        newest = {}
+        caughtUp = {}
+        while pubkeys:
+            queryBuild, paramsBuild = self.buildQuery(pubkeys, cursors)
+            try:
+                result = self.client.execute(queryBuild, variable_values=paramsBuild)
+            except Exception as e:
+                sys.stderr.write("Failed to retrieve the history:\n" + str(e) + "\n")
+                return caughtUp
+
+            nextPubkeys = []
+            for i, pubkey in enumerate(pubkeys):
+                if not cursors.get(pubkey):
+                    for transaction in result["mp{0}".format(i)]["receiving"]:
+                        self.handlePending(pubkey, transaction)
+
+                # Newest first: stop at the last transaction seen by the previous poll
+                received = result["bc{0}".format(i)]["received"]
+                reachedKnown = False
+                newWritten = []
+                for edge in received["edges"]:
+                    transaction = edge["node"]
+                    if transaction["hash"] == self.lastSeen.get(pubkey):
+                        reachedKnown = True
+                        break
+                    newWritten.append(transaction)
+                if pubkey not in cursors:
+                    newest[pubkey] = newWritten[0]["hash"] if newWritten else self.lastSeen.get(pubkey)
+
+                # A first poll only seeds lastSeen from the newest page, the
+                # payments written before the watch pay no invoice
+                if pubkey not in self.lastSeen:
+                    caughtUp[pubkey] = newest[pubkey]
+                    continue
+                for transaction in reversed(newWritten):
+                    if transaction["hash"] not in self.written:
+                        self.handleWritten(pubkey, transaction)
+
+                # Later polls catch up fully
+                if not reachedKnown and received["pageInfo"]["hasNextPage"]:
+                    cursors[pubkey] = received["pageInfo"]["endCursor"]
+                    nextPubkeys.append(pubkey)
+                else:
+                    caughtUp[pubkey] = newest[pubkey]
+            pubkeys = nextPubkeys
+        return caughtUp
+
+    def prune(self):
+        horizon = time.time() - RETENTION
+        self.pending = {txHash: entry for txHash, entry in self.pending.items() if entry[1] >= horizon}
+        self.written = {txHash: seen for txHash, seen in self.written.items() if seen >= horizon}
+
+    def poll(self):
+        self.loadInvoices()
+        self.prune()
+        pubkeys = self.index.pubkeys()
+        for i in range(0, len(pubkeys), CHUNK_SIZE):
+            self.lastSeen.update(self.pollChunk(pubkeys[i : i + CHUNK_SIZE]))
+
+    def run(self, interval=5, once=False):
+        while True:
+            self.poll()
+            # Invoices read from stdin cannot grow, stop once they are all paid
+            if once or (self.invoicesFile == "-" and not self.index.invoices):
+                return
+            time.sleep(interval)
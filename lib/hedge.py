@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+import os, time, queue, atexit, threading
+from lib.gvaClient import gvaClient
+from lib.nodeRanking import NodeRanking
+from lib.localCache import cachePath, loadJson, saveJson
+from lib import resilience, jsonCodec
+
+# Hedging of idempotent reads: None (off), "delay" (second node after a
+# delay) or "race" (two nodes at once)
+MODE = None
+# Seconds before hedging when the latency of the node is not known yet
+DEFAULT_DELAY = float(os.getenv("HEDGE_DELAY") or 0.5)
+MIN_DELAY = 0.05
+# Hedged requests running at once, beyond it reads go to one node only
+_hedges = threading.BoundedSemaphore(int(os.getenv("HEDGE_MAX") or 4))
+
+# Recent latencies by URL, kept next to the node ranking: the hedging delay
+# follows their 90th percentile from one command to the next
+_latencies = None
+_latenciesDirty = False
+_latenciesLock = threading.Lock()
+WINDOW = 50
+
+
+def configure(mode):
+    global MODE
+    MODE = mode
+
+
+def latencies():
+    # Called with the lock held
+    global _latencies
+    if _latencies is None:
+        _latencies = loadJson(cachePath("latencies.json")) or {}
+        atexit.register(saveLatencies)
+    return _latencies
+
+
+def saveLatencies():
+    with _latenciesLock:
+        if _latenciesDirty:
+            saveJson(cachePath("latencies.json"), _latencies)
+
+
+def recordLatency(url, latency):
+    global _latenciesDirty
+    with _latenciesLock:
+        samples = latencies().setdefault(url, [])
+        samples.append(round(latency, 3))
+        del samples[:-WINDOW]
+        _latenciesDirty = True
+
+
+def hedgeDelay(url, rankedLatency=None):
+    if MODE == "race":
+        return 0
+    with _latenciesLock:
+        samples = sorted(latencies().get(url, []))
+    if len(samples) >= 5:
+        return max(MIN_DELAY, samples[int(len(samples) * 0.9)])
+    # The probe of the ranking is a tiny query, real reads take a few times longer
+    if rankedLatency:
+        return max(MIN_DELAY, rankedLatency * 3)
+    return DEFAULT_DELAY
+
+
+def alternates(kind, primary):
+    # Other healthy endpoints, HEDGE_NODES / HEDGE_PODS first when configured
+    configured = (os.getenv("HEDGE_NODES" if kind == "nodes" else "HEDGE_PODS") or "").split()
+    ranking = NodeRanking()
+    ranked = ranking.nodes(primary) if kind == "nodes" else ranking.pods(primary)
+    rankedLatencies = {entry["url"]: entry["latency"] for entry in ranked}
+    urls = [
+        url
+        for url in configured + list(rankedLatencies)
+        if url != primary and not resilience.breakers.isOpen(url)
+    ]
+    return list(dict.fromkeys(urls)), rankedLatencies
+
+
+def launch(call, url, answers, slot=None):
+    # One leg of a hedged read in its own thread, its answer or error in answers
+    def leg():
+        start = time.monotonic()
+        try:
+            answer = call(url)
+        except Exception as e:
+            answers.put((None, e))
+        else:
+            recordLatency(url, time.monotonic() - start)
+            answers.put((answer, None))
+        finally:
+            if slot:
+                slot.release()
+
+    threading.Thread(target=leg, daemon=True).start()
+
+
+def hedged(call, primary, alternate, delay, valid=lambda result: True):
+    # First valid answer of the primary, or of the alternate launched once the
+    # delay is over or the primary failed. The slower leg is left to finish
+    # in the background, its answer is dropped.
+    answers = queue.Queue()
+    launch(call, primary, answers)
+    running, hedgeSent = 1, False
+    result = error = None
+    while running:
+        try:
+            answer, failure = answers.get(timeout=None if hedgeSent else delay)
+        except queue.Empty:
+            pass
+        else:
+            running -= 1
+            if failure is not None:
+                error = failure
+            elif valid(answer):
+                return answer
+            else:
+                result = answer
+        if not hedgeSent and alternate:
+            hedgeSent = True
+            if _hedges.acquire(blocking=False):
+                launch(call, alternate, answers, _hedges)
+                running += 1
+    if result is None and error:
+        raise error
+    return result
+
+
+class HedgedGvaClient:
+    # Same execute() as a gql Client, over a primary and an alternate node
+    def __init__(self, node, alternate, delay):
+        self.node = node
+        self.alternate = alternate
+        self.delay = delay
+
+    def execute(self, query, variable_values=None):
+        # Each leg keeps the timeouts, retries, breakers and recording of
+        # ResilientClient, the other leg replaces its rerouting
+        def call(node):
+            return gvaClient(node, reroute=False).execute(query, variable_values=variable_values)
+
+        return hedged(call, self.node, self.alternate, self.delay)
+
+
+def gvaReadClient(node):
+    # Client for idempotent GVA reads, hedged when enabled
+    if not MODE:
+        return gvaClient(node)
+    others, ranked = alternates("nodes", node)
+    if not others:
+        return gvaClient(node)
+    return HedgedGvaClient(node, others[0], hedgeDelay(node, ranked.get(node)))
+
+
+class HttpResponse:
+    # The parts of a requests response used by the Cesium+ classes
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return jsonCodec.loads(self.content)
+
+
+def readPost(pod, path, **kwargs):
+    # POST of an idempotent Cesium+ read (searches), hedged when enabled
+    if not MODE:
+        return resilience.post(pod, path, idempotent=True, **kwargs)
+    others, ranked = alternates("pods", pod)
+    if not others:
+        return resilience.post(pod, path, idempotent=True, **kwargs)
+
+    def call(url):
+        return resilience.post(url, path, idempotent=True, reroute=False, **kwargs)
+
+    return hedged(
+        call,
+        pod,
+        others[0],
+        hedgeDelay(pod, ranked.get(pod)),
+        lambda response: response.status_code == 200,
+    )
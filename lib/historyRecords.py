@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import csv
+from lib import jsonCodec
+from array import array
+from datetime import datetime, timezone
+
+# Directions where the account is the issuer of the transaction
+OUTGOING = ("SENT", "SENDING")
+
+
+class HistoryRecord:
+    __slots__ = (
+        "status",
+        "time",
+        "pubkey",
+        "amount",
+        "amountUD",
+        "comment",
+        "base",
+        "blockstamp",
+        "hash",
+    )
+
+    def __init__(self, status, time, pubkey, amount, amountUD, comment, base, blockstamp, hash):
+        self.status = status
+        self.time = time
+        self.pubkey = pubkey
+        self.amount = amount
+        self.amountUD = amountUD
+        self.comment = comment
+        self.base = base
+        self.blockstamp = blockstamp
+        self.hash = hash
+
+
+def parseTransaction(status, transaction, txTime, currentBase, amountUD, account):
+    # Outputs "amount:base:condition": received, the sum of the outputs to the
+    # account; sent, the sum of the others (the change comes back to the
+    # account), the counterparty being the recipient of the first one
+    received = status not in OUTGOING
+    accountCondition = "SIG({0})".format(account)
+    pubkey = transaction["issuers"][0] if received else account
+    total = 0
+    base = None
+    for output in transaction["outputs"]:
+        amount, outputBase, condition = output.split(":", 2)
+        if (condition == accountCondition) != received:
+            continue
+        if base is None:
+            base = int(outputBase)
+            if not received:
+                pubkey = condition[4:-1] if condition.startswith("SIG(") else condition
+        total += int(amount) * pow(10, int(outputBase) - currentBase)
+    if base is None:
+        base = int(transaction["outputs"][0].split(":", 2)[1])
+    amount = round((total if received else -total) / 100, 2)
+
+    return HistoryRecord(
+        status,
+        txTime,
+        pubkey,
+        amount,
+        amountUD(amount, txTime),
+        transaction["comment"],
+        base,
+        transaction["blockstamp"],
+        transaction["hash"],
+    )
+
+
+class HistoryColumns:
+    # Column arrays of a history: times and amounts in cents as machine integers,
+    # counterparties as indexes into a table of distinct pubkeys
+    def __init__(self):
+        self.times = array("q")
+        self.amounts = array("q")
+        self.counterparties = array("l")
+        self.pubkeys = []
+        self.pubkeyIndex = {}
+
+    def index(self, pubkey):
+        index = self.pubkeyIndex.get(pubkey)
+        if index is None:
+            index = self.pubkeyIndex[pubkey] = len(self.pubkeys)
+            self.pubkeys.append(pubkey)
+        return index
+
+    def append(self, txTime, amount, pubkey):
+        self.times.append(txTime)
+        self.amounts.append(int(round(amount * 100)))
+        self.counterparties.append(self.index(pubkey))
+
+    def addDividends(self, dividends, pubkey):
+        # Universal dividends (time, amount in cents) of the account, created by
+        # the account itself, merged by time (newest first, as the transactions)
+        index = self.index(pubkey)
+        rows = sorted(
+            list(zip(self.times, self.amounts, self.counterparties))
+            + [(udTime, amount, index) for udTime, amount in dividends],
+            key=lambda row: row[0],
+            reverse=True,
+        )
+        self.times = array("q", (row[0] for row in rows))
+        self.amounts = array("q", (row[1] for row in rows))
+        self.counterparties = array("l", (row[2] for row in rows))
+        return self
+
+    def extend(self, records):
+        for record in records:
+            self.append(record.time, record.amount, record.pubkey)
+        return self
+
+    def __len__(self):
+        return len(self.times)
+
+
+def historyStats(columns, top=10):
+    # Totals in and out by day, month and counterparty, one pass over the columns
+    byDay = {}
+    byCounterparty = {}
+    dayNames = {}
+    totalIn = totalOut = countIn = countOut = 0
+
+    for txTime, amount, counterparty in zip(columns.times, columns.amounts, columns.counterparties):
+        day = txTime // 86400
+        dayTotals = byDay.get(day)
+        if dayTotals is None:
+            dayTotals = byDay[day] = [0, 0]
+        partyTotals = byCounterparty.get(counterparty)
+        if partyTotals is None:
+            partyTotals = byCounterparty[counterparty] = [0, 0, 0]
+
+        if amount >= 0:
+            dayTotals[0] += amount
+            partyTotals[0] += amount
+            totalIn += amount
+            countIn += 1
+        else:
+            dayTotals[1] -= amount
+            partyTotals[1] -= amount
+            totalOut -= amount
+            countOut += 1
+        partyTotals[2] += 1
+
+    # Months are derived from the (few) distinct days only
+    byMonth = {}
+    for day in sorted(byDay):
+        date = datetime.fromtimestamp(day * 86400, timezone.utc)
+        dayNames[day] = date.strftime("%Y-%m-%d")
+        monthTotals = byMonth.setdefault(date.strftime("%Y-%m"), [0, 0])
+        monthTotals[0] += byDay[day][0]
+        monthTotals[1] += byDay[day][1]
+
+    def totals(values):
+        return {"in": values[0] / 100, "out": values[1] / 100}
+
+    counterparties = sorted(
+        byCounterparty.items(), key=lambda item: item[1][0] + item[1][1], reverse=True
+    )
+
+    return {
+        "count": len(columns),
+        "in": {
+            "total": totalIn / 100,
+            "count": countIn,
+            "average": round(totalIn / countIn / 100, 2) if countIn else 0,
+        },
+        "out": {
+            "total": totalOut / 100,
+            "count": countOut,
+            "average": round(totalOut / countOut / 100, 2) if countOut else 0,
+        },
+        "days": {dayNames[day]: totals(byDay[day]) for day in sorted(byDay)},
+        "months": {month: totals(values) for month, values in byMonth.items()},
+        "topCounterparties": [
+            {
+                "pubkey": columns.pubkeys[index],
+                "in": values[0] / 100,
+                "out": values[1] / 100,
+                "count": values[2],
+            }
+            for index, values in counterparties[:top]
+        ],
+        "counterparties": {
+            columns.pubkeys[index]: {**totals(values), "count": values[2]}
+            for index, values in counterparties
+        },
+    }
+
+
+def balanceSeries(columns, step=86400, toUD=None, until=None, start=0):
+    # Running balance (in cents, from start) at the end of each step, oldest
+    # first. Columns come newest first from GVA, they are walked backwards.
+    series = []
+    count = len(columns)
+    if not count:
+        return series
+
+    balance = start
+    i = count - 1
+    bucket = columns.times[i] // step * step
+    last = (until or columns.times[0]) // step * step
+    while bucket <= last:
+        end = bucket + step
+        while i >= 0 and columns.times[i] < end:
+            balance += columns.amounts[i]
+            i -= 1
+        point = {"time": bucket, "balance": balance / 100}
+        if toUD:
+            point["balanceUD"] = round(toUD(balance, end), 2)
+        series.append(point)
+        bucket = end
+    return series
+
+
+# Stable column names of history exports, amounts in cents
+EXPORT_COLUMNS = (
+    "status",
+    "time",
+    "counterparty",
+    "amount",
+    "amountUD",
+    "comment",
+    "blockstamp",
+    "hash",
+)
+
+
+def exportRow(record):
+    return (
+        record.status,
+        record.time,
+        record.pubkey,
+        int(round(record.amount * 100)),
+        record.amountUD,
+        record.comment,
+        record.blockstamp,
+        record.hash,
+    )
+
+
+class CsvExport:
+    def __init__(self, out):
+        self.writer = csv.writer(out)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, records):
+        self.writer.writerows(exportRow(record) for record in records)
+
+
+class NdjsonExport:
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, records):
+        self.out.writelines(
+            jsonCodec.dumps(dict(zip(EXPORT_COLUMNS, exportRow(record)))) + "\n"
+            for record in records
+        )
+
+
+class ColumnarExport:
+    # One JSON object of columns per received page, like record batches
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, records):
+        if not records:
+            return
+        rows = [exportRow(record) for record in records]
+        columns = dict(zip(EXPORT_COLUMNS, (list(column) for column in zip(*rows))))
+        self.out.write(jsonCodec.dumps(columns) + "\n")
+
+
+EXPORTS = {"csv": CsvExport, "ndjson": NdjsonExport, "columnar": ColumnarExport}
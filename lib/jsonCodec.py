@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+# JSON of the answers and of the outputs, with orjson when it is installed
+# and JSON_CODEC is not "json". Signed documents always go through the json
+# module: their hash depends on its exact serialization.
+
+import os, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if (os.getenv("JSON_CODEC") or "auto") == "json":
+    orjson = None
+
+
+def loads(data):
+    # str or bytes, the bytes of an answer need no decoding with orjson
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent=None, sort_keys=False, ensure_ascii=True):
+    # orjson only indents by 2 and rejects some values (huge integers),
+    # the json module covers the rest
+    if orjson and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option).decode()
+        except TypeError:
+            pass
+    return json.dumps(obj, indent=indent, sort_keys=sort_keys, ensure_ascii=ensure_ascii)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import json, time, random, asyncio
+import aiohttp
+from graphql import print_ast
+from lib.messaging import ReadFromCesium
+from lib.profiles import Profiles
+from lib.stars import ReadLikes
+from lib.gvaHistory import History
+from lib import esQuery, jsonCodec
+
+WORKLOADS = ("messages", "profiles", "stars", "history", "wallets", "genTx")
+# Relative weights of each workload in the default mix
+DEFAULT_MIX = "messages=3,profiles=3,stars=2,history=2,wallets=1,genTx=1"
+
+WALLETS_QUERY = """
+query ($cursor: String, $pageSize: Int!) {
+    wallets(pagination: { cursor: $cursor, ord: ASC, pageSize: $pageSize }) {
+        pageInfo { hasNextPage endCursor }
+        edges { node { script balance { amount base } idty { isMember username } } }
+    }
+}
+"""
+
+GENTX_QUERY = """
+query ($recipient: PkOrScriptGva!, $issuer: PubKeyGva!, $amount: Int!, $comment: String!) {
+    genTx(amount: $amount, comment: $comment, issuer: $issuer, recipient: $recipient, useMempoolSources: false)
+}
+"""
+
+# Upper bounds of the latency histogram buckets, 1ms to about 16s
+BUCKETS = [0.001 * 2**i for i in range(15)]
+
+
+def parseMix(mix):
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in WORKLOADS:
+            raise ValueError("Unknown workload: " + kind)
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def bucketName(bound):
+    return "<={0:g}ms".format(bound * 1000) if bound < 1 else "<={0:g}s".format(bound)
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.dropped = 0
+
+    def add(self, kind, latency, ok):
+        self.latencies.setdefault(kind, []).append(latency)
+        if not ok:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, duration):
+        def summary(latencies, errors):
+            latencies = sorted(latencies)
+            count = len(latencies)
+            histogram = {}
+            i = 0
+            for bound in BUCKETS:
+                n = 0
+                while i < count and latencies[i] <= bound:
+                    n += 1
+                    i += 1
+                if n:
+                    histogram[bucketName(bound)] = n
+            if i < count:
+                histogram[">" + bucketName(BUCKETS[-1])[2:]] = count - i
+
+            def percentile(p):
+                return round(latencies[min(count - 1, int(count * p))] * 1000, 1)
+
+            return {
+                "requests": count,
+                "throughput": round(count / duration, 2),
+                "errors": errors,
+                "errorRate": round(errors / count, 4),
+                "latencyMs": {
+                    "p50": percentile(0.5),
+                    "p90": percentile(0.9),
+                    "p99": percentile(0.99),
+                    "max": round(latencies[-1] * 1000, 1),
+                },
+                "histogram": histogram,
+            }
+
+        allLatencies = [latency for latencies in self.latencies.values() for latency in latencies]
+        report = {"duration": round(duration, 2), "dropped": self.dropped}
+        if allLatencies:
+            report["total"] = summary(allLatencies, sum(self.errors.values()))
+        report["workloads"] = {
+            kind: summary(latencies, self.errors.get(kind, 0))
+            for kind, latencies in sorted(self.latencies.items())
+        }
+        return report
+
+
+class LoadGenerator:
+    def __init__(self, node, pod, rate=50, duration=10, workers=32, mix=DEFAULT_MIX, accounts=None):
+        self.node = node
+        self.pod = pod
+        self.rate = rate
+        self.duration = duration
+        self.workers = workers
+        self.weights = parseMix(mix)
+        self.accounts = list(accounts or [])
+        self.walletsCursor = None
+        self.historyQuery = None
+        self.stats = LoadStats()
+
+    async def loadAccounts(self, session):
+        # Accounts of the workloads: the given ones or the first page of wallets
+        if self.accounts:
+            return
+        async with session.post(
+            self.node, json={"query": WALLETS_QUERY, "variables": {"cursor": None, "pageSize": 200}}
+        ) as response:
+            edges = (await response.json(loads=jsonCodec.loads))["data"]["wallets"]["edges"]
+        self.accounts = [edge["node"]["script"] for edge in edges]
+        if not self.accounts:
+            raise ValueError("No account to run the workloads with")
+
+    def request(self, kind):
+        # (url, JSON body) of one request, built like the matching jaklis command
+        pubkey = random.choice(self.accounts)
+        if kind == "messages":
+            outbox = random.random() < 0.5
+            reader = ReadFromCesium(pubkey, self.pod, True)
+            return self.pod + reader.searchPath(outbox), json.loads(reader.configDoc(10, outbox))
+        if kind == "profiles":
+            document = Profiles(pubkey, self.pod, True).configDocGet(pubkey, "_id")
+            return self.pod + esQuery.searchPath(esQuery.PROFILES, esQuery.FIRST_HITS), json.loads(document)
+        if kind == "stars":
+            document = ReadLikes(pubkey, self.pod, True).configDoc(None)
+            return self.pod + esQuery.searchPath(esQuery.LIKES, esQuery.SCORED_HITS), json.loads(document)
+        if kind == "history":
+            if not self.historyQuery:
+                self.historyQuery = print_ast(History(None, self.node, pubkey).pageQuery().document)
+            variables = {"script": "SIG({0})".format(pubkey), "number": 100, "cursor": None}
+            return self.node, {"query": self.historyQuery, "variables": variables}
+        if kind == "wallets":
+            # Walks the wallet list page after page, then starts over
+            variables = {"cursor": self.walletsCursor, "pageSize": 500}
+            return self.node, {"query": WALLETS_QUERY, "variables": variables}
+        recipient = random.choice(self.accounts)
+        variables = {"issuer": pubkey, "recipient": recipient, "amount": 100, "comment": "load"}
+        return self.node, {"query": GENTX_QUERY, "variables": variables}
+
+    async def send(self, session, kind):
+        url, body = self.request(kind)
+        start = time.monotonic()
+        ok = False
+        try:
+            async with session.post(url, json=body) as response:
+                result = await response.json(content_type=None, loads=jsonCodec.loads)
+                ok = response.status == 200 and not result.get("errors")
+            if kind == "wallets" and ok:
+                pageInfo = result["data"]["wallets"]["pageInfo"]
+                self.walletsCursor = pageInfo["endCursor"] if pageInfo["hasNextPage"] else None
+        except Exception:
+            pass
+        self.stats.add(kind, time.monotonic() - start, ok)
+
+    async def worker(self, session, queue):
+        while True:
+            kind = await queue.get()
+            try:
+                await self.send(session, kind)
+            finally:
+                queue.task_done()
+
+    async def run(self):
+        kinds = list(self.weights)
+        weights = [self.weights[kind] for kind in kinds]
+        connector = aiohttp.TCPConnector(limit=self.workers)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await self.loadAccounts(session)
+            queue = asyncio.Queue(maxsize=self.workers)
+            workers = [
+                asyncio.ensure_future(self.worker(session, queue)) for _ in range(self.workers)
+            ]
+
+            # Open loop: requests are due at the target rate whatever the answer
+            # times. When every worker is busy and the queue is full, a request
+            # is dropped and counted, the server can not keep up.
+            start = time.monotonic()
+            sent = 0
+            while True:
+                elapsed = time.monotonic() - start
+                if elapsed >= self.duration:
+                    break
+                due = int(elapsed * self.rate) + 1
+                for kind in random.choices(kinds, weights, k=due - sent):
+                    try:
+                        queue.put_nowait(kind)
+                    except asyncio.QueueFull:
+                        self.stats.dropped += 1
+                sent = due
+                await asyncio.sleep(max(0, sent / self.rate - (time.monotonic() - start)))
+
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+        return self.stats.report(time.monotonic() - start)
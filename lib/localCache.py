@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import os, json, tempfile
+from pathlib import Path
+
+# While recording or replaying, the caches keyed by node live in memory only:
+# every request of the command is recorded, and the replay (on a new port)
+# finds them all
+_bypassed = False
+_memory = {}
+
+
+def bypass():
+    global _bypassed
+    _bypassed = True
+
+
+def cachePath(name):
+    # Local files of jaklis live in JAKLIS_CACHE, ~/.cache/jaklis by default
+    directory = Path(os.getenv("JAKLIS_CACHE") or Path.home() / ".cache" / "jaklis")
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / name
+
+
+def loadJson(path):
+    # Cached JSON document, None when missing or unreadable
+    if _bypassed:
+        return _memory.get(str(path))
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def saveJson(path, data):
+    # Atomic replace, several threads or processes may save at once
+    if _bypassed:
+        _memory[str(path)] = data
+        return
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmpPath, path)
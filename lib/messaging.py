@@ -1,9 +1,12 @@
-import os, sys, ast, requests, json, base58, base64
+import os, sys, ast, json, base58, base64
 from time import time
 from datetime import datetime
 from termcolor import colored
 from lib.natools import fmt, get_privkey, box_decrypt, box_encrypt
 from lib.cesiumCommon import CesiumCommon, pp_json, PUBKEY_REGEX
+from lib.hedge import readPost
+from lib.gvaIdentities import Identities
+from lib import resilience, esQuery, jsonCodec
 
 
 #################### Reading class ####################
@@ -14,37 +17,50 @@ class ReadFromCesium(CesiumCommon):
     def configDoc(self, nbrMsg, outbox):
         boxType = "issuer" if outbox else "recipient"
 
-        data = {}
-        data['sort'] = { "time": "desc" }
-        data['from'] = 0
-        data['size'] = nbrMsg
-        data['_source'] = ['issuer','recipient','title','content','time','nonce','read_signature']
-        data['query'] = {}
-        data['query']['bool'] = {}
-        data['query']['bool']['filter'] = {}
-        data['query']['bool']['filter']['term'] = {}
-        data['query']['bool']['filter']['term'][boxType] = self.pubkey
+        data = esQuery.search(
+            esQuery.filtered((boxType, self.pubkey)),
+            nbrMsg,
+            ['issuer','recipient','title','content','time','nonce'],
+            sort={ "time": "desc" },
+        )
 
         document = json.dumps(data)
         return document
 
-    def sendDocument(self, nbrMsg, outbox):
+    def searchPath(self, outbox):
         boxType = "outbox" if outbox else "inbox"
+        return esQuery.searchPath(esQuery.MESSAGES.format(boxType), esQuery.HITS)
 
+    def sendDocument(self, nbrMsg, outbox):
         document = self.configDoc(nbrMsg, outbox)
         headers = {
             'Content-type': 'application/json',
         }
 
         # Send JSON document and get JSON result
-        result = requests.post('{0}/message/{1}/_search'.format(self.pod, boxType), headers=headers, data=document)
+        result = readPost(self.pod, self.searchPath(outbox), headers=headers, data=document)
         if result.status_code == 200:
-            return result.json()["hits"]
+            return self.boxHits(jsonCodec.loads(result.content))
         else:
             sys.stderr.write("Echec de l'envoi du document de lecture des messages...\n" + result.text)
 
+    def boxHits(self, answer):
+        hits = answer.get("hits", {"total": 0})
+        hits.setdefault("hits", [])
+        return hits
+
+    def sendBoxes(self, nbrMsg):
+        # Inbox and outbox in one round trip
+        answers = self.multiSearch(
+            [(esQuery.MESSAGES.format("inbox"), self.configDoc(nbrMsg, False)),
+             (esQuery.MESSAGES.format("outbox"), self.configDoc(nbrMsg, True))],
+            esQuery.HITS,
+        )
+        return [self.boxHits(answer) if answer else None for answer in answers]
+
     # Parse JSON result and display messages
-    def readMessages(self, msgJSON, nbrMsg, outbox):
+    def readMessages(self, msgJSON, nbrMsg, outbox, usernames=None):
+        usernames = usernames or {}
         def decrypt(msg):
             if msg is None: return ''
             msg64 = base64.b64decode(msg)
@@ -74,10 +90,13 @@ class ReadFromCesium(CesiumCommon):
                     nonce = base58.b58decode('5aZdSqKGHBqm2uMPwN6XnfiiJKRieb1Hh')
                 self.dateS = msgSrc["time"]
                 date = datetime.fromtimestamp(self.dateS).strftime(", le %d/%m/%Y à %H:%M  ")
+                pubkey = msgSrc["recipient"] if outbox else self.issuer
+                if pubkey in usernames:
+                    pubkey = usernames[pubkey] + " (" + pubkey + ")"
                 if outbox:
-                    startHeader = "  À " + msgSrc["recipient"]
+                    startHeader = "  À " + pubkey
                 else:
-                    startHeader = "  De " + self.issuer
+                    startHeader = "  De " + pubkey
                 headerMsg = startHeader + date + "(ID: {})".format(self.idMsg) + "  "
 
                 print('-'.center(rows, '-'))
@@ -96,7 +115,8 @@ class ReadFromCesium(CesiumCommon):
             print(colored(infoTotal.center(rows, '#'), "yellow"))
     
     # Parse JSON result and display messages
-    def jsonMessages(self, msgJSON, nbrMsg, outbox):
+    def jsonMessages(self, msgJSON, nbrMsg, outbox, usernames=None):
+        usernames = usernames or {}
         def decrypt(msg):
             if msg is None: return ''
             msg64 = base64.b64decode(msg)
@@ -149,13 +169,27 @@ class ReadFromCesium(CesiumCommon):
                 data[i]['id'] = self.idMsg
                 data[i]['date'] = self.date
                 data[i]['pubkey'] = pubkey
+                if pubkey in usernames:
+                    data[i]['username'] = usernames[pubkey]
                 data[i]['title'] = self.title
                 data[i]['content'] = self.content
                 # print('toto')
 
-            data = json.dumps(data, indent=2)
+            data = jsonCodec.dumps(data, indent=2)
             return data
 
+    def usernames(self, *boxes):
+        # Usernames of the correspondents of the (hits, outbox) boxes, in one
+        # request to the GVA node
+        pubkeys = [
+            hits["_source"]["recipient" if outbox else "issuer"]
+            for box, outbox in boxes if box
+            for hits in box["hits"]
+        ]
+        if not self.node or not pubkeys:
+            return {}
+        return Identities(self.node).usernames(pubkeys)
+
 
 #################### Sending class ####################
 
@@ -191,9 +225,15 @@ class SendToCesium(CesiumCommon):
             'Content-type': 'application/json',
         }
 
+        path = '/message/{0}?pubkey={1}'.format(boxType, self.recipient)
+        queued = self.queue(path, document)
+        if queued:
+            print(colored(queued, "yellow"))
+            return
+
         # Send JSON document and get result
         try:
-            result = requests.post('{0}/message/{1}?pubkey={2}'.format(self.pod, boxType, self.recipient), headers=headers, data=document)
+            result = resilience.post(self.pod, path, headers=headers, data=document)
         except Exception as e:
             sys.stderr.write("Impossible d'envoyer le message:\n" + str(e))
             sys.exit(1)
@@ -236,17 +276,23 @@ class DeleteFromCesium(CesiumCommon):
 
         # Send JSON document and get result
         try:
-            result = requests.post('{0}/history/delete'.format(self.pod), headers=headers, data=document)
-            if result.status_code == 404:
-                raise ValueError("Message introuvable")
-            elif result.status_code == 403:
-                raise ValueError("Vous n'êtes pas l'auteur de ce message.")
+            result = resilience.post(self.pod, '/history/delete', headers=headers, data=document)
         except Exception as e:
-            sys.stderr.write(colored("Impossible de supprimer le message {0}:\n".format(idMsg), 'red') + str(e) + "\n")
-            return False
+            return self.failed(idMsg, e)
+        return self.checkResult(result, idMsg)
+
+    def failed(self, idMsg, error):
+        sys.stderr.write(colored("Impossible de supprimer le message {0}:\n".format(idMsg), 'red') + str(error) + "\n")
+        return False
+
+    # Check the answer of the pod, shared with the async client
+    def checkResult(self, result, idMsg):
+        if result.status_code == 404:
+            return self.failed(idMsg, "Message introuvable")
+        elif result.status_code == 403:
+            return self.failed(idMsg, "Vous n'êtes pas l'auteur de ce message.")
+        elif result.status_code == 200:
+            print(colored("Message {0} supprimé avec succès !".format(idMsg), "green"))
+            return result
         else:
-            if result.status_code == 200:
-                print(colored("Message {0} supprimé avec succès !".format(idMsg), "green"))
-                return result
-            else:
-                sys.stderr.write("Erreur inconnue.")
+            sys.stderr.write("Erreur inconnue.")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from lib.natools import get_privkey
+from lib.messaging import ReadFromCesium
+from lib.stars import ReadLikes
+from lib.gvaBalance import Balance
+from lib.gvaHistory import History
+from lib.gvaIdentities import Identities
+from lib.udTimeline import UdTimeline
+from lib.nodeMeta import NodeMeta
+from lib import jsonCodec, esQuery
+
+KEYFILE_EXTENSIONS = (".dunikey", ".pubsec")
+
+# Commands which can run for several accounts at once
+MULTI_COMMANDS = ("read", "balance", "history", "stars")
+# Pod searches of the accounts sent together in one multi-search
+MSEARCH_CHUNK = 50
+
+
+def expandKeyfiles(paths):
+    # Directories stand for every keyfile they contain
+    keyfiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            keyfiles += sorted(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith(KEYFILE_EXTENSIONS)
+            )
+        else:
+            keyfiles.append(path)
+    return list(dict.fromkeys(keyfiles))
+
+
+class MultiAccounts:
+    def __init__(self, keyfiles, node, pod, jobs=8):
+        self.keyfiles = keyfiles
+        self.node = node
+        self.pod = pod
+        self.jobs = jobs
+        self.udTimeline = None
+        self.prefetched = {}
+
+    def read(self, keyfile, number=3, outbox=False):
+        readCesium = ReadFromCesium(keyfile, self.pod, node=self.node)
+        if keyfile in self.prefetched:
+            hits = readCesium.boxHits(self.prefetched[keyfile])
+        else:
+            hits = readCesium.sendDocument(number, outbox)
+        if not hits:
+            raise ValueError("Echec de la lecture des messages")
+        if not hits["total"]:
+            return []
+        usernames = readCesium.usernames((hits, outbox))
+        return jsonCodec.loads(readCesium.jsonMessages(hits, number, outbox, usernames))
+
+    def balance(self, keyfile, useMempool=False):
+        return Balance(keyfile, self.node, None, useMempool).sendDoc()
+
+    def history(self, keyfile, number=10):
+        gva = History(keyfile, self.node, None, self.udTimeline)
+        gva.sendDoc(number)
+        transList = gva.parseHistory()
+        usernames = Identities(self.node).usernames([t.pubkey for t in transList])
+        return jsonCodec.loads(gva.jsonHistory(transList, usernames))
+
+    def stars(self, keyfile, profile=None, summary=False):
+        readLikes = ReadLikes(keyfile, self.pod, node=self.node)
+        if keyfile in self.prefetched:
+            result = self.prefetched[keyfile]
+        else:
+            document = readLikes.configDocScore(profile) if summary else readLikes.configDoc(profile)
+            result = readLikes.sendDocument(document)
+            if not result:
+                raise ValueError("Echec de la lecture des étoiles")
+            result = jsonCodec.loads(result)
+        return readLikes.parseScore(result) if summary else readLikes.parseLikes(result)
+
+    def prefetch(self, cmd, options):
+        # The searches of all the accounts in a few multi-searches, accounts
+        # whose search failed run their own later
+        searches = []
+        for keyfile in self.keyfiles:
+            try:
+                if cmd == "read":
+                    reader = ReadFromCesium(keyfile, self.pod)
+                    outbox = options.get("outbox", False)
+                    document = reader.configDoc(options.get("number", 3), outbox)
+                    path = esQuery.MESSAGES.format("outbox" if outbox else "inbox")
+                    searches.append((keyfile, reader, path, document))
+                else:
+                    reader = ReadLikes(keyfile, self.pod)
+                    if options.get("summary"):
+                        document = reader.configDocScore(options.get("profile"))
+                    else:
+                        document = reader.configDoc(options.get("profile"))
+                    searches.append((keyfile, reader, esQuery.LIKES, document))
+            except (SystemExit, Exception):
+                continue
+        filterPath = esQuery.HITS if cmd == "read" else esQuery.SCORED_HITS
+        for i in range(0, len(searches), MSEARCH_CHUNK):
+            chunk = searches[i : i + MSEARCH_CHUNK]
+            try:
+                answers = chunk[0][1].multiSearch([(path, document) for _, _, path, document in chunk], filterPath)
+            except Exception:
+                continue
+            for (keyfile, _, _, _), answer in zip(chunk, answers):
+                if answer:
+                    self.prefetched[keyfile] = answer
+
+    def runOne(self, cmd, keyfile, options):
+        entry = {"keyfile": keyfile}
+        try:
+            entry["pubkey"] = get_privkey(keyfile, "pubsec").pubkey
+            entry[cmd] = getattr(self, cmd)(keyfile, **options)
+        except SystemExit:
+            # The lower level classes report on stderr before exiting
+            entry["error"] = "failed, see error output"
+        except Exception as e:
+            # One failing account does not spoil the report of the others
+            entry["error"] = str(e) or type(e).__name__
+        return entry
+
+    def run(self, cmd, **options):
+        if cmd not in MULTI_COMMANDS:
+            raise ValueError("Command {0} does not support several keyfiles".format(cmd))
+
+        # Shared node state is fetched once, before the accounts run in parallel
+        if cmd == "history":
+            NodeMeta(self.node).get()
+            self.udTimeline = UdTimeline(self.node)
+            self.udTimeline.update()
+        elif cmd in ("read", "stars"):
+            self.prefetch(cmd, options)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(
+                executor.map(
+                    lambda keyfile: self.runOne(cmd, keyfile, options), self.keyfiles
+                )
+            )
@@ -77,11 +77,16 @@ def verify(data, pubkey):
 		sys.stderr.write("Bad signature!\n")
 		exit(1)
 
+# PubSec keys already read, by path (signing and decrypting ask for them a lot)
+_pubsec_keys = {}
+
 def get_privkey(privkey_path, privkey_format):
 	if privkey_format == "pubsec":
 		if privkey_path == "*":
 			privkey_path = "privkey.pubsec"
-		return duniterpy.key.SigningKey.from_pubsec_file(privkey_path)
+		if privkey_path not in _pubsec_keys:
+			_pubsec_keys[privkey_path] = duniterpy.key.SigningKey.from_pubsec_file(privkey_path)
+		return _pubsec_keys[privkey_path]
 	
 	elif privkey_format == "cred":
 		if privkey_path == "*":
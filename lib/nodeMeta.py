@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os, sys, time
+from gql import gql
+from lib.gvaClient import gvaClient
+from lib.localCache import cachePath, loadJson, saveJson
+from lib.resilience import errorMessage
+
+# Seconds and blocks (about one day) a cached node metadata stays valid
+TTL = int(os.getenv("NODE_CACHE_TTL") or 3600)
+BLOCKS_TTL = int(os.getenv("NODE_CACHE_BLOCKS") or 288)
+
+
+class NodeMeta:
+    def __init__(self, node, path=None):
+        self.node = node
+        self.path = path or cachePath("nodes.json")
+
+    def load(self):
+        return loadJson(self.path) or {}
+
+    def save(self, cache):
+        # Atomic replace, several threads or processes may refresh at once
+        saveJson(self.path, cache)
+
+    def fetch(self):
+        queryBuild = gql(
+            """
+            query {
+                node {
+                    peer {
+                        currency
+                    }
+                    version
+                }
+                currentUd {
+                    amount
+                    base
+                }
+                currentBlock {
+                    number
+                }
+            }
+        """
+        )
+        try:
+            result = gvaClient(self.node).execute(queryBuild)
+        except Exception as e:
+            message = errorMessage(e)
+            sys.stderr.write("Echec de récupération des informations du noeud:\n" + message + "\n")
+            sys.exit(1)
+
+        return {
+            "currency": result["node"]["peer"]["currency"],
+            "version": result["node"]["version"],
+            "currentUd": result["currentUd"],
+            "block": result["currentBlock"]["number"],
+            "time": int(time.time()),
+        }
+
+    def get(self):
+        # Cached metadata of the node, fetched again once expired by time or by
+        # the current block number seen since (head) far enough from the cached one
+        cache = self.load()
+        meta = cache.get(self.node)
+        if (
+            meta
+            and time.time() - meta["time"] < TTL
+            and meta.get("head", meta["block"]) - meta["block"] < BLOCKS_TTL
+        ):
+            return meta
+
+        meta = self.fetch()
+        cache[self.node] = meta
+        self.save(cache)
+        return meta
+
+    def seen(self, number):
+        # Current block number met by subscribe or syncBlocks
+        cache = self.load()
+        meta = cache.get(self.node)
+        if meta and number > meta.get("head", meta["block"]):
+            meta["head"] = number
+            self.save(cache)
+
+    def expire(self):
+        # Forget the node metadata, eg. when a new UD block is seen
+        cache = self.load()
+        if cache.pop(self.node, None):
+            self.save(cache)
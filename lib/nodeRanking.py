@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import os, time, asyncio
+import aiohttp
+from lib.localCache import cachePath, loadJson, saveJson
+from lib import jsonCodec
+
+# Known endpoints, completed by the peers they advertise
+DEFAULT_NODES = [
+    "https://g1.asycn.io/gva",
+    "https://duniter.pini.fr/gva",
+    "https://g1v1.p2p.legal/gva",
+]
+DEFAULT_PODS = [
+    "https://g1.data.e-is.pro",
+    "https://g1.data.presles.fr",
+    "https://g1.data.adn.life",
+    "https://g1.data.le-sou.org",
+    "https://g1.data.duniter.fr",
+    "https://data.gchange.fr",
+]
+
+# Seconds a ranking stays valid
+RANKING_TTL = int(os.getenv("NODE_RANKING_TTL") or 600)
+PROBE_TIMEOUT = 5
+# Blocks a node may lag behind the highest one and still be up to date
+BLOCK_LAG = 3
+# Endpoints probed at most by kind, discovered peers included
+MAX_CANDIDATES = 30
+
+PROBE_QUERY = "query { node { peer { currency } version } currentBlock { number } }"
+
+
+def endpointUrl(endpoint, api):
+    # "GVA [S] host... port [path]" or "ES_USER_API host... port [path]" to an URL
+    words = endpoint.split()
+    if not words or words[0] != api:
+        return None
+    words = words[1:]
+    secure = bool(words) and words[0] == "S"
+    if secure:
+        words = words[1:]
+    portIndex = next((i for i, word in enumerate(words) if word.isdigit()), None)
+    if not portIndex:
+        return None
+    host, port = words[0], words[portIndex]
+    if ":" in host:
+        host = "[{0}]".format(host)
+    scheme = "https" if secure or port == "443" else "http"
+    url = "{0}://{1}".format(scheme, host)
+    if port not in ("443", "80"):
+        url += ":" + port
+    if len(words) > portIndex + 1:
+        url += "/" + words[portIndex + 1].strip("/")
+    return url
+
+
+class NodeRanking:
+    def __init__(self, path=None):
+        self.path = path or cachePath("ranking.json")
+
+    def load(self):
+        return loadJson(self.path) or {}
+
+    def save(self, ranking):
+        saveJson(self.path, ranking)
+
+    async def probeNode(self, session, url):
+        start = time.monotonic()
+        try:
+            async with session.post(url, json={"query": PROBE_QUERY}) as response:
+                result = (await response.json(loads=jsonCodec.loads))["data"]
+            return {
+                "url": url,
+                "latency": round(time.monotonic() - start, 3),
+                "block": result["currentBlock"]["number"],
+                "currency": result["node"]["peer"]["currency"],
+                "version": result["node"]["version"],
+            }
+        except Exception as e:
+            return {"url": url, "error": str(e) or type(e).__name__}
+
+    async def probePod(self, session, url):
+        start = time.monotonic()
+        try:
+            async with session.get(url + "/node/summary") as response:
+                result = (await response.json(loads=jsonCodec.loads))["duniter"]
+            return {
+                "url": url,
+                "latency": round(time.monotonic() - start, 3),
+                "software": result["software"],
+                "version": result["version"],
+            }
+        except Exception as e:
+            return {"url": url, "error": str(e) or type(e).__name__}
+
+    async def peers(self, session, url, api):
+        # Endpoints advertised by the peers known to a node (BMA) or a pod
+        try:
+            async with session.get(url + "/network/peers") as response:
+                peers = (await response.json(loads=jsonCodec.loads))["peers"]
+        except Exception:
+            return []
+        return [
+            endpointUrl(endpoint, api)
+            for peer in peers
+            if peer.get("status", "UP") == "UP"
+            for endpoint in peer.get("endpoints") or []
+        ]
+
+    async def discover(self, session, nodes, pods):
+        # Peer lists are asked to the known endpoints, all at once
+        nodePeers, podPeers = await asyncio.gather(
+            asyncio.gather(*(self.peers(session, node[: -len("/gva")], "GVA") for node in nodes if node.endswith("/gva"))),
+            asyncio.gather(*(self.peers(session, pod, "ES_USER_API") for pod in pods)),
+        )
+        nodes = list(dict.fromkeys(nodes + [url for urls in nodePeers for url in urls if url]))
+        pods = list(dict.fromkeys(pods + [url for urls in podPeers for url in urls if url]))
+        return nodes[:MAX_CANDIDATES], pods[:MAX_CANDIDATES]
+
+    async def probeAll(self, nodes, pods):
+        timeout = aiohttp.ClientTimeout(total=PROBE_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            nodes, pods = await self.discover(session, nodes, pods)
+            nodeResults, podResults = await asyncio.gather(
+                asyncio.gather(*(self.probeNode(session, node) for node in nodes)),
+                asyncio.gather(*(self.probePod(session, pod) for pod in pods)),
+            )
+        return list(nodeResults), list(podResults)
+
+    def refresh(self, nodes=(), pods=()):
+        # Previously ranked endpoints stay candidates, down ones included
+        previous = self.load()
+        nodes = list(dict.fromkeys(
+            list(nodes) + DEFAULT_NODES + [entry["url"] for entry in previous.get("nodes", [])]
+        ))
+        pods = list(dict.fromkeys(
+            list(pods) + DEFAULT_PODS + [entry["url"] for entry in previous.get("pods", [])]
+        ))
+        nodeResults, podResults = asyncio.run(self.probeAll(nodes, pods))
+
+        # A node down keeps the currency it was last seen with
+        currencies = {entry["url"]: entry.get("currency") for entry in previous.get("nodes", [])}
+        for entry in nodeResults:
+            if "error" in entry and currencies.get(entry["url"]):
+                entry["currency"] = currencies[entry["url"]]
+
+        # Healthy endpoints first, fastest first
+        def rank(entry):
+            return ("error" in entry, entry.get("latency", 0))
+
+        ranking = {
+            "time": int(time.time()),
+            "nodes": sorted(nodeResults, key=rank),
+            "pods": sorted(podResults, key=rank),
+        }
+        self.save(ranking)
+        return ranking
+
+    def get(self, nodes=(), pods=(), refresh=False):
+        ranking = self.load()
+        if refresh or not ranking or time.time() - ranking["time"] > RANKING_TTL:
+            ranking = self.refresh(nodes, pods)
+        return ranking
+
+    def nodes(self, default):
+        # Up to date healthy nodes of the same currency as the configured one,
+        # fastest first. None when its currency was never seen.
+        ranking = self.get(nodes=[default])
+        if not any(entry["url"] == default for entry in ranking["nodes"]):
+            ranking = self.get(nodes=[default], refresh=True)
+        reference = next(entry for entry in ranking["nodes"] if entry["url"] == default)
+        currency = reference.get("currency")
+        healthy = [
+            entry for entry in ranking["nodes"] if "error" not in entry and entry["currency"] == currency
+        ]
+        if not healthy:
+            return []
+        head = max(entry["block"] for entry in healthy)
+        return [entry for entry in healthy if head - entry["block"] <= BLOCK_LAG]
+
+    def pods(self, default):
+        # Healthy pods running the same software (Cesium+ or Ḡchange) as the configured one
+        pods = self.get(pods=[default])["pods"]
+        healthy = [entry for entry in pods if "error" not in entry]
+        reference = next((entry for entry in healthy if entry["url"] == default), None)
+        if not reference:
+            software = "gchange-pod" if "gchange" in default else "cesium-plus-pod"
+        else:
+            software = reference["software"]
+        return [entry for entry in healthy if entry["software"] == software]
+
+    def bestNode(self, default):
+        nodes = self.nodes(default)
+        return nodes[0]["url"] if nodes else default
+
+    def bestPod(self, default):
+        pods = self.pods(default)
+        return pods[0]["url"] if pods else default
@@ -1,6 +1,7 @@
-import sys, re, json, requests, base64
+import sys, re, json, base64
 from time import time
 from lib.cesiumCommon import CesiumCommon, PUBKEY_REGEX
+from lib import resilience, jsonCodec
 
 class Offers(CesiumCommon):
     # Configure JSON document SET to send
@@ -48,15 +49,16 @@ class Offers(CesiumCommon):
         return self.signDoc(document)
 
     # Configure JSON document SET to send
-    def configDocErase(self, id):
+    def configDocErase(self, id, offerToDeleteBrut=None):
         timeSent = int(time())
 
 # "currency":"g1","unit":null,"fees":null,"feesCurrency":null,"picturesCount":0,"stock":0,"tags":[],"id":"AXehXeyZaml2THvBAeS5","creationTime":1613320117}
 #AXehXeyZaml2THvBAeS5
 
 
-        offerToDeleteBrut = self.sendDocumentGet(id, 'get')
-        offerToDelete = json.loads(self.parseJSON(offerToDeleteBrut))
+        if not offerToDeleteBrut:
+            offerToDeleteBrut = self.sendDocumentGet(id, 'get')
+        offerToDelete = jsonCodec.loads(self.parseJSON(offerToDeleteBrut))
 
         title = offerToDelete['title']
         creationTime = offerToDelete['time']
@@ -84,6 +86,9 @@ class Offers(CesiumCommon):
 
         return self.signDoc(document)
 
+    def getPath(self, id):
+        return '/market/record/{0}?_source=category,title,description,issuer,time,creationTime,location,address,city,price,unit,currency,thumbnail._content_type,thumbnail._content,picturesCount,type,stock,fees,feesCurrency,geoPoint,pubkey,freePrice'.format(id)
+
     def sendDocumentGet(self, id, type):
 
         headers = {
@@ -92,14 +97,14 @@ class Offers(CesiumCommon):
 
         # Send JSON document and get JSON result
         if type == 'set':
-            reqQuery = '{0}/market/record'.format(self.pod)
+            reqPath = '/market/record'
         elif type == 'get':
-            reqQuery = '{0}/market/record/{1}?_source=category,title,description,issuer,time,creationTime,location,address,city,price,unit,currency,thumbnail._content_type,thumbnail._content,picturesCount,type,stock,fees,feesCurrency,geoPoint,pubkey,freePrice'.format(self.pod, id)
+            reqPath = self.getPath(id)
         elif type == 'erase':
-            reqQuery = '{0}/market/delete'.format(self.pod)
+            reqPath = '/market/delete'
             
 
-        result = requests.get(reqQuery, headers=headers)
+        result = resilience.get(self.pod, reqPath, headers=headers)
         # print(result)
         if result.status_code == 200:
             # print(result.text)
@@ -116,11 +121,16 @@ class Offers(CesiumCommon):
 
         # Send JSON document and get JSON result
         if type == 'set':
-            reqQuery = '{0}/market/record'.format(self.pod)
+            reqPath = '/market/record'
         if type == 'delete':
-            reqQuery = '{0}/market/record/{1}/_update'.format(self.pod, id)
+            reqPath = '/market/record/{0}/_update'.format(id)
+
+        queued = type == 'set' and self.queue(reqPath, document)
+        if queued:
+            print(queued)
+            return queued
 
-        result = requests.post(reqQuery, headers=headers, data=document)
+        result = resilience.post(self.pod, reqPath, headers=headers, data=document)
         if result.status_code == 200:
             # print(result.text)
             return result.text
@@ -128,11 +138,11 @@ class Offers(CesiumCommon):
             sys.stderr.write("Echec de l'envoi du document...\n" + result.text + '\n')
 
     def parseJSON(self, doc):
-        doc = json.loads(doc)['_source']
+        doc = jsonCodec.loads(doc)['_source']
         if doc:
             # pubkey = { "pubkey": doc['issuer'] }
             # rest = { "description": doc['description'] }
             # final = {**pubkey, **rest}
-            return json.dumps(doc, indent=2)
+            return jsonCodec.dumps(doc, indent=2)
         else:
             return 'Profile vide'
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Store and forward of the signed Cesium+ writes: with --queue (or OUTBOX=1)
+# send, set, stars and setoffer only store their signed document in the
+# outbox, "jaklis flush" submits them later.
+#   ./jaklis.py --queue send -d PUBKEY -t title -m message
+#   ./jaklis.py flush -j 8
+
+import os, sys, json, time, hashlib, tempfile
+from concurrent.futures import ThreadPoolExecutor
+from lib.localCache import cachePath
+from lib import resilience, esQuery
+
+QUEUE = (os.getenv("OUTBOX") or "0") == "1"
+# Documents sent at once, and documents submitted by round of the flusher
+JOBS = int(os.getenv("OUTBOX_JOBS") or 8)
+BATCH = int(os.getenv("OUTBOX_BATCH") or 100)
+# Seconds a document being sent stays claimed by its flusher
+CLAIM_TIMEOUT = 300
+
+HEADERS = {"Content-type": "application/json"}
+
+
+def enable():
+    global QUEUE
+    QUEUE = True
+
+
+def queueing():
+    return QUEUE
+
+
+class Outbox:
+    # One JSON file by document, named after its time so that the directory
+    # lists them in order. A flusher claims a file by renaming it, several
+    # flushers never send the same document.
+    def __init__(self, path=None):
+        self.path = path or cachePath("outbox")
+        os.makedirs(self.path, exist_ok=True)
+        self.rejectedPath = os.path.join(self.path, "rejected")
+
+    def write(self, name, entry):
+        fd, tmpPath = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmpPath, os.path.join(self.path, name))
+
+    def put(self, pod, path, document):
+        # Signed document to send later to path on pod
+        signed = json.loads(document)
+        entry = {
+            "pod": pod,
+            "path": path,
+            "document": document,
+            "time": signed.get("time") or int(time.time()),
+            "queued": time.time(),
+            "attempts": 0,
+        }
+        name = "{0:012d}-{1}.json".format(entry["time"], signed.get("hash") or hashlib.sha256(document.encode()).hexdigest())
+        self.write(name, entry)
+        return name
+
+    def pending(self):
+        # Names of the documents waiting, oldest first; claims left by a
+        # flusher which stopped are released
+        names = []
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".sending"):
+                claimed = os.path.join(self.path, name)
+                try:
+                    if time.time() - os.path.getmtime(claimed) < CLAIM_TIMEOUT:
+                        continue
+                    os.replace(claimed, claimed[: -len(".sending")])
+                except OSError:
+                    continue
+                name = name[: -len(".sending")]
+            if name.endswith(".json"):
+                names.append(name)
+        return sorted(names)
+
+    def claim(self, name):
+        # The entry of a document, None when another flusher took it
+        claimed = os.path.join(self.path, name + ".sending")
+        try:
+            os.replace(os.path.join(self.path, name), claimed)
+            with open(claimed, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def release(self, name, entry, error):
+        # Failed document, kept for the next round
+        entry["attempts"] += 1
+        entry["error"] = error
+        self.write(name, entry)
+        os.remove(os.path.join(self.path, name + ".sending"))
+
+    def done(self, name):
+        os.remove(os.path.join(self.path, name + ".sending"))
+
+    def reject(self, name, entry, error):
+        # Refused by the pod: another attempt would be refused too
+        os.makedirs(self.rejectedPath, exist_ok=True)
+        entry["error"] = error
+        with open(os.path.join(self.rejectedPath, name), "w") as f:
+            json.dump(entry, f)
+        os.remove(os.path.join(self.path, name + ".sending"))
+
+    def send(self, entry):
+        # "sent", "retry" or "rejected", and the error. A document sent twice
+        # is refused as a duplicate, see duplicate().
+        try:
+            result = resilience.post(entry["pod"], entry["path"], True, headers=HEADERS, data=entry["document"])
+        except Exception as e:
+            return "retry", resilience.errorMessage(e)
+        if result.status_code == 200:
+            return "sent", None
+        if "DuplicatedDocumentException" in result.text:
+            return self.duplicate(entry, "{0} {1}".format(result.status_code, result.text))
+        if result.status_code in resilience.RETRY_STATUS or result.status_code >= 500:
+            return "retry", "{0} {1}".format(result.status_code, result.text)
+        return "rejected", "{0} {1}".format(result.status_code, result.text)
+
+    def duplicate(self, entry, error):
+        # A duplicate counts as sent only when the pod holds this very document
+        # (same hash): a new like of a profile already liked is refused as a
+        # duplicate of the old one, and needs the old one to be removed first
+        document = json.loads(entry["document"])
+        if entry["path"].endswith("/_like"):
+            path = esQuery.LIKES
+        else:
+            path = "/{0}/{1}/_search".format(*entry["path"].strip("/").split("/")[:2])
+        search = esQuery.search(esQuery.filtered(("hash", document.get("hash"))), 0)
+        try:
+            result = resilience.post(
+                entry["pod"], esQuery.searchPath(path, "hits.total"), True, headers=HEADERS, data=json.dumps(search)
+            )
+            stored = result.status_code == 200 and result.json().get("hits", {}).get("total", 0) > 0
+        except Exception as e:
+            return "retry", resilience.errorMessage(e)
+        if stored:
+            return "sent", None
+        return "rejected", error
+
+    def sendLane(self, lane):
+        # Documents to the same place, in the order of their time: a failure
+        # holds back the later ones, a profile is never updated out of order
+        report = {"sent": 0, "rejected": 0, "failed": 0}
+        for name in lane:
+            entry = self.claim(name)
+            if entry is None:
+                continue
+            status, error = self.send(entry)
+            if status == "sent":
+                report["sent"] += 1
+                self.done(name)
+            elif status == "rejected":
+                report["rejected"] += 1
+                sys.stderr.write("Document refusé par le pod ({0}): {1}\n".format(name, error))
+                self.reject(name, entry, error)
+            else:
+                report["failed"] += 1
+                self.release(name, entry, error)
+                break
+        return report
+
+    def lanes(self, names):
+        # Documents due (not in the future for the pod) grouped by pod and path
+        lanes = {}
+        now = time.time()
+        for name in names:
+            try:
+                with open(os.path.join(self.path, name), "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if entry["time"] > now:
+                continue
+            lanes.setdefault((entry["pod"], entry["path"]), []).append(name)
+        return list(lanes.values())
+
+    def flush(self, jobs=JOBS, batch=BATCH, wait=False):
+        # Rounds of at most batch documents, jobs lanes at once, until the
+        # outbox is empty or a round sent nothing. With wait, the failed ones
+        # are tried again after a backoff until all are sent.
+        total = {"sent": 0, "rejected": 0, "failed": 0}
+        attempt = 0
+        while True:
+            names = self.pending()[:batch]
+            lanes = self.lanes(names)
+            if not lanes:
+                if not wait or not names:
+                    break
+                # Only documents of the future are left
+                time.sleep(1)
+                continue
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                reports = list(executor.map(self.sendLane, lanes))
+            sent = sum(report["sent"] + report["rejected"] for report in reports)
+            for key in total:
+                total[key] += sum(report[key] for report in reports)
+            if not sent:
+                if not wait:
+                    break
+                resilience.backoff(min(attempt, 6))
+                attempt += 1
+            else:
+                attempt = 0
+        # Failed attempts, and documents still waiting in the outbox
+        total["pending"] = len(self.pending())
+        return total
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import os, time, atexit, threading
+from lib.localCache import cachePath, loadJson, saveJson
+
+# Seconds a cached profile stays valid, and profiles kept at most (the least
+# recently used ones are evicted first)
+TTL = int(os.getenv("PROFILE_CACHE_TTL") or 86400)
+MAX_PROFILES = int(os.getenv("PROFILE_CACHE_SIZE") or 20000)
+
+# Fields of the profiles every lookup asks for, so that they are cached for
+# all the others
+FIELDS = ["title", "pubkey", "city", "avatar._content_type", "time"]
+
+
+class ProfileCache:
+    # Profile documents by pod and pubkey (_id), with the _source fields they
+    # were fetched with. A lookup is served when the cached profile has all
+    # the fields it needs. Profiles found missing are cached too. Changes are
+    # written once, by flush() when the process exits.
+    def __init__(self, path=None):
+        self.path = path or cachePath("profiles.json")
+        self.lock = threading.Lock()
+        self.entries = None
+        self.scans = None
+        self.enabled = True
+        self.dirty = False
+        atexit.register(self.flush)
+
+    def disable(self):
+        # --no-cache: profiles are fetched again, and the cache refreshed
+        self.enabled = False
+
+    def load(self):
+        if self.entries is None:
+            cache = loadJson(self.path) or {}
+            self.entries = cache.get("profiles", {})
+            self.scans = cache.get("scans", {})
+        return self.entries
+
+    def save(self):
+        # Least recently used first: the oldest ones go beyond the size
+        for key in list(self.entries)[: max(0, len(self.entries) - MAX_PROFILES)]:
+            del self.entries[key]
+        saveJson(self.path, {"profiles": self.entries, "scans": self.scans})
+        self.dirty = False
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    def getMany(self, pod, pubkeys, fields=FIELDS):
+        # Cached profiles by pubkey (None for missing ones) and the pubkeys to fetch
+        found, missing = {}, []
+        with self.lock:
+            entries = self.load()
+            for pubkey in dict.fromkeys(pubkeys):
+                key = pod + " " + pubkey
+                entry = entries.get(key)
+                if (
+                    self.enabled
+                    and entry
+                    and time.time() - entry["cached"] < TTL
+                    and (not entry["found"] or set(fields) <= set(entry["fields"]))
+                ):
+                    # Most recently used last
+                    entries[key] = entries.pop(key)
+                    self.dirty = True
+                    found[pubkey] = entry["source"] if entry["found"] else None
+                else:
+                    missing.append(pubkey)
+        return found, missing
+
+    def get(self, pod, pubkey, fields=FIELDS):
+        found, _ = self.getMany(pod, [pubkey], fields)
+        return found.get(pubkey), pubkey in found
+
+    def putMany(self, pod, sources, fields=FIELDS):
+        # Sources of the fetched profiles by pubkey, None for missing ones.
+        # Fields fetched before are kept along the new ones.
+        now = time.time()
+        with self.lock:
+            entries = self.load()
+            for pubkey, source in sources.items():
+                key = pod + " " + pubkey
+                previous = entries.pop(key, None)
+                if source is None:
+                    entries[key] = {"found": False, "cached": now}
+                    continue
+                kept = fields
+                if previous and previous["found"] and now - previous["cached"] < TTL:
+                    source = {**previous["source"], **source}
+                    kept = list(dict.fromkeys(previous["fields"] + fields))
+                entries[key] = {"found": True, "cached": now, "fields": kept, "source": source}
+            self.dirty = True
+
+    def put(self, pod, pubkey, source, fields=FIELDS):
+        self.putMany(pod, {pubkey: source}, fields)
+
+    def forget(self, pod, pubkey):
+        # The profile changed
+        with self.lock:
+            if self.load().pop(pod + " " + pubkey, None):
+                self.dirty = True
+
+    def scanned(self, name, pubkeys=None):
+        # Pubkeys of a whole scan (all geolocated profiles) still valid and
+        # cached, or records them
+        with self.lock:
+            self.load()
+            if pubkeys is not None:
+                self.scans[name] = {"time": time.time(), "pubkeys": list(pubkeys)}
+                self.dirty = True
+                return pubkeys
+            scan = self.scans.get(name)
+            if not self.enabled or not scan or time.time() - scan["time"] >= TTL:
+                return None
+            return scan["pubkeys"]
+
+
+profileCache = ProfileCache()
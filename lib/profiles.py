@@ -1,6 +1,9 @@
-import sys, json, requests, base64
+import sys, json, base64
 from time import time
 from lib.cesiumCommon import CesiumCommon, PUBKEY_REGEX
+from lib.hedge import readPost
+from lib import resilience, esQuery, jsonCodec
+from lib.profileCache import profileCache
 
 
 class Profiles(CesiumCommon):
@@ -43,38 +46,27 @@ class Profiles(CesiumCommon):
         return self.signDoc(document)
 
     # Configure JSON document GET to send
-    def configDocGet(self, profile, scope="title", getAvatar=None):
+    def getFields(self, getAvatar=None):
         if getAvatar:
             avatar = "avatar"
         else:
             avatar = "avatar._content_type"
 
-        data = {
-            "query": {
-                "bool": {
-                    "should": [
-                        {"match": {scope: {"query": profile, "boost": 2}}},
-                        {"prefix": {scope: profile}},
-                    ]
-                }
-            },
-            "highlight": {"fields": {"title": {}, "tags": {}}},
-            "from": 0,
-            "size": 100,
-            "_source": [
-                "title",
-                avatar,
-                "description",
-                "city",
-                "address",
-                "socials.url",
-                "creationTime",
-                "membersCount",
-                "type",
-                "geoPoint",
-            ],
-            "indices_boost": {"user": 100, "page": 1, "group": 0.01},
-        }
+        return [
+            "title",
+            avatar,
+            "description",
+            "city",
+            "address",
+            "socials.url",
+            "creationTime",
+            "membersCount",
+            "type",
+            "geoPoint",
+        ]
+
+    def configDocGet(self, profile, scope="title", getAvatar=None):
+        data = esQuery.profileSearch(profile, scope, self.getFields(getAvatar))
 
         document = json.dumps(data)
 
@@ -103,27 +95,61 @@ class Profiles(CesiumCommon):
 
         # Send JSON document and get JSON result
         if type == "set":
-            reqQuery = "{0}/user/profile?pubkey={1}/_update?pubkey={1}".format(
-                self.pod, self.pubkey
-            )
+            reqPath = "/user/profile?pubkey={0}/_update?pubkey={0}".format(self.pubkey)
         elif type == "get":
-            reqQuery = "{0}/user,page,group/profile,record/_search".format(self.pod)
+            reqPath = esQuery.searchPath(esQuery.PROFILES, esQuery.FIRST_HITS)
         elif type == "erase":
-            reqQuery = "{0}/history/delete".format(self.pod)
+            reqPath = "/history/delete"
 
-        result = requests.post(reqQuery, headers=headers, data=document)
+        if type == "set":
+            queued = self.queue(reqPath, document)
+            if queued:
+                profileCache.forget(self.pod, self.pubkey)
+                return queued
+
+        if type == "get":
+            # Searches are idempotent and may be hedged on another pod
+            result = readPost(self.pod, reqPath, headers=headers, data=document)
+        else:
+            result = resilience.post(self.pod, reqPath, headers=headers, data=document)
         if result.status_code == 200:
             # print(result.text)
+            if type != "get":
+                profileCache.forget(self.pod, self.pubkey)
             return result.text
         else:
             sys.stderr.write("Echec de l'envoi du document...\n" + result.text + "\n")
 
+    def readProfile(self, profile, scope="title", getAvatar=None):
+        # Search result of the profile, a pubkey is looked up in the cache
+        # first. Avatars are never cached.
+        fields = self.getFields(getAvatar)
+        if scope == "_id" and not getAvatar:
+            source, found = profileCache.get(self.pod, profile, fields)
+            if found:
+                return {"hits": {"hits": [{"_id": profile, "_source": source}] if source else []}}
+
+        resultJSON = self.sendDocument(self.configDocGet(profile, scope, getAvatar), "get")
+        if not resultJSON:
+            return
+        result = jsonCodec.loads(resultJSON)
+        hits = esQuery.hits(result)
+        if hits and not getAvatar:
+            profileCache.put(self.pod, hits[0]["_id"], hits[0]["_source"], fields)
+        elif scope == "_id" and not getAvatar:
+            profileCache.put(self.pod, profile, None, fields)
+        return result
+
     def parseJSON(self, doc):
-        doc = json.loads(doc)["hits"]["hits"]
+        final = self.parseProfile(doc if isinstance(doc, dict) else jsonCodec.loads(doc))
+        if final:
+            return jsonCodec.dumps(final, indent=2)
+        else:
+            return "Profile vide"
+
+    def parseProfile(self, result):
+        doc = esQuery.hits(result)
         if doc:
             pubkey = {"pubkey": doc[0]["_id"]}
             rest = doc[0]["_source"]
-            final = {**pubkey, **rest}
-            return json.dumps(final, indent=2)
-        else:
-            return "Profile vide"
+            return {**pubkey, **rest}
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+import os, json, time, random, threading
+import requests
+from requests.adapters import HTTPAdapter
+from gql import Client
+from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.exceptions import TransportQueryError
+from lib.localCache import cachePath, loadJson, saveJson
+from lib.nodeRanking import NodeRanking
+from lib import traffic, jsonCodec
+
+# Seconds a single request may take, and a whole command (0: no deadline)
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT") or 10)
+COMMAND_DEADLINE = float(os.getenv("COMMAND_DEADLINE") or 60)
+# Attempts of an idempotent request on one node, and base of the jittered backoff
+RETRIES = int(os.getenv("RETRIES") or 3)
+RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF") or 0.5)
+# Consecutive failures opening the circuit of a node, and seconds it stays open
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES") or 5)
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN") or 60)
+# Alternate nodes tried once a node failed or its circuit is open
+MAX_REROUTES = 2
+
+# Keep-alive connections kept by pod, and connections opened to the pod while
+# the command starts (0: none)
+POOL_SIZE = int(os.getenv("POD_POOL_SIZE") or 10)
+POOL_WARMUP = int(os.getenv("POD_POOL_WARMUP") or 1)
+
+# Compressed answers (gzip, deflate) unless HTTP_COMPRESSION=0, the pods and
+# nodes compress the large ones when asked
+COMPRESSION = {
+    "Accept-Encoding": "gzip, deflate" if (os.getenv("HTTP_COMPRESSION") or "1") != "0" else "identity"
+}
+
+# HTTP answers worth another attempt
+RETRY_STATUS = (429, 502, 503, 504)
+
+_deadline = None
+_sessions = {}
+_sessionsLock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(requests.ConnectionError):
+    pass
+
+
+def unreachable(url, lastError):
+    return lastError or CircuitOpen("Noeud injoignable (circuit ouvert): " + url)
+
+
+def startDeadline(seconds=COMMAND_DEADLINE):
+    global _deadline
+    _deadline = time.monotonic() + seconds if seconds else None
+
+
+def timeout():
+    # Timeout of the next request, never beyond the command deadline
+    if _deadline is None:
+        return REQUEST_TIMEOUT
+    remaining = _deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Délai de la commande dépassé")
+    return min(REQUEST_TIMEOUT, remaining)
+
+
+def backoff(attempt):
+    # Full jitter, so that parallel clients do not retry in step
+    delay = random.uniform(0, RETRY_BACKOFF * 2**attempt)
+    if _deadline is not None:
+        delay = min(delay, max(0, _deadline - time.monotonic()))
+    time.sleep(delay)
+
+
+class Breakers:
+    # Failures by node, shared by the threads of the process and kept in the
+    # local cache so that the next commands fail fast too
+    def __init__(self, path=None):
+        self.path = path or cachePath("breakers.json")
+        self.lock = threading.Lock()
+        self.states = None
+
+    def load(self):
+        if self.states is None:
+            self.states = loadJson(self.path) or {}
+        return self.states
+
+    def save(self):
+        saveJson(self.path, self.states)
+
+    def isOpen(self, url):
+        with self.lock:
+            state = self.load().get(url)
+            return bool(state) and state["openUntil"] > time.time()
+
+    def success(self, url):
+        with self.lock:
+            if self.load().pop(url, None):
+                self.save()
+
+    def failure(self, url):
+        with self.lock:
+            state = self.load().setdefault(url, {"failures": 0, "openUntil": 0})
+            state["failures"] += 1
+            if state["failures"] >= BREAKER_FAILURES:
+                # Half open after the cooldown: one more failure opens it again
+                state["failures"] = BREAKER_FAILURES - 1
+                state["openUntil"] = time.time() + BREAKER_COOLDOWN
+            self.save()
+
+
+breakers = Breakers()
+
+
+def session(url):
+    # One pooled keep-alive session by pod, shared by the threads of the process
+    with _sessionsLock:
+        if url not in _sessions:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            _sessions[url] = requests.Session()
+            _sessions[url].headers.update(COMPRESSION)
+            _sessions[url].mount("http://", adapter)
+            _sessions[url].mount("https://", adapter)
+        return _sessions[url]
+
+
+def warmUp(url, connections=POOL_WARMUP):
+    # Opens connections to the pod in the background, the TCP and TLS
+    # handshakes overlap with the loading of the keys
+    def connect():
+        try:
+            session(url).head(url, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException:
+            pass
+
+    for _ in range(connections):
+        threading.Thread(target=connect, daemon=True).start()
+
+
+def route(url, kind, reroute=True):
+    # The node itself unless its circuit is open, then healthy alternates,
+    # looked up only when needed
+    if not breakers.isOpen(url):
+        yield url
+    if not reroute:
+        return
+    ranking = NodeRanking()
+    try:
+        ranked = ranking.nodes(url) if kind == "nodes" else ranking.pods(url)
+    except Exception:
+        ranked = []
+    alternates = [entry["url"] for entry in ranked if entry["url"] != url]
+    for alternate in alternates[:MAX_REROUTES]:
+        if not breakers.isOpen(alternate):
+            yield alternate
+
+
+def request(method, base, path, idempotent=False, reroute=True, **kwargs):
+    # HTTP request to a Cesium+ pod, over its pooled session. Idempotent ones are retried and moved to
+    # another pod; others are sent once, to another pod only if the circuit
+    # of this one is open.
+    lastError = None
+    for url in route(base, "pods", reroute):
+        for attempt in range(RETRIES if idempotent else 1):
+            start = time.monotonic()
+            try:
+                response = session(url).request(method, url + path, timeout=timeout(), **kwargs)
+            except requests.RequestException as e:
+                recordHttp(method, url + path, kwargs, start, error=e)
+                breakers.failure(url)
+                lastError = e
+            else:
+                recordHttp(method, url + path, kwargs, start, response)
+                if response.status_code not in RETRY_STATUS:
+                    breakers.success(url)
+                    return response
+                breakers.failure(url)
+                lastError = requests.HTTPError(
+                    "{0} {1}".format(response.status_code, response.reason), response=response
+                )
+            if not idempotent or breakers.isOpen(url):
+                break
+            if attempt < RETRIES - 1:
+                backoff(attempt)
+        if not idempotent:
+            break
+    raise unreachable(base, lastError)
+
+
+def recordHttp(method, url, kwargs, start, response=None, error=None):
+    # The answer is only decoded while recording
+    if traffic.recording():
+        body = kwargs.get("data")
+        if "json" in kwargs:
+            body = json.dumps(kwargs["json"])
+        if response is None:
+            traffic.recordHttp(method, url, body, 0, str(error), time.monotonic() - start)
+        else:
+            traffic.recordHttp(method, url, body, response.status_code, response.text, time.monotonic() - start)
+
+
+def post(base, path, idempotent=False, **kwargs):
+    return request("POST", base, path, idempotent, **kwargs)
+
+
+def get(base, path, **kwargs):
+    return request("GET", base, path, True, **kwargs)
+
+
+def errorMessage(e):
+    # Message of a GraphQL error, or the error itself for transport failures
+    if isinstance(e, TransportQueryError) and isinstance(e.errors, list) and e.errors:
+        return e.errors[0].get("message", str(e))
+    return str(e) or type(e).__name__
+
+
+def gvaTransport(url, timeout=None):
+    # GraphQL transport with compressed answers, decoded by the JSON codec
+    return AIOHTTPTransport(url=url, timeout=timeout, headers=COMPRESSION, json_deserialize=jsonCodec.loads)
+
+
+def isMutation(document):
+    # gql() gives a GraphQLRequest wrapping the parsed document
+    document = getattr(document, "document", document)
+    return any(
+        getattr(definition, "operation", None) and definition.operation.value == "mutation"
+        for definition in document.definitions
+    )
+
+
+class ResilientClient:
+    # Same execute() as a gql Client: timeouts, retries of queries, circuit
+    # breakers and rerouting to alternate nodes. Mutations are sent once.
+    def __init__(self, node, reroute=True, bounded=True):
+        # Unbounded clients have no request timeout, for the single huge
+        # answers (all the wallets of the node)
+        self.node = node
+        self.reroute = reroute
+        self.bounded = bounded
+        self.clients = {}
+
+    def client(self, url):
+        if url not in self.clients:
+            transport = gvaTransport(url, int(REQUEST_TIMEOUT) if self.bounded else None)
+            self.clients[url] = Client(transport=transport, fetch_schema_from_transport=False)
+        return self.clients[url]
+
+    def send(self, url, document, variable_values):
+        start = time.monotonic()
+        try:
+            result = self.client(url).execute(document, variable_values=variable_values)
+        except TransportQueryError as e:
+            traffic.recordGraphql(
+                url, document, variable_values, {"errors": e.errors, "data": e.data}, time.monotonic() - start
+            )
+            raise
+        except Exception as e:
+            traffic.recordGraphql(url, document, variable_values, str(e), time.monotonic() - start, 0)
+            raise
+        traffic.recordGraphql(url, document, variable_values, {"data": result}, time.monotonic() - start)
+        return result
+
+    def execute(self, document, variable_values=None):
+        idempotent = not isMutation(document)
+        lastError = None
+        for url in route(self.node, "nodes", idempotent and self.reroute):
+            for attempt in range(RETRIES if idempotent else 1):
+                timeout()
+                try:
+                    result = self.send(url, document, variable_values)
+                except TransportQueryError:
+                    # The node answered with GraphQL errors: not the node's fault
+                    breakers.success(url)
+                    raise
+                except Exception as e:
+                    breakers.failure(url)
+                    lastError = e
+                    if not idempotent or breakers.isOpen(url):
+                        break
+                    if attempt < RETRIES - 1:
+                        backoff(attempt)
+                else:
+                    breakers.success(url)
+                    return result
+            if not idempotent:
+                break
+        raise unreachable(self.node, lastError)
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+# Local stand-in for a GVA node and a Cesium+ pod, to check commands offline:
+#   python3 -m lib.standIn --port 8765 -p PUBKEY1 -p PUBKEY2
+#   ./jaklis.py -n http://localhost:8765/gva subscribe -w PUBKEY1
+#   ./jaklis.py -n http://localhost:8765 get -p PUBKEY1
+
+import sys, re, json, time, random, base64, asyncio, argparse
+from aiohttp import web, WSMsgType
+
+BALANCE_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?balance\s*\(\s*script\s*:\s*\$(\w+)\s*\)")
+BLOCK_FIELD = re.compile(r"(\w+)\s*:\s*block\s*\(\s*number\s*:\s*(\d+)\s*\)")
+HISTORY_BC_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?txsHistoryBc\s*\(((?:[^(){}]|\{[^}]*\})*)\)")
+HISTORY_MP_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?txsHistoryMp\s*\(")
+IDTY_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?idty\s*\(\s*pubkey\s*:\s*\$(\w+)\s*\)")
+UDS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?udsOfPubkey\s*\(((?:[^(){}]|\{[^}]*\})*)\)")
+WALLETS_FIELD = re.compile(r"wallets\s*\(((?:[^(){}]|\{[^}]*\})*)\)")
+ARGUMENT = re.compile(r"(\w+)\s*:\s*(\$\w+|\"[^\"]*\"|\w+)")
+
+
+class GvaStandIn:
+    def __init__(self, pubkeys=(), blocks=None, interval=2.0, udEvery=10, history=0, latency=0, slow=0, slowDelay=2.0):
+        self.pubkeys = list(pubkeys)
+        # Simulated answer time, a fraction of queries being much slower (tail latency)
+        self.latency = latency
+        self.slow = slow
+        self.slowDelay = slowDelay
+        self.blocks = list(blocks or [])
+        self.interval = interval
+        self.udEvery = udEvery
+        self.number = 0
+        self.ud = 1000
+        self.balances = {pubkey: 100000 for pubkey in self.pubkeys}
+        self.subscribers = {}
+        self.chain = []
+        self.history = {}
+        # UDs created by each member (even pubkeys, as their idty), oldest first
+        self.uds = {}
+        # Hashes of the signed documents written on the pod, and the likes by
+        # (profile, issuer)
+        self.written = set()
+        self.likes = {}
+        for _ in range(history):
+            self.addBlock(self.syntheticBlock())
+
+    def syntheticBlock(self):
+        # Random payment of one of the known pubkeys to one or two others, with
+        # its change, UD every udEvery blocks
+        transactions = []
+        if len(self.pubkeys) > 1:
+            issuer = random.choice(self.pubkeys)
+            others = [pubkey for pubkey in self.pubkeys if pubkey != issuer]
+            recipients = random.sample(others, random.randint(1, min(2, len(others))))
+            outputs = ["{0}:0:SIG({1})".format(random.randint(1, 1000), recipient) for recipient in recipients]
+            outputs.insert(random.randint(0, len(outputs)), "{0}:0:SIG({1})".format(random.randint(1, 1000), issuer))
+            transactions.append(
+                {
+                    "issuers": [issuer],
+                    "outputs": outputs,
+                    "comment": "stand-in {0}".format(self.number),
+                    "blockstamp": "{0}-STANDIN".format(self.number),
+                    "hash": "{0:064X}".format(random.getrandbits(256)),
+                }
+            )
+        return {
+            "number": self.number,
+            "hash": "{0:064X}".format(random.getrandbits(256)),
+            "issuer": self.pubkeys[0] if self.pubkeys else "",
+            "medianTime": int(time.time()),
+            "dividend": self.ud if self.number % self.udEvery == 0 else None,
+            "unitBase": 0,
+            "transactions": transactions,
+        }
+
+    def applyBlock(self, block):
+        if block.get("dividend"):
+            for i, pubkey in enumerate(self.pubkeys):
+                if i % 2 == 0:
+                    self.balances[pubkey] = self.balances.get(pubkey, 0) + block["dividend"]
+                    self.uds.setdefault(pubkey, []).append(
+                        {
+                            "amount": block["dividend"],
+                            "base": block["unitBase"],
+                            "blockNumber": block["number"],
+                            "blockchainTime": block["medianTime"],
+                        }
+                    )
+        for transaction in block["transactions"]:
+            issuer = transaction["issuers"][0]
+            for output in transaction["outputs"]:
+                amount, base, condition = output.split(":", 2)
+                amount = int(amount) * pow(10, int(base))
+                recipient = condition[4:-1]
+                if recipient != issuer:
+                    self.balances[issuer] = self.balances.get(issuer, 0) - amount
+                    self.balances[recipient] = self.balances.get(recipient, 0) + amount
+
+    def addBlock(self, block):
+        self.number = block["number"] + 1
+        self.applyBlock(block)
+        self.chain.append(block)
+
+        # Per account history, oldest first
+        for transaction in block["transactions"]:
+            issuer = transaction["issuers"][0]
+            node = {**transaction, "currency": "g1-test", "writtenTime": block["medianTime"]}
+            self.history.setdefault(issuer, []).append(("SENT", node))
+            for output in transaction["outputs"]:
+                recipient = output.split(":", 2)[2][4:-1]
+                if recipient != issuer:
+                    self.history.setdefault(recipient, []).append(("RECEIVED", node))
+
+    def argumentValues(self, arguments, variables):
+        # Argument values are either literals or $variables of the query
+        def value(raw):
+            if raw.startswith("$"):
+                return variables.get(raw[1:])
+            return raw.strip('"')
+
+        return {name: value(raw) for name, raw in ARGUMENT.findall(arguments)}
+
+    def walletsPage(self, arguments, variables):
+        values = self.argumentValues(arguments, variables)
+        pageSize = int(values.get("pageSize") or 0) or len(self.pubkeys)
+        offset = int(values.get("cursor") or 0) if values.get("cursor") != "null" else 0
+        page = self.pubkeys[offset : offset + pageSize]
+        return {
+            "pageInfo": {
+                "hasNextPage": offset + pageSize < len(self.pubkeys),
+                "endCursor": str(offset + len(page)),
+            },
+            "edges": [
+                {
+                    "node": {
+                        "script": pubkey,
+                        "balance": {"amount": self.balances[pubkey], "base": 0},
+                        "idty": {"isMember": i % 2 == 0, "username": "standin{0}".format(offset + i)},
+                    }
+                }
+                for i, pubkey in enumerate(page)
+            ],
+        }
+
+    def historyPage(self, arguments, variables):
+        values = self.argumentValues(arguments, variables)
+        pubkey = values["script"][4:-1]
+        pageSize = int(values.get("pageSize") or 10)
+        offset = int(values.get("cursor") or 0)
+        edges = [
+            {"direction": direction, "node": node}
+            for direction, node in reversed(self.history.get(pubkey, []))
+        ]
+
+        def connection(edges):
+            page = edges[offset : offset + pageSize]
+            return {
+                "pageInfo": {
+                    "hasPreviousPage": offset > 0,
+                    "hasNextPage": offset + pageSize < len(edges),
+                    "endCursor": str(offset + len(page)),
+                },
+                "edges": page,
+            }
+
+        return {
+            "both": connection(edges),
+            "received": connection([e for e in edges if e["direction"] == "RECEIVED"]),
+            "sent": connection([e for e in edges if e["direction"] == "SENT"]),
+        }
+
+    def udsPage(self, arguments, variables):
+        values = self.argumentValues(arguments, variables)
+        pageSize = int(values.get("pageSize") or 10)
+        offset = int(values.get("cursor") or 0)
+        uds = list(reversed(self.uds.get(values["pubkey"], [])))
+        page = uds[offset : offset + pageSize]
+        return {
+            "pageInfo": {
+                "hasNextPage": offset + pageSize < len(uds),
+                "endCursor": str(offset + len(page)),
+            },
+            "edges": [{"node": ud} for ud in page],
+        }
+
+    async def produceBlocks(self, app):
+        while True:
+            await asyncio.sleep(self.interval)
+            block = self.blocks.pop(0) if self.blocks else self.syntheticBlock()
+            self.addBlock(block)
+            for ws, ids in list(self.subscribers.items()):
+                for idSub in ids:
+                    await ws.send_json(
+                        {"id": idSub, "type": "data", "payload": {"data": {"newBlocks": [block]}}}
+                    )
+
+    async def handleSubscription(self, request):
+        # Apollo "graphql-ws" protocol, the one spoken by gql WebsocketsTransport
+        ws = web.WebSocketResponse(protocols=("graphql-ws",))
+        await ws.prepare(request)
+        self.subscribers[ws] = set()
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                if message["type"] == "connection_init":
+                    await ws.send_json({"type": "connection_ack"})
+                elif message["type"] == "start":
+                    self.subscribers[ws].add(message["id"])
+                elif message["type"] == "stop":
+                    self.subscribers[ws].discard(message["id"])
+                    await ws.send_json({"id": message["id"], "type": "complete"})
+                elif message["type"] == "connection_terminate":
+                    break
+        finally:
+            del self.subscribers[ws]
+        return ws
+
+    async def handleQuery(self, request):
+        # Only answers (aliased) balance, idty, block and history fields, node, currentUd,
+        # udsReval, currentBlock, wallets and genTx
+        delay = self.slowDelay if random.random() < self.slow else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+        body = await request.json()
+        query = body.get("query", "")
+        variables = body.get("variables") or {}
+        data = {}
+        for alias, variable in BALANCE_FIELD.findall(query):
+            alias = alias or "balance"
+            pubkey = variables[variable]
+            if pubkey.startswith("SIG("):
+                pubkey = pubkey[4:-1]
+            if pubkey in self.balances:
+                data[alias] = {"amount": self.balances[pubkey], "base": 0}
+            else:
+                data[alias] = None
+        for alias, variable in IDTY_FIELD.findall(query):
+            pubkey = variables[variable]
+            if pubkey in self.pubkeys:
+                i = self.pubkeys.index(pubkey)
+                data[alias or "idty"] = {"isMember": i % 2 == 0, "username": "standin{0}".format(i)}
+            else:
+                data[alias or "idty"] = None
+        for alias, number in BLOCK_FIELD.findall(query):
+            number = int(number)
+            data[alias] = self.chain[number] if number < len(self.chain) else None
+        for alias, arguments in HISTORY_BC_FIELD.findall(query):
+            data[alias or "txsHistoryBc"] = self.historyPage(arguments, variables)
+        for alias, arguments in UDS_FIELD.findall(query):
+            data[alias or "udsOfPubkey"] = self.udsPage(arguments, variables)
+        for alias in HISTORY_MP_FIELD.findall(query):
+            data[alias or "txsHistoryMp"] = {"receiving": [], "sending": []}
+        if "currentBlock" in query:
+            data["currentBlock"] = {"number": self.number - 1}
+        if "node" in query and "peer" in query:
+            data["node"] = {"peer": {"currency": "g1-test"}, "version": "stand-in"}
+        if "udsReval" in query:
+            data["udsReval"] = [{"amount": self.ud, "base": 0, "blockNumber": 0}]
+        if "currentUd" in query:
+            data["currentUd"] = {"amount": self.ud, "base": 0}
+        for arguments in WALLETS_FIELD.findall(query):
+            data["wallets"] = self.walletsPage(arguments, variables)
+        if "genTx" in query:
+            data["genTx"] = ["Version: 10\nType: Transaction\nCurrency: g1-test\n"]
+        return web.json_response({"data": data})
+
+    def podHit(self, index, i):
+        # Synthetic Cesium+ document of the searched index
+        pubkey = self.pubkeys[i % len(self.pubkeys)] if self.pubkeys else ""
+        if index == "message":
+            source = {
+                "issuer": pubkey,
+                "recipient": pubkey,
+                "title": base64.b64encode(random.randbytes(32)).decode(),
+                "content": base64.b64encode(random.randbytes(128)).decode(),
+                "time": int(time.time()) - i * 60,
+                "nonce": "5aZdSqKGHBqm2uMPwN6XnfiiJKRieb1Hh",
+            }
+        elif index == "like":
+            source = {"issuer": pubkey, "level": random.randint(1, 5)}
+        else:
+            source = {"title": "stand-in {0}".format(i), "city": "Nowhere", "pubkey": pubkey}
+        return {"_index": index, "_id": pubkey if index == "user" else str(i), "_source": source}
+
+    def searchAnswer(self, index, search):
+        # Any Cesium+ search: a few synthetic hits of the index and the level sum
+        index = index.split(",")[0]
+        hits = [self.podHit(index, i) for i in range(min(len(self.pubkeys), 10))]
+        return {
+            "took": 1,
+            "hits": {"total": len(hits), "hits": hits[: search.get("size", 10)]},
+            "aggregations": {
+                "level_sum": {"value": sum(hit["_source"].get("level", 0) for hit in hits)}
+            },
+        }
+
+    async def podDelay(self):
+        delay = self.slowDelay if random.random() < self.slow else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def handleSearch(self, request):
+        await self.podDelay()
+        search = json.loads(await request.text() or "{}")
+        # A search of a written document by its hash
+        for term in search.get("query", {}).get("bool", {}).get("filter", []):
+            if "hash" in term.get("term", {}):
+                total = int(term["term"]["hash"] in self.written)
+                return web.json_response({"hits": {"total": total, "hits": []}})
+        return web.json_response(self.searchAnswer(request.match_info["index"], search))
+
+    async def handleMultiGet(self, request):
+        await self.podDelay()
+        ids = json.loads(await request.text())["ids"]
+        docs = []
+        for id in ids:
+            if id in self.pubkeys:
+                hit = self.podHit(request.match_info["index"], self.pubkeys.index(id))
+                docs.append({"_id": id, "found": True, "_source": hit["_source"]})
+            else:
+                docs.append({"_id": id, "found": False})
+        return web.json_response({"docs": docs})
+
+    async def handleMultiSearch(self, request):
+        await self.podDelay()
+        lines = [json.loads(line) for line in (await request.text()).splitlines() if line.strip()]
+        responses = [
+            self.searchAnswer(header["index"], search) for header, search in zip(lines[::2], lines[1::2])
+        ]
+        return web.json_response({"responses": responses})
+
+    async def handleWrite(self, request):
+        # Signed documents are stored once, as Cesium+ pods do
+        await self.podDelay()
+        document = json.loads(await request.text())
+        # A profile is liked once by an issuer, a new like is a duplicate
+        like = (document.get("id"), document.get("issuer")) if request.path.endswith("/_like") else None
+        if document.get("hash") in self.written or like in self.likes:
+            return web.json_response({"error": "DuplicatedDocumentException[Duplicated document]"}, status=400)
+        self.written.add(document.get("hash"))
+        if like:
+            self.likes[like] = document.get("hash")
+        return web.Response(text=document.get("hash") or "")
+
+    async def handleSummary(self, request):
+        return web.json_response({"duniter": {"software": "cesium-plus-pod", "version": "stand-in"}})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/gva", self.handleQuery)
+        app.router.add_get("/gva-sub", self.handleSubscription)
+        app.router.add_post("/{index}/{type}/_search", self.handleSearch)
+        app.router.add_post("/_msearch", self.handleMultiSearch)
+        app.router.add_post("/{index}/{type}/_mget", self.handleMultiGet)
+        app.router.add_get("/node/summary", self.handleSummary)
+        app.router.add_post("/{index}/{type}", self.handleWrite)
+        app.router.add_post("/{index}/{type}/{id}/_like", self.handleWrite)
+
+        async def startProducer(app):
+            app["producer"] = asyncio.ensure_future(self.produceBlocks(app))
+
+        async def stopProducer(app):
+            app["producer"].cancel()
+
+        app.on_startup.append(startProducer)
+        app.on_cleanup.append(stopProducer)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in GVA node and Cesium+ pod")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-p", "--pubkey", action="append", default=[], help="Known account")
+    parser.add_argument("-b", "--blocks", help="NDJSON file of blocks to emit, in order")
+    parser.add_argument("-i", "--interval", type=float, default=2.0, help="Seconds between blocks")
+    parser.add_argument("--history", type=int, default=0, help="Blocks generated at startup")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds before answering a query")
+    parser.add_argument("--slow", type=float, default=0, help="Fraction of queries answered after --slow-delay")
+    parser.add_argument("--slow-delay", type=float, default=2.0, help="Seconds before answering a slow query")
+    args = parser.parse_args()
+
+    blocks = []
+    if args.blocks:
+        with open(args.blocks, "r") as f:
+            blocks = [json.loads(line) for line in f if line.strip()]
+
+    standIn = GvaStandIn(
+        args.pubkey,
+        blocks,
+        args.interval,
+        history=args.history,
+        latency=args.latency,
+        slow=args.slow,
+        slowDelay=args.slow_delay,
+    )
+    sys.stderr.write(
+        "GVA stand-in on http://{0}:{1}/gva, Cesium+ pod on http://{0}:{1}\n".format(
+            args.host, args.port
+        )
+    )
+    web.run_app(standIn.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
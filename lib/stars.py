@@ -1,38 +1,52 @@
-import os, sys, ast, requests, json, base58, base64, time, string, random, re
+import os, sys, ast, json, base58, base64, time, string, random, re
 from lib.natools import fmt, sign, get_privkey, box_decrypt, box_encrypt
 from time import sleep
 from hashlib import sha256
 from datetime import datetime
 from termcolor import colored
 from lib.cesiumCommon import CesiumCommon, PUBKEY_REGEX
+from lib.hedge import readPost
+from lib import resilience, esQuery, jsonCodec
+from lib.profileCache import profileCache, FIELDS
+from lib.gvaIdentities import Identities
+
+# Liker profiles fetched by one _mget request
+PROFILES_CHUNK = 500
 
 class ReadLikes(CesiumCommon):
     # Configure JSON document to send
-    def configDoc(self, profile):
-        if not profile: profile = self.pubkey
+    def likeFilters(self, profile):
+        return [('index', 'user'), ('type', 'profile'), ('id', profile or self.pubkey), ('kind', 'STAR')]
+
+    def configDoc(self, profile, issuer=None):
+        filters = self.likeFilters(profile)
+        if issuer:
+            # Only the like of this issuer, without the score
+            data = esQuery.search(esQuery.filtered(*filters, ('issuer', issuer)), 1, ['issuer','level'])
+        else:
+            data = esQuery.search(
+                esQuery.filtered(*filters),
+                5000,
+                ['issuer','level'],
+                aggs={'level_sum': {'sum': {'field': 'level'}}},
+            )
 
-        data = {}
-        data['query'] = {}
-        data['query']['bool'] = {}
-        data['query']['bool']['filter'] = [
-            {'term': {'index': 'user'}},
-            {'term': {'type': 'profile'}},
-            {'term': {'id': profile}},
-            {'term': {'kind': 'STAR'}}
-        ]
-        # data['query']['bool']['should'] = {'term':{'issuer': self.issuer}}
-        data['size'] = 5000
-        data['_source'] = ['issuer','level']
-        data['aggs'] = {
-            'level_sum': {
-                'sum': {
-                    'field': 'level'
-                }
-            }
-        }
+        return json.dumps(data)
 
+    # Number of likes and sum of their levels, without any like
+    def configDocScore(self, profile):
+        data = esQuery.search(
+            esQuery.filtered(*self.likeFilters(profile)),
+            0,
+            aggs={'level_sum': {'sum': {'field': 'level'}}},
+        )
         return json.dumps(data)
 
+    def parseScore(self, result):
+        totalLikes = result['hits']['total']
+        totalValue = result['aggregations']['level_sum']['value']
+        return { 'count' : totalLikes, 'score' : totalValue/totalLikes if totalLikes else 0 }
+
     def sendDocument(self, document):
 
         headers = {
@@ -40,7 +54,7 @@ class ReadLikes(CesiumCommon):
         }
 
         # Send JSON document and get JSON result
-        result = requests.post('{0}/like/record/_search'.format(self.pod), headers=headers, data=document)
+        result = readPost(self.pod, esQuery.searchPath(esQuery.LIKES, esQuery.SCORED_HITS), headers=headers, data=document)
 
         if result.status_code == 200:
             # print(result.text)
@@ -49,20 +63,26 @@ class ReadLikes(CesiumCommon):
             sys.stderr.write("Echec de l'envoi du document de lecture des messages...\n" + result.text + '\n')
 
     def parseResult(self, result):
-        result = json.loads(result)
+        return jsonCodec.dumps(self.parseLikes(jsonCodec.loads(result)))
+
+    def parseLikes(self, result, profiles=None, usernames=None):
         totalLikes = result['hits']['total']
         totalValue = result['aggregations']['level_sum']['value']
         if totalLikes:
             score = totalValue/totalLikes
         else:
             score = 0
-        raw = result['hits']['hits']
+        raw = esQuery.hits(result)
+        if profiles is None:
+            profiles = self.getProfiles([i['_source']['issuer'] for i in raw])
+        if usernames is None:
+            usernames = self.usernames([i['_source']['issuer'] for i in raw])
         finalPrint = {}
         finalPrint['likes'] = []
         for i in raw:
             issuer = i['_source']['issuer']
             # print(issuer)
-            gProfile = self.getProfile(issuer)
+            gProfile = profiles.get(issuer)
             try:
                 pseudo = gProfile['title']
             except:
@@ -76,32 +96,71 @@ class ReadLikes(CesiumCommon):
             if issuer == self.pubkey:
                 finalPrint['yours'] = { 'id' : id, 'pseudo' : pseudo, 'payTo' : payTo, 'level' : level }
             else:
-                finalPrint['likes'].append({ 'issuer' : issuer, 'pseudo' : pseudo, 'payTo' : payTo, 'level' : level })
+                like = { 'issuer' : issuer, 'pseudo' : pseudo, 'payTo' : payTo, 'level' : level }
+                if issuer in usernames:
+                    like['username'] = usernames[issuer]
+                finalPrint['likes'].append(like)
         finalPrint['score'] = score
 
-        return json.dumps(finalPrint)
+        return finalPrint
 
-    def getProfile(self, profile):
+    def usernames(self, issuers):
+        # Usernames of the likers, in one request to the GVA node
+        if not self.node or not issuers:
+            return {}
+        return Identities(self.node).usernames(issuers)
+
+    def configDocProfile(self, profile):
+        data = esQuery.search(esQuery.filtered(('_id', profile)), 1, FIELDS)
+
+        return json.dumps(data)
+
+    def getProfiles(self, issuers):
+        # Profiles of the likers by pubkey, the cached ones first, the others
+        # fetched once by chunks of one _mget request
         headers = {
             'Content-type': 'application/json',
         }
+        path = esQuery.searchPath(esQuery.PROFILES_MGET, esQuery.DOCS, _source=','.join(FIELDS))
+
+        cached, issuers = profileCache.getMany(self.pod, issuers)
+        profiles = { issuer : profile for issuer, profile in cached.items() if profile }
+        fetched = {}
+        for start in range(0, len(issuers), PROFILES_CHUNK):
+            ids = issuers[start:start + PROFILES_CHUNK]
+            result = readPost(self.pod, path, headers=headers, data=json.dumps({'ids': ids}))
+            if result.status_code != 200:
+                sys.stderr.write("Echec de la lecture des profils...\n" + result.text + '\n')
+                continue
+            # Pubkeys without profile are cached as such
+            fetched.update(dict.fromkeys(ids))
+            fetched.update(self.parseProfiles(jsonCodec.loads(result.content)))
+        if fetched:
+            profileCache.putMany(self.pod, fetched)
+        profiles.update({ issuer : profile for issuer, profile in fetched.items() if profile })
+        return profiles
+
+    def parseProfiles(self, result):
+        return { doc['_id'] : doc['_source'] for doc in result.get('docs', []) if '_source' in doc }
 
-        data = {}
-        data['query'] = {}
-        data['query']['bool'] = {}
-        data['query']['bool']['filter'] = [
-            {'term': {'_index': 'user'}},
-            {'term': {'_type': 'profile'}},
-            {'term': {'_id': profile}}
-        ]
-        data['_source'] = ['title','pubkey']
+    def getProfile(self, profile):
+        cached, found = profileCache.get(self.pod, profile)
+        if found:
+            return cached
 
-        data = json.dumps(data)
+        headers = {
+            'Content-type': 'application/json',
+        }
 
-        result = requests.post('{0}/user/profile/_search'.format(self.pod), headers=headers, data=data)
-        result = json.loads(result.text)['hits']['hits']
-        for i in result:
-            return i['_source']
+        data = self.configDocProfile(profile)
+
+        result = readPost(self.pod, esQuery.searchPath(esQuery.USER_PROFILES, esQuery.FIRST_HITS), headers=headers, data=data)
+        if result.status_code != 200:
+            return
+        result = esQuery.hits(jsonCodec.loads(result.content))
+        source = result[0]['_source'] if result else None
+        profileCache.put(self.pod, profile, source)
+        return source
 
 
 #################### Like class ####################
@@ -152,14 +211,19 @@ class SendLikes(CesiumCommon):
             'Content-type': 'application/json',
         }
 
+        queued = self.queue('/user/profile/:id/_like', document)
+        if queued:
+            print(colored(queued, 'yellow'))
+            return
+
         # Send JSON document and get JSON result
-        result = requests.post('{0}/user/profile/:id/_like'.format(self.pod), headers=headers, data=document)
+        result = resilience.post(self.pod, '/user/profile/:id/_like', headers=headers, data=document)
 
         if result.status_code == 200:
             print(colored("Profile liké avec succès !", 'green'))
             return result.text
         elif result.status_code == 400:
-            resultJson = json.loads(result.text)
+            resultJson = jsonCodec.loads(result.content)
             if 'DuplicatedDocumentException' in resultJson['error']:
                 rmLike = UnLikes(self.dunikey, self.pod)
                 idLike = rmLike.checkLike(pubkey)
@@ -172,7 +236,7 @@ class SendLikes(CesiumCommon):
             else:
                 sys.stderr.write("Echec de l'envoi du document de lecture des messages...\n" + resultJson['error'] + '\n')
         else:
-            resultJson = json.loads(result.text)
+            resultJson = jsonCodec.loads(result.content)
             sys.stderr.write("Echec de l'envoi du document de lecture des messages...\n" + resultJson['error'] + '\n')
 
 
@@ -183,13 +247,12 @@ class UnLikes(CesiumCommon):
     # Check if you liked this profile
     def checkLike(self, pubkey):
         readProfileLikes = ReadLikes(self.dunikey, self.pod)
-        document = readProfileLikes.configDoc(pubkey)
+        document = readProfileLikes.configDoc(pubkey, self.pubkey)
         result = readProfileLikes.sendDocument(document)
-        result = readProfileLikes.parseResult(result)
-        result = json.loads(result)
+        result = esQuery.hits(jsonCodec.loads(result)) if result else []
 
-        if 'yours' in result:
-            myLike = result['yours']['id']
+        if result:
+            myLike = result[0]['_id']
             return myLike
         else:
             sys.stderr.write("Vous n'avez pas liké ce profile\n")
@@ -232,7 +295,7 @@ class UnLikes(CesiumCommon):
         }
 
         # Send JSON document and get JSON result
-        result = requests.post('{0}/history/delete'.format(self.pod), headers=headers, data=document)
+        result = resilience.post(self.pod, '/history/delete', headers=headers, data=document)
 
         if result.status_code == 200:
             if not silent:
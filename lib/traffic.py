@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Record of the Cesium+ and GVA exchanges of jaklis, and a local stand-in
+# serving them back:
+#   ./jaklis.py --record /tmp/trace read -n 50
+#   ./jaklis.py --replay /tmp/trace read -n 50
+#   python3 -m lib.traffic /tmp/trace --port 8766 --latencies
+
+import os, sys, json, time, asyncio, argparse, threading
+from collections import deque
+from urllib.parse import urlsplit
+from aiohttp import web
+from graphql import print_ast
+
+EXCHANGES_FILE = "exchanges.ndjson"
+
+_recorder = None
+
+
+class Recorder:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(os.path.join(directory, EXCHANGES_FILE), "a")
+        self.lock = threading.Lock()
+
+    def write(self, exchange):
+        with self.lock:
+            self.file.write(json.dumps(exchange) + "\n")
+            self.file.flush()
+
+
+def startRecording(directory):
+    global _recorder
+    _recorder = Recorder(directory)
+
+
+def recording():
+    return _recorder is not None
+
+
+def recordHttp(method, url, body, status, response, elapsed):
+    if not _recorder:
+        return
+    _recorder.write(
+        {
+            "method": method,
+            "url": url,
+            "body": body,
+            "status": status,
+            "response": response,
+            "elapsed": round(elapsed, 4),
+            "time": time.time(),
+        }
+    )
+
+
+def recordGraphql(url, document, variables, response, elapsed, status=200):
+    # Stored as the HTTP exchange the GraphQL client had with the node
+    if not _recorder:
+        return
+    document = getattr(document, "document", document)
+    body = json.dumps({"query": print_ast(document), "variables": variables or {}})
+    recordHttp("POST", url, body, status, json.dumps(response), elapsed)
+
+
+def exchangeKey(method, url, body):
+    # Same key for the same request whatever the host, the JSON formatting
+    # or the layout of a GraphQL query. GraphQL requests are matched whatever
+    # the path of the node.
+    parts = urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        return method, path, body
+    if isinstance(payload, dict) and isinstance(payload.get("query"), str):
+        payload = {
+            "query": " ".join(payload["query"].split()),
+            "variables": payload.get("variables") or {},
+        }
+        path = "graphql"
+    return method, path, json.dumps(payload, sort_keys=True)
+
+
+class ReplayServer:
+    def __init__(self, directory, latencies=False):
+        self.latencies = latencies
+        # Exchanges by request, served in their recorded order, the last one
+        # answering every further identical request
+        self.exchanges = {}
+        with open(os.path.join(directory, EXCHANGES_FILE), "r") as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    key = exchangeKey(exchange["method"], exchange["url"], exchange["body"])
+                    self.exchanges.setdefault(key, deque()).append(exchange)
+
+    async def handle(self, request):
+        body = await request.text()
+        key = exchangeKey(request.method, str(request.rel_url), body)
+        exchanges = self.exchanges.get(key)
+        if not exchanges:
+            sys.stderr.write("Not recorded: {0} {1}\n".format(request.method, request.rel_url))
+            return web.json_response({"error": "Request not recorded"}, status=404)
+        exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+        if self.latencies:
+            await asyncio.sleep(exchange["elapsed"])
+        if not exchange["status"]:
+            # The original request failed without an answer
+            return web.json_response({"error": exchange["response"]}, status=502)
+        return web.Response(
+            text=exchange["response"], status=exchange["status"], content_type="application/json"
+        )
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024**2)
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        return app
+
+
+def startReplay(directory, latencies=False):
+    # Replay server on a free local port, in a background thread
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(ReplayServer(directory, latencies).app())
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return "http://127.0.0.1:{0}".format(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded jaklis exchanges")
+    parser.add_argument("directory", help="Directory given to --record")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latencies", action="store_true", help="Answer with the recorded latencies")
+    args = parser.parse_args()
+
+    server = ReplayServer(args.directory, args.latencies)
+    sys.stderr.write("Replay on http://{0}:{1}\n".format(args.host, args.port))
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
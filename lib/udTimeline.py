@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import sys, time
+from bisect import bisect_right
+from gql import gql
+from lib.gvaClient import gvaClient
+from lib.localCache import cachePath, loadJson, saveJson
+
+# The UD amount only changes at revaluations, checking twice a day is plenty
+REFRESH_DELAY = 12 * 3600
+
+
+class UdTimeline:
+    def __init__(self, node, path=None):
+        self.node = node
+        self.path = path or cachePath("udTimeline.json")
+        self.checked = 0
+        # Sorted (medianTime, blockNumber, amount, base) of every UD revaluation
+        self.entries = []
+        self.times = []
+        self.load()
+
+    def load(self):
+        cache = loadJson(self.path)
+        if not cache or cache.get("node") != self.node:
+            return
+        self.checked = cache["checked"]
+        self.entries = [tuple(entry) for entry in cache["entries"]]
+        self.times = [entry[0] for entry in self.entries]
+
+    def save(self):
+        saveJson(self.path, {"node": self.node, "checked": self.checked, "entries": self.entries})
+
+    def update(self, force=False):
+        if not force and self.entries and time.time() - self.checked < REFRESH_DELAY:
+            return
+
+        client = gvaClient(self.node)
+        try:
+            revals = client.execute(gql("query { udsReval { amount base blockNumber } }"))
+            known = {entry[1] for entry in self.entries}
+            new = [reval for reval in revals["udsReval"] if reval["blockNumber"] not in known]
+
+            # Only the new revaluations need their block time
+            if new:
+                fields = "\n".join(
+                    "b{0}: block(number: {0}) {{ medianTime }}".format(reval["blockNumber"])
+                    for reval in new
+                )
+                blocks = client.execute(gql("query {{ {0} }}".format(fields)))
+                for reval in new:
+                    self.entries.append(
+                        (
+                            blocks["b{0}".format(reval["blockNumber"])]["medianTime"],
+                            reval["blockNumber"],
+                            reval["amount"],
+                            reval["base"],
+                        )
+                    )
+        except Exception as e:
+            # Callers fall back to the current UD when the timeline is empty
+            sys.stderr.write("Failed to update the UD timeline:\n" + str(e) + "\n")
+            return
+
+        self.entries.sort()
+        self.times = [entry[0] for entry in self.entries]
+        self.checked = int(time.time())
+        self.save()
+
+    def at(self, timestamp):
+        # (amount, base) of the UD in force at timestamp
+        i = bisect_right(self.times, timestamp)
+        entry = self.entries[i - 1] if i else self.entries[0]
+        return entry[2], entry[3]
+
+    def toUD(self, amount, timestamp, base=0):
+        # Convert an amount in cents of the given base into UD of its own date
+        udAmount, udBase = self.at(timestamp)
+        return amount * pow(10, base) / (udAmount * pow(10, udBase))